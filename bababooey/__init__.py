@@ -4,6 +4,9 @@ from .sound_effect_data import SoundEffectData
 from .str_time_converters import millis_to_str, str_to_millis
 from .voice_helpers import VoiceClientManager
 from .history import UserSoundEffectHistory
+from .game_records import GameRecords
+from .members import MemberInfo, MemberResolver
+from .playback_events import PlaybackEvent, PlaybackEventBus
 
 # Depend on history, and voice_client_manager
 from .sound_effect import SoundEffect
@@ -0,0 +1,325 @@
+"""Batch creation of sound effects from local audio files.
+
+Entries come from either a directory of audio files or a CSV/JSON manifest.
+They are validated against the catalog up front, then the slow ffmpeg work
+(probing, loudness normalization and waveform rendering) goes through the
+subprocess scheduler at background priority, so it never crowds out
+playback. Everything that made it through is committed to the catalog
+in a single write.
+"""
+from collections.abc import Sequence
+import asyncio
+import csv
+import dataclasses
+import datetime
+import hashlib
+import json
+import logging
+import math
+import os
+import pathlib
+import re
+import subprocess
+
+from bababooey import Catalog, SoundEffect, SoundEffectData, str_to_millis
+from bababooey.subprocess_scheduler import JobResult, Priority, scheduler
+from bababooey.sound_effect_data import MAX_SOUND_EFFECT_NAME_LENGTH, MIN_SOUND_EFFECT_NAME_LENGTH
+
+_log = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = {'.mp3', '.ogg', '.opus', '.wav', '.flac', '.m4a', '.webm'}
+IMPORTED_DIR = 'data/imported'
+WAVEFORM_DIR = 'data/waveforms'
+PROCESS_TIMEOUT_SECONDS = 120
+
+
+@dataclasses.dataclass
+class ImportEntry:
+    name: str
+    emoji: str
+    source: str
+    start_millis: int = 0
+    end_millis: int | None = None
+    tags: str = ''
+    # Where the audio originally came from, defaults to source.
+    url: str | None = None
+
+
+@dataclasses.dataclass
+class ProcessedClip:
+    entry: ImportEntry
+    file_path: str
+    duration_millis: int
+    waveform_path: str | None
+
+
+@dataclasses.dataclass
+class ImportReport:
+    created: list[SoundEffect] = dataclasses.field(default_factory=list)
+    # (entry name, reason) for everything that was skipped.
+    errors: list[tuple[str, str]] = dataclasses.field(default_factory=list)
+
+    def summary(self) -> str:
+        lines = [f'Created {len(self.created)} sound effects.']
+        if self.created:
+            lines.append(' '.join(
+                f'{sfx.emoji} {sfx.name}' for sfx in self.created))
+        if self.errors:
+            lines.append(f'Skipped {len(self.errors)}:')
+            lines.extend(f'- `{name}`: {reason}' for name, reason in self.errors)
+        return '\n'.join(lines)
+
+
+def _optional_millis(raw: str | int | float | None) -> int | None:
+    """Reads seconds, either a number or a string like "1:05.5"."""
+    if raw is None or raw == '':
+        return None
+    # bool is an int, but never a time.
+    if isinstance(raw, (int, float)) and not isinstance(raw, bool):
+        if not math.isfinite(raw) or raw < 0:
+            raise ValueError(f'Expected a time in seconds, got {raw!r}')
+        return round(raw * 1000)
+    if isinstance(raw, str):
+        return str_to_millis(raw.strip())
+    raise ValueError(f'Expected a time in seconds, got {raw!r}')
+
+
+def _entry_from_row(row: dict, base_dir: str) -> ImportEntry:
+    if not isinstance(row, dict):
+        raise ValueError(f'Each entry must be an object, got {row!r}')
+    for field in ('name', 'emoji', 'source'):
+        if not isinstance(row.get(field), str):
+            raise ValueError(f'Each entry needs {field} as a string, got '
+                             f'{row!r}')
+    for field in ('tags', 'url'):
+        if row.get(field) is not None and not isinstance(row[field], str):
+            raise ValueError(f'{field} must be a string, got {row!r}')
+    source = row['source']
+    if not os.path.isabs(source):
+        source = os.path.join(base_dir, source)
+    return ImportEntry(name=row['name'],
+                       emoji=row['emoji'],
+                       source=source,
+                       start_millis=_optional_millis(row.get('start')) or 0,
+                       end_millis=_optional_millis(row.get('end')),
+                       tags=row.get('tags') or f'{row["name"]},',
+                       url=row.get('url') or None)
+
+
+def read_manifest(path: str, base_dir: str | None = None) -> list[ImportEntry]:
+    """Reads a .json (list of objects) or .csv (with a header) manifest.
+
+    Each entry has name, emoji and source, and optionally start, end, tags
+    and url. Start and end are seconds, as numbers or like "1:05.5".
+    Relative sources are relative to base_dir, which defaults to
+    the manifest's directory.
+
+    Raises a ValueError if the manifest isn't shaped like that.
+    """
+    if base_dir is None:
+        base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, newline='') as f:
+        if path.endswith('.json'):
+            rows = json.load(f)
+            if not isinstance(rows, list):
+                raise ValueError('A .json manifest must be a list of entries.')
+        else:
+            try:
+                rows = list(csv.DictReader(f))
+            except csv.Error as e:
+                raise ValueError(f'Not a valid CSV manifest: {e}') from e
+    return [_entry_from_row(row, base_dir) for row in rows]
+
+
+def entries_from_directory(path: str) -> list[ImportEntry]:
+    """Makes an entry for each audio file named like "<emoji> <name>.mp3"."""
+    entries = []
+    for file in sorted(pathlib.Path(path).iterdir()):
+        if file.suffix.lower() not in AUDIO_EXTENSIONS:
+            continue
+        emoji, _, name = file.stem.partition(' ')
+        entries.append(
+            ImportEntry(name=name, emoji=emoji, source=str(file),
+                        tags=f'{name},'))
+    return entries
+
+
+def _is_inside(path: str, directory: str) -> bool:
+    # Resolving both first means neither .. nor symlinks get out.
+    path = os.path.realpath(path)
+    directory = os.path.realpath(directory)
+    return os.path.commonpath([path, directory]) == directory
+
+
+def validate_entries(
+    entries: Sequence[ImportEntry],
+    catalog: Catalog,
+    allowed_dir: str | None = None,
+) -> tuple[list[ImportEntry], list[tuple[str, str]]]:
+    """Splits entries into (valid, errors) before any expensive work.
+
+    If allowed_dir is given, sources outside of it are rejected.
+    """
+    valid = []
+    errors = []
+    names = set()
+    emojis = set()
+    for entry in entries:
+        if not MIN_SOUND_EFFECT_NAME_LENGTH <= len(
+                entry.name) <= MAX_SOUND_EFFECT_NAME_LENGTH:
+            errors.append((entry.name, 'name must be between '
+                           f'{MIN_SOUND_EFFECT_NAME_LENGTH} and '
+                           f'{MAX_SOUND_EFFECT_NAME_LENGTH} characters'))
+        elif not entry.emoji:
+            errors.append((entry.name, 'missing an emoji'))
+        elif catalog.by_name(entry.name) is not None or entry.name in names:
+            errors.append((entry.name, 'name is already taken'))
+        elif catalog.by_emoji(entry.emoji) is not None or entry.emoji in emojis:
+            errors.append((entry.name, f'emoji {entry.emoji} is already taken'))
+        elif allowed_dir is not None and not _is_inside(
+                entry.source, allowed_dir):
+            errors.append(
+                (entry.name, f'source `{entry.source}` is outside the '
+                 'import directory'))
+        elif not os.path.isfile(entry.source):
+            errors.append((entry.name, f'source `{entry.source}` not found'))
+        elif entry.end_millis is not None and entry.end_millis <= entry.start_millis:
+            errors.append((entry.name, 'end must come after start'))
+        else:
+            names.add(entry.name)
+            emojis.add(entry.emoji)
+            valid.append(entry)
+    return valid, errors
+
+
+async def _run_background(argv: list[str], kind: str) -> JobResult:
+    result = await scheduler.run(argv,
+                                 priority=Priority.BACKGROUND,
+                                 kind=kind,
+                                 timeout=PROCESS_TIMEOUT_SECONDS)
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, argv,
+                                            result.stdout, result.stderr)
+    return result
+
+
+async def _probe_duration_millis(file_path: str) -> int:
+    result = await _run_background([
+        'ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of',
+        'default=noprint_wrappers=1:nokey=1', file_path
+    ], 'ffprobe')
+    return int(float(result.stdout.decode().strip()) * 1000)
+
+
+def _output_stem(entry: ImportEntry) -> str:
+    slug = re.sub(r'[^A-Za-z0-9_-]+', '_', entry.name).strip('_') or 'sfx'
+    digest = hashlib.sha1(
+        f'{entry.source}:{entry.start_millis}:{entry.end_millis}'.encode()
+    ).hexdigest()[:10]
+    return f'{slug}-{digest}'
+
+
+def waveform_path_for(file_path: str) -> str:
+    """Where the waveform of an imported clip is rendered."""
+    stem, _ = os.path.splitext(os.path.basename(file_path))
+    return os.path.join(WAVEFORM_DIR, stem + '.png')
+
+
+async def process_entry(entry: ImportEntry) -> ProcessedClip:
+    """Trims, loudness normalizes and renders a waveform for one entry."""
+    source_millis = await _probe_duration_millis(entry.source)
+    end_millis = entry.end_millis
+    if end_millis is None or end_millis > source_millis:
+        end_millis = source_millis
+
+    os.makedirs(IMPORTED_DIR, exist_ok=True)
+    file_path = os.path.join(IMPORTED_DIR, _output_stem(entry) + '.ogg')
+    await _run_background([
+        'ffmpeg', '-y', '-v', 'error', '-ss',
+        str(datetime.timedelta(milliseconds=entry.start_millis)), '-t',
+        str(datetime.timedelta(milliseconds=end_millis - entry.start_millis)),
+        '-i', entry.source, '-af', 'loudnorm', '-c:a', 'libopus', file_path
+    ], 'ffmpeg_import')
+
+    os.makedirs(WAVEFORM_DIR, exist_ok=True)
+    waveform_path = waveform_path_for(file_path)
+    try:
+        await _run_background([
+            'ffmpeg', '-y', '-v', 'error', '-i', file_path, '-filter_complex',
+            'compand, showwavespic=colors=#5865F2', '-frames:v', '1',
+            waveform_path
+        ], 'ffmpeg_waveform')
+    except (subprocess.CalledProcessError, TimeoutError):
+        # Nice to have, not worth failing the import over.
+        waveform_path = None
+
+    duration_millis = await _probe_duration_millis(file_path)
+    return ProcessedClip(entry=entry,
+                         file_path=file_path,
+                         duration_millis=duration_millis,
+                         waveform_path=waveform_path)
+
+
+def _describe_failure(e: Exception) -> str:
+    if isinstance(e, subprocess.CalledProcessError):
+        stderr = e.stderr.decode(errors='replace') if isinstance(
+            e.stderr, bytes) else (e.stderr or '')
+        return f'{e.cmd[0]} failed: {stderr.strip()[-200:]}'
+    return f'{type(e).__name__}: {e}'
+
+
+async def run_import(entries: Sequence[ImportEntry],
+                     catalog: Catalog,
+                     *,
+                     author: int,
+                     guild: int,
+                     max_workers: int | None = None,
+                     allowed_dir: str | None = None) -> ImportReport:
+    """Validates, processes and saves entries.
+
+    All the sound effects that processed successfully are created together,
+    so the caller only needs to redraw the soundboard once. Sources outside
+    allowed_dir, when given, are skipped.
+    """
+    report = ImportReport()
+    valid, report.errors = validate_entries(entries, catalog, allowed_dir)
+    if not valid:
+        return report
+
+    if max_workers is None:
+        # Leave the slots playback and previews are guaranteed free.
+        max_workers = max(
+            1, scheduler.max_concurrent - scheduler.reserved_for_playback - 1)
+    # The scheduler already limits how many run, this keeps a big import
+    # from queueing all its jobs ahead of other background work.
+    in_flight = asyncio.Semaphore(max_workers)
+
+    async def process(entry: ImportEntry) -> ProcessedClip:
+        async with in_flight:
+            return await process_entry(entry)
+
+    results = await asyncio.gather(*[process(e) for e in valid],
+                                   return_exceptions=True)
+
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    to_create = []
+    for entry, result in zip(valid, results):
+        if isinstance(result, Exception):
+            _log.warning('Failed to import %s', entry.name, exc_info=result)
+            report.errors.append((entry.name, _describe_failure(result)))
+            continue
+        to_create.append(
+            SoundEffectData(num=-1,
+                            name=entry.name,
+                            emoji=entry.emoji,
+                            yt_url=entry.url or entry.source,
+                            file_path=result.file_path,
+                            author=author,
+                            guild=guild,
+                            created_at=now,
+                            start_millis=0,
+                            end_millis=result.duration_millis,
+                            tags=entry.tags))
+    if to_create:
+        report.created = catalog.create_new_sfx_batch(to_create)
+    return report
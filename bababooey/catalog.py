@@ -3,13 +3,27 @@
 This module and the corresponding class represents the disk storage of
 SoundEffect objects.
 """
-from collections.abc import Sequence
+from collections.abc import Callable, Sequence
+import asyncio
+import dataclasses
 import datetime
+import heapq
+import logging
 import shelve
 
 import discord
 
-from bababooey import UserSoundEffectHistory, SoundEffect, SoundEffectData, VoiceClientManager
+from bababooey import PlaybackEventBus, UserSoundEffectHistory, SoundEffect, SoundEffectData, VoiceClientManager
+from bababooey.catalog_snapshot import read_snapshot, source_signature, write_snapshot
+from bababooey.downloads import read_audio_length
+
+_log = logging.getLogger(__name__)
+
+SFX_DATA_PATH = 'data/sfx_data'
+
+# Called with (before, after) when a sound effect is edited, after is None
+# when it was deleted.
+ChangeListener = Callable[[SoundEffectData, SoundEffectData | None], None]
 
 
 def _score_sound_effect_name_matches(partial: str, sfx_name: str) -> int:
@@ -36,57 +50,209 @@ class Catalog:
     def __init__(self, voice_client_manager: VoiceClientManager):
         self._voice_client_manager = voice_client_manager
         self._history = UserSoundEffectHistory()
+        self.playback_events = PlaybackEventBus()
         self._all = self._read_sfx_data()
         self._by_name = {sfx.name: sfx for sfx in self._all}
         self._by_num = {sfx.num: sfx for sfx in self._all}
+        self._by_emoji = {sfx.emoji: sfx for sfx in self._all}
+        self._change_listeners: list[ChangeListener] = []
 
     def all(self) -> Sequence[SoundEffect]:
         return list(self._all)
 
     def _read_sfx_data(self) -> list[SoundEffect]:
-        s = shelve.open('data/sfx_data')
-        effects = [
-            SoundEffect(raw, self._history, self._voice_client_manager)
-            for raw in s['data']
+        raws = read_snapshot(source_signature(SFX_DATA_PATH))
+        if raws is None:
+            _log.info('Catalog snapshot is missing or stale, reading the shelve')
+            s = shelve.open(SFX_DATA_PATH, flag='r')
+            raws = s['data']
+            s.close()
+            self._write_snapshot(raws)
+        return [
+            SoundEffect(raw, self._history, self._voice_client_manager,
+                        self.playback_events)
+            for raw in raws
         ]
-        s.close()
-        return effects
 
-    def create_new_sfx(self, sfx_data: SoundEffectData) -> SoundEffect:
-        next_num = self._all[-1].num + 1
-        sfx_data.num = next_num
+    def _write_snapshot(self, raws: Sequence[SoundEffectData]) -> None:
+        try:
+            write_snapshot(raws, source_signature(SFX_DATA_PATH))
+        except OSError:
+            # Not fatal, the next start just reads the shelve again.
+            _log.exception('Failed to write the catalog snapshot')
+
+    def _check_unique(self, sfx_data: SoundEffectData) -> None:
         if sfx_data.name in self._by_name:
             raise ValueError(
                 f'Cannot create a sound effect with duplicate name "{sfx_data.name}"'
             )
-        if any([sfx.emoji == sfx_data.emoji for sfx in self._all]):
+        if sfx_data.emoji in self._by_emoji:
             raise ValueError(
                 f'Cannot create a sound effect with duplicate emoji "{sfx_data.emoji}"'
             )
-        s = shelve.open('data/sfx_data')
+
+    def add_change_listener(self, listener: ChangeListener) -> None:
+        """For things derived from a sound effect that an edit makes stale."""
+        self._change_listeners.append(listener)
+
+    def _notify_change(self, before: SoundEffectData,
+                       after: SoundEffectData | None) -> None:
+        for listener in self._change_listeners:
+            try:
+                listener(before, after)
+            except Exception:
+                _log.exception('Change listener failed for %s', before.name)
+
+    def _rewrite_shelve(
+            self, change: Callable[[list[SoundEffectData]], None]) -> None:
+        s = shelve.open(SFX_DATA_PATH)
         all_raw = s['data']
-        all_raw.append(sfx_data)
+        if all_raw:
+            # In case the change deletes the highest num.
+            s['next_num'] = max(s.get('next_num', 0), all_raw[-1].num + 1)
+        change(all_raw)
         s['data'] = all_raw
         s.close()
-        sfx = SoundEffect(sfx_data,
-                          history=self._history,
-                          voice_client_manager=self._voice_client_manager)
+        self._write_snapshot(all_raw)
+
+    def _add_to_indexes(self, sfx: SoundEffect) -> None:
         self._all.append(sfx)
         self._by_name[sfx.name] = sfx
         self._by_num[sfx.num] = sfx
+        self._by_emoji[sfx.emoji] = sfx
+
+    def create_new_sfx(self, sfx_data: SoundEffectData) -> SoundEffect:
+        return self.create_new_sfx_batch([sfx_data])[0]
+
+    def create_new_sfx_batch(
+            self, sfx_data_list: Sequence[SoundEffectData]) -> list[SoundEffect]:
+        """Creates all the sound effects, committing them in one write.
+
+        Either every sound effect is created or none are.
+        """
+        names = set()
+        emojis = set()
+        for sfx_data in sfx_data_list:
+            self._check_unique(sfx_data)
+            if sfx_data.name in names or sfx_data.emoji in emojis:
+                raise ValueError(
+                    f'Sound effect "{sfx_data.emoji} {sfx_data.name}" is '
+                    'duplicated within the batch')
+            names.add(sfx_data.name)
+            emojis.add(sfx_data.emoji)
+
+        s = shelve.open(SFX_DATA_PATH)
+        # Deleted nums are never reused, history and soundboards still
+        # refer to them.
+        next_num = max(s.get('next_num', 0),
+                       self._all[-1].num + 1 if self._all else 0)
+        for i, sfx_data in enumerate(sfx_data_list):
+            sfx_data.num = next_num + i
+        all_raw = s['data']
+        all_raw.extend(sfx_data_list)
+        s['data'] = all_raw
+        s['next_num'] = next_num + len(sfx_data_list)
+        s.close()
+        self._write_snapshot(all_raw)
+
+        created = []
+        for sfx_data in sfx_data_list:
+            sfx = SoundEffect(sfx_data,
+                              history=self._history,
+                              voice_client_manager=self._voice_client_manager,
+                              playback_events=self.playback_events)
+            self._add_to_indexes(sfx)
+            created.append(sfx)
+        return created
+
+    def _existing(self, num: int) -> SoundEffect:
+        sfx = self._by_num.get(num)
+        if sfx is None:
+            raise ValueError(f'There is no sound effect number {num}')
         return sfx
 
-    def find_partial_matches(self,
-                             partial_sound_name: str) -> Sequence[SoundEffect]:
-        """Return all matches to a partial sound effect name."""
+    def update(self, num: int, /, **changes) -> SoundEffect:
+        """Changes some of a sound effect's fields, e.g. name or end_millis.
+
+        The SoundEffect is updated in place, so anything holding it sees the
+        change. Raises a ValueError if it doesn't exist or the new name or
+        emoji is taken.
+        """
+        if 'num' in changes:
+            raise ValueError('A sound effect\'s number can\'t change')
+        sfx = self._existing(num)
+        before = sfx.data
+        after = dataclasses.replace(before, **changes)
+        for index, key, field in ((self._by_name, after.name, 'name'),
+                                  (self._by_emoji, after.emoji, 'emoji')):
+            if index.get(key, sfx) is not sfx:
+                raise ValueError(
+                    f'Another sound effect already has the {field} "{key}"')
+
+        def replace(all_raw: list[SoundEffectData]) -> None:
+            for i, raw in enumerate(all_raw):
+                if raw.num == num:
+                    all_raw[i] = after
+                    return
+
+        self._rewrite_shelve(replace)
+        sfx.replace_data(after)
+        if after.name != before.name:
+            del self._by_name[before.name]
+            self._by_name[after.name] = sfx
+        if after.emoji != before.emoji:
+            del self._by_emoji[before.emoji]
+            self._by_emoji[after.emoji] = sfx
+        self._notify_change(before, after)
+        return sfx
+
+    def delete(self, num: int) -> SoundEffect:
+        """Removes a sound effect, raises a ValueError if it doesn't exist.
+
+        Its audio file is left alone.
+        """
+        sfx = self._existing(num)
+        before = sfx.data
+
+        def remove(all_raw: list[SoundEffectData]) -> None:
+            all_raw[:] = [raw for raw in all_raw if raw.num != num]
+
+        self._rewrite_shelve(remove)
+        self._all.remove(sfx)
+        del self._by_num[num]
+        del self._by_name[before.name]
+        del self._by_emoji[before.emoji]
+        self._notify_change(before, None)
+        return sfx
+
+    def find_partial_matches(
+        self,
+        partial_sound_name: str,
+        limit: int | None = None,
+        boost: Callable[[SoundEffect], float] | None = None
+    ) -> Sequence[SoundEffect]:
+        """Return matches to a partial sound effect name, best first.
+
+        boost(sfx) is taken off the match score, where 1 is worth moving the
+        match one character further along the name. With a limit, only the
+        best ones are kept, in a heap, rather than sorting every match.
+        """
         partial_sound_lower = partial_sound_name.lower()
         res = []
         for sfx in self._all:
             if partial_sound_lower in sfx.name.lower():
                 res.append(sfx)
 
-        res.sort(key=lambda sfx: _score_sound_effect_name_matches(
-            partial_sound_name, sfx.name))
+        def score(sfx: SoundEffect) -> float:
+            match = _score_sound_effect_name_matches(partial_sound_name,
+                                                     sfx.name)
+            if boost is None:
+                return match
+            return match - boost(sfx)
+
+        if limit is not None:
+            return heapq.nsmallest(limit, res, key=score)
+        res.sort(key=score)
         return res
 
     def by_name(self, name: str) -> SoundEffect | None:
@@ -104,20 +270,76 @@ class Catalog:
     def by_num(self, num: int) -> SoundEffect | None:
         return self._by_num.get(num, None)
 
+    def by_emoji(self, emoji: str) -> SoundEffect | None:
+        return self._by_emoji.get(emoji, None)
+
     def users_most_recent(self, user: discord.Member,
                           limit: int) -> Sequence[SoundEffect]:
         """Returns user's recent sound effects in order of recency."""
+        # Deleted sound effects may still be in the history.
+        return [
+            sfx for sfx_num in self._history.users_most_recent(user, limit)
+            if (sfx := self.by_num(sfx_num)) is not None
+        ]
+
+    async def users_most_recent_async(self, user: discord.Member,
+                                      limit: int) -> Sequence[SoundEffect]:
+        """Like users_most_recent, without blocking the event loop."""
         return [
-            self.by_num(sfx_num)
-            for sfx_num in self._history.users_most_recent(user, limit)
+            sfx for sfx_num in await self._history.users_most_recent_async(
+                user, limit) if (sfx := self.by_num(sfx_num)) is not None
         ]
 
     def all_history(
             self) -> Sequence[tuple[datetime.datetime, int, int, SoundEffect]]:
-        """Returns sequence of (datetime, user_id, guild_id, SoundEffect)."""
+        """Returns sequence of (datetime, user_id, guild_id, SoundEffect).
+
+        The SoundEffect is None for ones that have since been deleted.
+        """
         return [(dt, user_id, guild_id, self.by_num(sfx_num)) for dt, user_id,
                 guild_id, sfx_num in self._history.fetch_all_history()]
 
-    def create(self, name: str, emoji: str, youtube_url: str, file_path: str,
-               author: discord.Member) -> SoundEffect:
-        pass
+    async def recent_history_async(
+        self,
+        limit: int,
+        guild_id: int | None = None
+    ) -> Sequence[tuple[datetime.datetime, int, int, SoundEffect]]:
+        """The newest limit rows of all_history, optionally of one guild."""
+        rows = await asyncio.to_thread(self._history.fetch_recent_history,
+                                       limit, guild_id)
+        return [(dt, user_id, guild_id, self.by_num(sfx_num))
+                for dt, user_id, guild_id, sfx_num in rows]
+
+    def decayed_play_counts(
+        self, rate: float, epoch: datetime.datetime
+    ) -> Sequence[tuple[int, int, SoundEffect, float]]:
+        """(guild_id, user_id, SoundEffect, count) with plays decayed by rate.
+
+        A play at epoch counts as 1, deleted sound effects are left out.
+        """
+        return [(guild_id, user_id, sfx, count)
+                for guild_id, user_id, num, count in
+                self._history.fetch_decayed_counts(rate, epoch)
+                if (sfx := self.by_num(num)) is not None]
+
+    async def create(self, name: str, emoji: str, youtube_url: str,
+                     file_path: str, author: discord.Member) -> SoundEffect:
+        """Creates a sound effect of the whole file.
+
+        Raises a ValueError if the file's length can't be read.
+        """
+        length_millis = await read_audio_length(file_path)
+        if length_millis is None:
+            raise ValueError(f'Couldn\'t read the length of {file_path}.')
+        return self.create_new_sfx(
+            SoundEffectData(num=-1,
+                            name=name,
+                            emoji=emoji,
+                            yt_url=youtube_url,
+                            file_path=file_path,
+                            author=author.id,
+                            guild=author.guild.id,
+                            created_at=datetime.datetime.now(
+                                tz=datetime.timezone.utc),
+                            end_millis=length_millis,
+                            tags=f'{name},'))
@@ -0,0 +1,144 @@
+"""A compact, memory-mapped copy of the catalog for fast startup.
+
+The shelve at data/sfx_data stays the source of truth. Unpickling it means
+building every SoundEffectData up front, so alongside it we keep a snapshot:
+
+    MAGIC | u32 header length | header JSON | record JSON blobs...
+
+The header holds the shelve's signature (to tell when the snapshot is
+stale) and an index of (num, name, emoji, offset, length) per sound effect.
+Loading reads only the header. The blobs stay in the mapped file until a
+field other than num/name/emoji is first read from a record.
+"""
+from collections.abc import Sequence
+import dataclasses
+import datetime
+import glob
+import json
+import logging
+import mmap
+import os
+import struct
+
+from bababooey.sound_effect_data import SoundEffectData
+
+_log = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = 'data/catalog.snapshot'
+MAGIC = b'BBSNAP01'
+_HEADER_LEN = struct.Struct('<I')
+
+
+def source_signature(shelve_path: str) -> list[list]:
+    """Identifies a version of the shelve by its files' sizes and mtimes.
+
+    dbm backends split the shelve into one or more files with suffixes.
+    """
+    signature = []
+    for path in sorted(glob.glob(glob.escape(shelve_path) + '*')):
+        stat = os.stat(path)
+        signature.append([os.path.basename(path), stat.st_size,
+                          stat.st_mtime_ns])
+    return signature
+
+
+def _encode(raw: SoundEffectData) -> bytes:
+    d = dataclasses.asdict(raw)
+    d['created_at'] = raw.created_at.isoformat()
+    return json.dumps(d, ensure_ascii=False).encode()
+
+
+def _decode(blob: bytes) -> SoundEffectData:
+    d = json.loads(blob)
+    d['created_at'] = datetime.datetime.fromisoformat(d['created_at'])
+    return SoundEffectData(**d)
+
+
+class SnapshotRecord:
+    """Stands in for a SoundEffectData, decoding the rest on first use."""
+
+    __slots__ = ('num', 'name', 'emoji', '_buffer', '_offset', '_length',
+                 '_data')
+
+    def __init__(self, num: int, name: str, emoji: str, buffer: mmap.mmap,
+                 offset: int, length: int):
+        self.num = num
+        self.name = name
+        self.emoji = emoji
+        self._buffer = buffer
+        self._offset = offset
+        self._length = length
+        self._data: SoundEffectData | None = None
+
+    def load(self) -> SoundEffectData:
+        if self._data is None:
+            self._data = _decode(self._buffer[self._offset:self._offset +
+                                              self._length])
+        return self._data
+
+    def __getattr__(self, attr: str):
+        # Only called for the fields that aren't slots.
+        return getattr(self.load(), attr)
+
+
+def write_snapshot(raws: Sequence[SoundEffectData],
+                   signature: list[list],
+                   path: str = SNAPSHOT_PATH) -> None:
+    """Writes the snapshot atomically, readers never see half of one."""
+    blobs = []
+    index = []
+    offset = 0
+    for raw in raws:
+        blob = _encode(raw)
+        index.append([raw.num, raw.name, raw.emoji, offset, len(blob)])
+        blobs.append(blob)
+        offset += len(blob)
+    header = json.dumps({
+        'source': signature,
+        'index': index
+    },
+                        ensure_ascii=False).encode()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LEN.pack(len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(signature: list[list],
+                  path: str = SNAPSHOT_PATH) -> list[SnapshotRecord] | None:
+    """Returns the records, or None if there is no up to date snapshot."""
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            # The mapping stays valid after the file is closed or replaced.
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+    if buffer[0:len(MAGIC)] != MAGIC:
+        _log.warning('%s is not a catalog snapshot, ignoring it', path)
+        return None
+    start = len(MAGIC) + _HEADER_LEN.size
+    try:
+        header_len, = _HEADER_LEN.unpack_from(buffer, len(MAGIC))
+        header = json.loads(buffer[start:start + header_len])
+        if header['source'] != signature:
+            return None
+        blobs_start = start + header_len
+        records = []
+        for num, name, emoji, offset, length in header['index']:
+            if blobs_start + offset + length > len(buffer):
+                raise ValueError(f'record {num} is past the end of the file')
+            records.append(
+                SnapshotRecord(num, name, emoji, buffer, blobs_start + offset,
+                               length))
+    except (struct.error, ValueError, KeyError, TypeError) as e:
+        # Say a crash cut it short. The shelve is read instead, and the
+        # snapshot rewritten from it.
+        _log.warning('%s is corrupt, ignoring it: %r', path, e)
+        return None
+    return records
@@ -1,104 +1,115 @@
 import asyncio
 import datetime
+import io
 import logging
 import os
 import random
 import re
-import subprocess
 
 import discord
 import discord.ext.commands
-import yt_dlp as youtube_dl
 from discord import app_commands
 from racket import RacketBot
 
-from bababooey import Catalog, SoundEffectData, VoiceClientManager
+from bababooey import (
+    Catalog,
+    MemberResolver,
+    SoundEffect,
+    SoundEffectData,
+    VoiceClientManager,
+    str_to_millis,
+)
+from bababooey.bulk_import import (
+    IMPORTED_DIR,
+    read_manifest,
+    run_import,
+    waveform_path_for,
+)
+from bababooey.creation_sessions import CreationSessionRegistry
+from bababooey.ephemeral_messages import EphemeralMessageRegistry
+from bababooey.downloads import download_source, download_window, read_audio_length
+from bababooey.fingerprints import DuplicateFinder
+from bababooey.game_records import Board, GameRecords, RunnerUp
+from bababooey.history_feed import HistoryFeed
+from bababooey.playback_events import PlaybackEvent, Subscription
+from bababooey.metrics import begin_interaction, metrics, start_metrics_server
+from bababooey.pcm import PCMSliceSource, decode_pcm
+from bababooey.popularity import Popularity
+from bababooey.playback_backends import DEFAULT_BACKEND, make_backend
+from bababooey.preloader import PCMCache, PreloadingBackend, Preloader
+from bababooey.profiling import LoopLagMonitor, capture_profile, timed_command
+from bababooey.voice_helpers import describe_play_error
+from bababooey.sound_effect_data import (
+    MAX_SOUND_EFFECT_NAME_LENGTH,
+    MIN_SOUND_EFFECT_NAME_LENGTH,
+)
 from bababooey.ui import (
     SoundEffectButton,
     SoundEffectCreationManager,
+    SoundEffectDetailButtons,
+    SoundboardButton,
+    make_soundboard_page,
     make_soundboard_views,
+    page_of_message,
+    soundboard_page,
 )
+import settings
 from settings import SOUNDBOARD_CHANNELS
 
 _log = logging.getLogger(__name__)
 
+# Optional, serve Prometheus metrics on localhost at this port.
+METRICS_PORT: int | None = getattr(settings, "METRICS_PORT", None)
+# Optional, how clips are decoded for playback: ffmpeg, pyav or stub.
+PLAYBACK_BACKEND: str = getattr(settings, "PLAYBACK_BACKEND", DEFAULT_BACKEND)
+# Optional, memory for decoding the likely next sounds ahead of time, 0 is off.
+PRELOAD_MEMORY_MB: int = getattr(settings, "PRELOAD_MEMORY_MB", 64)
+# Optional, how much to download either side of /add_sound's start/end hints.
+DOWNLOAD_PADDING_SECONDS: float = getattr(settings, "DOWNLOAD_PADDING_SECONDS", 15)
+# Optional, plays shown in the live feed under each soundboard, 0 is off.
+HISTORY_FEED_SIZE: int = getattr(settings, "HISTORY_FEED_SIZE", 15)
+# Optional, the least time between edits of a live feed message.
+HISTORY_FEED_EDIT_SECONDS: float = getattr(settings, "HISTORY_FEED_EDIT_SECONDS", 3.0)
+# Optional, how long until a play counts half as much towards search ranking.
+POPULARITY_HALF_LIFE_DAYS: float = getattr(settings, "POPULARITY_HALF_LIFE_DAYS", 14)
+# Optional, the only directory /import_sounds may read sources from.
+IMPORT_SOURCE_DIR: str = getattr(settings, "IMPORT_SOURCE_DIR", "data/import")
+
 CUSTOM_EMOJI_RE = re.compile(r"<a?:.+:\d+>")
 X_MESSAGE_TTL_SECONDS = 15 * 60.0 - 5.0
+# The most popular sound ranks as if its match were this many characters
+# further forward in its name.
+POPULARITY_BOOST = 3.0
+# How long after the winner other guesses still count as runners-up.
+RUNNERS_UP_WINDOW_SECONDS = 5.0
+RUNNERS_UP_SHOWN = 3
+LEADERBOARD_SIZE = 10
 
 
-async def do_youtube_dl(url: str, loop: asyncio.BaseEventLoop) -> tuple[str, int]:
-    """Download a youtube video
-
-    We will return both the path to the downloaded video, as well as
-    the duration in seconds.
+async def _collect_runners_up(
+    guesses: Subscription, winning_play: PlaybackEvent
+) -> list[tuple[PlaybackEvent, float]]:
+    """The first few other people to play the answer after the winner.
 
-    Returns:
-        A tuple[str, int] of the absoloute path, duration_millis respectively.
+    Returns (event, seconds behind the winner) pairs.
     """
-    os.makedirs("data/youtubedl", exist_ok=True)
-
-    youtube_dl.utils.bug_reports_message = lambda: ""
-
-    ytdl_format_options = {
-        "format": "bestaudio/best",
-        # do the conversion using sox
-        #'postprocessors': [{
-        #'key': 'FFmpegExtractAudio',
-        #'preferredcodec': 'mp3',
-        #'preferredquality': '192',
-        # }],
-        "outtmpl": "data/youtubedl/%(extractor)s-%(id)s-%(title)s.%(ext)s",
-        "restrictfilenames": True,
-        "noplaylist": True,
-        "nocheckcertificate": True,
-        "ignoreerrors": False,
-        "logtostderr": False,
-        "quiet": False,
-        "no_warnings": False,
-        "default_search": "auto",
-        "source_address": "0.0.0.0",  # bind to ipv4 since ipv6 addresses cause issues sometimes
-        # Use the oauth login method to avoid bot detection.
-        "username": "oauth2",
-        "password": "",
-    }
-
-    ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
-
-    _log.info("Downloading song from youtube: %s", url)
-
-    def do_download():
-        res = ytdl.extract_info(url, download=True)
-        return res
-
-    data = ytdl.sanitize_info(await loop.run_in_executor(None, do_download))
-    if "entries" in data:
-        # take first item from a playlist
-        data = data["entries"][0]
-
-    filename = ytdl.prepare_filename(data)
-    # labeled_format = filename.rsplit('.', 1)[-1]
-    # if labeled_format not in ('mp3', 'webm', 'm4a'):
-
-    return (os.path.relpath(filename), data["duration"] * 1000)
-
-
-async def read_audio_length(file_path: str) -> int | None:
-    """Returns the length of the audio in millis."""
-    proc = await asyncio.create_subprocess_shell(
-        f'ffprobe -show_entries format=duration {file_path} | grep "duration="',
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    stdout, stderr = await proc.communicate()
-    if proc.returncode != 0:
-        _log.error("ffprobe failed. Here is the stderr: %s", stderr.decode())
-        return None
-    output = stdout.decode().strip()
-    try:
-        return int(float(output.removeprefix("duration=")) * 1000)
-    except ValueError:
-        _log.error('Failed to parse ffprobe output "%s"', output)
-        return None
+    runners_up = []
+    seen = {winning_play.user.id}
+    deadline = asyncio.get_running_loop().time() + RUNNERS_UP_WINDOW_SECONDS
+    while len(runners_up) < RUNNERS_UP_SHOWN:
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            break
+        try:
+            event = await asyncio.wait_for(guesses.get(), remaining)
+        except asyncio.TimeoutError:
+            break
+        if event.user.id in seen:
+            continue
+        seen.add(event.user.id)
+        behind = (event.timestamp - winning_play.timestamp).total_seconds()
+        runners_up.append((event, behind))
+    return runners_up
 
 
 def _unicode_safe_emoji(discord_emoji: str) -> str:
@@ -112,17 +123,99 @@ class BababooeyCog(discord.ext.commands.Cog):
 
     def __init__(self, bot: RacketBot):
         self.bot = bot
-        self.voice_client_manager = VoiceClientManager()
+        backend = make_backend(PLAYBACK_BACKEND)
+        self._preloader: Preloader | None = None
+        if PRELOAD_MEMORY_MB > 0:
+            pcm_cache = PCMCache(PRELOAD_MEMORY_MB * 1024 * 1024)
+            backend = PreloadingBackend(backend, pcm_cache)
+        self.voice_client_manager = VoiceClientManager(backend)
         self.catalog = Catalog(self.voice_client_manager)
-        # user.id -> discord.Message
-        self._previous_x_messages: dict[int, discord.Message] = {}
+        if PRELOAD_MEMORY_MB > 0:
+            self._preloader = Preloader(self.catalog, pcm_cache)
+        self.popularity = Popularity(
+            self.catalog, half_life_seconds=POPULARITY_HALF_LIFE_DAYS * 24 * 3600
+        )
+        # Made on first use, it imports numpy.
+        self._duplicate_finder: DuplicateFinder | None = None
+        self._duplicate_finder_unavailable = False
+        self.game_records = GameRecords()
+        self.member_resolver = MemberResolver(bot)
         self._soundboard_drawing_lock = asyncio.Lock()
-
-    @discord.ext.commands.Cog.listener()
-    async def on_ready(self):
-        for guild_id in SOUNDBOARD_CHANNELS:
-            for view in make_soundboard_views(self.catalog.all(), guild_id):
-                self.bot.add_view(view)
+        self._history_feed: HistoryFeed | None = None
+        if HISTORY_FEED_SIZE > 0:
+            self._history_feed = HistoryFeed(
+                bot,
+                self.catalog,
+                self.member_resolver,
+                SOUNDBOARD_CHANNELS,
+                size=HISTORY_FEED_SIZE,
+                min_edit_seconds=HISTORY_FEED_EDIT_SECONDS,
+                drawing_lock=self._soundboard_drawing_lock,
+            )
+        self.creation_sessions = CreationSessionRegistry(
+            in_use=lambda path: any(
+                sfx.file_path == path for sfx in self.catalog.all()
+            )
+        )
+        self.x_messages = EphemeralMessageRegistry(X_MESSAGE_TTL_SECONDS)
+        # guild.id -> soundboard pages an edit or delete made stale.
+        self._dirty_soundboard_pages: dict[int, set[int]] = {}
+        self.catalog.add_change_listener(self._invalidate_derived)
+        self._metrics_runner = None
+        self._loop_lag_monitor = LoopLagMonitor()
+        self._play_counter_task: asyncio.Task | None = None
+
+    async def cog_load(self):
+        # Handles every soundboard button, whichever guild or sound effect.
+        self.bot.add_dynamic_items(SoundboardButton)
+        self._loop_lag_monitor.start()
+        self.creation_sessions.start()
+        self.x_messages.start()
+        self._play_counter_task = asyncio.create_task(self._count_plays())
+        self.popularity.start()
+        if self._preloader is not None:
+            self._preloader.start()
+        if self._history_feed is not None:
+            self._history_feed.start()
+        if METRICS_PORT is not None:
+            self._metrics_runner = await start_metrics_server("127.0.0.1", METRICS_PORT)
+
+    async def cog_unload(self):
+        self.bot.remove_dynamic_items(SoundboardButton)
+        self._loop_lag_monitor.stop()
+        self.creation_sessions.stop()
+        self.x_messages.stop()
+        if self._play_counter_task is not None:
+            self._play_counter_task.cancel()
+        self.popularity.stop()
+        if self._duplicate_finder is not None:
+            self._duplicate_finder.stop()
+        if self._preloader is not None:
+            self._preloader.stop()
+        if self._history_feed is not None:
+            self._history_feed.stop()
+        if self._metrics_runner is not None:
+            await self._metrics_runner.cleanup()
+
+    async def _count_plays(self):
+        with self.catalog.playback_events.subscribe() as plays:
+            async for event in plays:
+                metrics.increment("plays_total", guild=event.guild_id)
+
+    def _get_duplicate_finder(self) -> DuplicateFinder | None:
+        """Starts fingerprinting the catalog the first time it's needed.
+
+        None if numpy isn't installed.
+        """
+        if self._duplicate_finder is None and not self._duplicate_finder_unavailable:
+            try:
+                self._duplicate_finder = DuplicateFinder(self.catalog)
+            except ValueError as e:
+                _log.warning("Not checking for duplicate sound effects: %s", e)
+                self._duplicate_finder_unavailable = True
+                return None
+            self._duplicate_finder.start()
+        return self._duplicate_finder
 
     async def _autocomplete_sound_effect_name(
         self, interaction: discord.Interaction, partial_sound: str
@@ -130,7 +223,14 @@ class BababooeyCog(discord.ext.commands.Cog):
         if partial_sound == "":
             matches = self.catalog.users_most_recent(interaction.user, 25)
         else:
-            matches = self.catalog.find_partial_matches(partial_sound)
+            matches = self.catalog.find_partial_matches(
+                partial_sound,
+                limit=25,
+                boost=lambda sfx: POPULARITY_BOOST
+                * self.popularity.score(
+                    interaction.guild_id, interaction.user.id, sfx.num
+                ),
+            )
         return [
             app_commands.Choice(
                 name=f"{_unicode_safe_emoji(sfx.emoji)} {sfx.name}", value=sfx.name
@@ -141,8 +241,10 @@ class BababooeyCog(discord.ext.commands.Cog):
     @app_commands.command()
     @app_commands.describe(search="Look for a sound effect by name or tags.")
     @app_commands.autocomplete(search=_autocomplete_sound_effect_name)
+    @timed_command
     async def x(self, interaction: discord.Interaction, search: str):
         """Play a sound effect."""
+        begin_interaction(interaction, "x")
         sfx = self.catalog.by_name(search)
         if sfx is None:
             await interaction.response.send_message(
@@ -150,52 +252,42 @@ class BababooeyCog(discord.ext.commands.Cog):
             )
             return
 
-        # Play the requested sound effect.
-        await sfx.play_for(interaction.user)
+        # Acknowledge straight away, connecting to voice alone can take longer
+        # than Discord's interaction deadline.
+        with metrics.timer("interaction_response"):
+            await interaction.response.defer(ephemeral=True, thinking=True)
 
-        # Collect the recent sounds to display.
-        recent_sfx = self.catalog.users_most_recent(interaction.user, 5)
-        view = discord.ui.View(timeout=X_MESSAGE_TTL_SECONDS)
-        for i, sfx in enumerate(reversed(recent_sfx)):
-            view.add_item(SoundEffectButton(sfx, row=i))
-        # Create the /x interface.
-        await interaction.response.send_message(
-            view=view, ephemeral=True, delete_after=X_MESSAGE_TTL_SECONDS
+        # Play, record and look up the recent sounds all at once.
+        played, recent_sfx = await asyncio.gather(
+            sfx.play_for(interaction.user),
+            self.catalog.users_most_recent_async(interaction.user, 5),
+            return_exceptions=True,
         )
-
-        # Handle message cleanup code.
-        x_message = await interaction.original_response()
-        user_id = interaction.user.id
-
-        # NOTE: If one of the above `await` calls takes a long time, a more
-        # recent x/ command might have made it into _previous_x_messages. In
-        # that case we don't want to delete it, rather we want to delete our
-        # x/ message.
-        if (
-            user_id in self._previous_x_messages
-            and self._previous_x_messages[user_id].created_at > x_message.created_at
-        ):
-            await x_message.delete()
+        if isinstance(played, Exception):
+            _log.error("Failed to play %s", sfx.name, exc_info=played)
+            await interaction.edit_original_response(
+                content=f"Couldn't play {sfx.emoji} `{sfx.name}`: {describe_play_error(played)}"
+            )
             return
+        if isinstance(recent_sfx, Exception):
+            _log.error("Failed to look up recent sounds", exc_info=recent_sfx)
+            recent_sfx = []
+        # The lookup may have raced the history write, make sure the sound we
+        # just played shows up.
+        recent_sfx = [sfx] + [s for s in recent_sfx if s is not None and s.num != sfx.num]
 
-        # Pop previous message from the dict before doing an async operation on
-        # it. This avoids two threads both calling .delete() simultaneously.
-        previous_msg = self._previous_x_messages.pop(user_id, None)
-        # Assign previous x messages before doing async operation so we're sure
-        # we aren't overwriting an assignment from another thread.
-        # (Ensuring this is atomic with the above line.)
-        self._previous_x_messages[user_id] = x_message
-        if previous_msg is not None:
-            # If it already passed the ttl, don't bother trying to delete it.
-            if previous_msg.created_at < datetime.datetime.now(
-                tz=datetime.timezone.utc
-            ) - datetime.timedelta(seconds=X_MESSAGE_TTL_SECONDS):
-                return
-            await previous_msg.delete()
+        view = discord.ui.View(timeout=X_MESSAGE_TTL_SECONDS)
+        for i, recent in enumerate(reversed(recent_sfx[0:5])):
+            view.add_item(SoundEffectButton(recent, row=i))
+        # Create the /x interface.
+        x_message = await interaction.edit_original_response(view=view)
+        # Deleted by the next /x, or once it expires.
+        self.x_messages.track(interaction.user.id, interaction.guild.id, x_message)
 
     @app_commands.command()
     @app_commands.describe(search="Look for a sound effect by name or tags.")
     @app_commands.autocomplete(search=_autocomplete_sound_effect_name)
+    @timed_command
     async def inspect_sound(
         self,
         interaction: discord.Interaction,
@@ -211,16 +303,177 @@ class BababooeyCog(discord.ext.commands.Cog):
                 )
             )
             return
-        view = discord.ui.View(timeout=X_MESSAGE_TTL_SECONDS)
-        view.add_item(
-            discord.ui.Button(
-                style=discord.ButtonStyle.link,
-                label="Go to the source",
-                url=sfx.clean_yt_url,
+
+        async def edit_callback(
+            name: str, start_str: str, end_str: str | None, tags: str | None
+        ) -> None:
+            res = await self._parse_sfx_edit(sfx, name, start_str, end_str, tags)
+            if isinstance(res, str):
+                await interaction.followup.send(res, ephemeral=True)
+                return
+            try:
+                self.catalog.update(sfx.num, **res)
+            except ValueError as e:
+                await interaction.followup.send(
+                    f"Failed to edit {sfx.name}.\n{e}", ephemeral=True
+                )
+                return
+            await interaction.edit_original_response(
+                embed=await sfx.details_embed(interaction.guild, self.member_resolver),
+                view=make_view(),
             )
-        )
-        e = await sfx.details_embed(interaction.guild)
-        await interaction.response.send_message(embed=e, view=view)
+            await self._redraw_dirty_soundboards()
+
+        async def delete_callback(confirmation: discord.Interaction) -> None:
+            try:
+                self.catalog.delete(sfx.num)
+            except ValueError as e:
+                await confirmation.response.send_message(
+                    f"Failed to delete {sfx.name}.\n{e}", ephemeral=True
+                )
+                return
+            await confirmation.response.edit_message(
+                embed=discord.Embed(
+                    title=f"{sfx.emoji} {sfx.name}",
+                    description=f"Deleted by {confirmation.user.display_name}.",
+                ),
+                view=None,
+            )
+            await self._redraw_dirty_soundboards()
+
+        def can_change(user: discord.abc.User) -> bool:
+            permissions = getattr(user, "guild_permissions", None)
+            return user.id == sfx.data.author or (
+                permissions is not None and permissions.manage_guild
+            )
+
+        def make_view() -> SoundEffectDetailButtons:
+            view = SoundEffectDetailButtons(
+                sfx.data,
+                self.voice_client_manager,
+                edit_callback=edit_callback,
+                delete_callback=delete_callback,
+                can_change=can_change,
+                timeout=X_MESSAGE_TTL_SECONDS,
+            )
+            # Imported sound effects have a file path rather than a link.
+            if sfx.clean_yt_url.startswith(("https://", "http://")):
+                view.add_item(
+                    discord.ui.Button(
+                        style=discord.ButtonStyle.link,
+                        label="Go to the source",
+                        url=sfx.clean_yt_url,
+                    )
+                )
+            return view
+
+        e = await sfx.details_embed(interaction.guild, self.member_resolver)
+        await interaction.response.send_message(embed=e, view=make_view())
+
+    async def _parse_sfx_edit(
+        self,
+        sfx: SoundEffect,
+        name: str,
+        start_str: str,
+        end_str: str | None,
+        tags: str | None,
+    ) -> dict | str:
+        """The fields to change for Catalog.update, or an error string."""
+        errors = ""
+        if not MIN_SOUND_EFFECT_NAME_LENGTH <= len(name) <= MAX_SOUND_EFFECT_NAME_LENGTH:
+            errors += (
+                f"Name must be {MIN_SOUND_EFFECT_NAME_LENGTH} to "
+                f"{MAX_SOUND_EFFECT_NAME_LENGTH} characters long.\n"
+            )
+        start_millis = 0
+        if start_str is not None and start_str.lower() not in ("", "none"):
+            try:
+                start_millis = str_to_millis(start_str)
+            except ValueError:
+                errors += f'The start time "{start_str}" doesn\'t parse. Try seconds (6.2) or minutes (1:20.1) or the full format (00:00.000).\n'
+        if end_str is None or end_str.lower() in ("", "none"):
+            # The whole rest of the file.
+            end_millis = await read_audio_length(sfx.file_path) or sfx.end_millis
+        else:
+            try:
+                end_millis = str_to_millis(end_str)
+            except ValueError:
+                errors += f'The end time "{end_str}" doesn\'t parse. Try seconds (6.2) or minutes (1:20.1) or the full format (00:00.000).\n'
+                end_millis = sfx.end_millis
+        if not errors and start_millis >= end_millis:
+            errors += "The start time must be before the end time.\n"
+        if errors:
+            return errors
+        return {
+            "name": name,
+            "start_millis": start_millis,
+            "end_millis": end_millis,
+            "tags": tags or "",
+        }
+
+    def _invalidate_derived(
+        self, before: SoundEffectData, after: SoundEffectData | None
+    ) -> None:
+        """Drops what an edit or delete made stale, and nothing else."""
+        if after is None and before.file_path.startswith(IMPORTED_DIR):
+            if not any(sfx.file_path == before.file_path for sfx in self.catalog.all()):
+                try:
+                    os.remove(waveform_path_for(before.file_path))
+                except FileNotFoundError:
+                    pass
+        # Buttons look sound effects up by num when pressed, so only what they
+        # show needs redrawing.
+        if after is None or (after.name, after.emoji) != (before.name, before.emoji):
+            for guild_id in SOUNDBOARD_CHANNELS:
+                self._dirty_soundboard_pages.setdefault(guild_id, set()).add(
+                    soundboard_page(before.num)
+                )
+
+    async def _redraw_dirty_soundboards(self) -> None:
+        """Redraws the stale pages of every guild's soundboard."""
+        for guild_id in list(self._dirty_soundboard_pages):
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                self._dirty_soundboard_pages.pop(guild_id, None)
+                continue
+            try:
+                await self._redraw_dirty_soundboard_pages(guild)
+            except discord.HTTPException:
+                _log.exception("Failed to redraw the soundboard in %s", guild)
+
+    async def _redraw_dirty_soundboard_pages(self, guild: discord.Guild) -> None:
+        """Edits just the soundboard messages that edits made stale.
+
+        Falls back to a full redraw if one of them can't be found.
+        """
+        async with self._soundboard_drawing_lock:
+            pages = self._dirty_soundboard_pages.pop(guild.id, set())
+            if not pages or guild.id not in SOUNDBOARD_CHANNELS:
+                return
+            soundboard_channel = await self.bot.fetch_channel(
+                SOUNDBOARD_CHANNELS[guild.id]
+            )
+            all_sfx = self.catalog.all()
+            last_page = soundboard_page(all_sfx[-1].num) if all_sfx else 0
+            messages = {}
+            # Every page, the live history feed and one to spare.
+            async for msg in soundboard_channel.history(limit=last_page + 3):
+                if msg.author.id == self.bot.user.id:
+                    messages[page_of_message(msg)] = msg
+            missing = False
+            for page in sorted(pages):
+                view = make_soundboard_page(all_sfx, guild.id, page)
+                msg = messages.get(page)
+                if msg is None:
+                    missing = missing or view is not None
+                elif view is None:
+                    await msg.delete()
+                else:
+                    await msg.edit(view=view)
+            metrics.increment("soundboard_pages_redrawn_total", len(pages))
+        if missing:
+            _log.info("A dirty soundboard page had no message, redrawing it all")
+            await self._do_soundboard_redraw(guild)
 
     async def _do_soundboard_redraw(self, guild: discord.Guild) -> str:
         """Redraw the soundboard.
@@ -234,9 +487,14 @@ class BababooeyCog(discord.ext.commands.Cog):
                 SOUNDBOARD_CHANNELS[guild.id]
             )
             views = make_soundboard_views(self.catalog.all(), guild.id)
+            # Everything is redrawn, nothing is stale anymore.
+            self._dirty_soundboard_pages.pop(guild.id, None)
 
             # Check the history in that channel.
             expected_number_of_messages = len(views)
+            if self._history_feed is not None:
+                # Its message sits below the soundboard.
+                expected_number_of_messages += 1
             messages = [
                 msg
                 async for msg in soundboard_channel.history(
@@ -272,10 +530,13 @@ class BababooeyCog(discord.ext.commands.Cog):
 
             for view in views:
                 await soundboard_channel.send(view=view)
+            if self._history_feed is not None:
+                self._history_feed.repost(guild.id)
 
             return f"Sent a fresh soundboard in #{soundboard_channel}"
 
     @app_commands.command()
+    @timed_command
     async def sync_soundboard(self, interaction: discord.Interaction):
         """Redraw the soundboard channel."""
         if self._soundboard_drawing_lock.locked():
@@ -290,30 +551,105 @@ class BababooeyCog(discord.ext.commands.Cog):
         )
 
     @app_commands.command()
+    @timed_command
     async def history(self, interaction: discord.Interaction):
         """See the global sound effect history."""
         await interaction.response.defer()
+        page = await self.catalog.recent_history_async(20)
+        # Resolve everyone on the page together rather than one at a time.
+        users = await self.member_resolver.resolve_many(
+            interaction.guild, (user_id for _, user_id, _, _ in page)
+        )
         lines = []
-        for dt, user_id, _, sfx in self.catalog.all_history()[0:20]:
-            # Try to use the cache first.
-            user = interaction.guild.get_member(user_id)
-            if user is None:
-                # This can be slow, hopefully we only have to do this once per
-                # user_id.
-                user = await interaction.guild.fetch_member(user_id)
+        for dt, user_id, _, sfx in page:
+            if sfx is None:
+                lines.append(
+                    f"`{dt:%H:%M:%S}` {chr(0x274c)}`{'(deleted)':>12}` {users[user_id].display_name}"
+                )
+                continue
             lines.append(
-                f"`{dt:%H:%M:%S}` {sfx.emoji}`{sfx.name:>12}` {user.display_name}"
+                f"`{dt:%H:%M:%S}` {sfx.emoji}`{sfx.name:>12}` {users[user_id].display_name}"
             )
 
-        await interaction.followup.send("\n".join(lines))
+        # Departed users are shown as mentions, which shouldn't ping them.
+        await interaction.followup.send(
+            "\n".join(lines), allowed_mentions=discord.AllowedMentions.none()
+        )
 
     @app_commands.command()
+    @app_commands.default_permissions(administrator=True)
+    @timed_command
+    async def stats(self, interaction: discord.Interaction):
+        """Where the time goes between a button press and a sound."""
+        e = discord.Embed(title="Stats")
+        lines = []
+        for stage in metrics.stages():
+            h = metrics.stage_summary(stage)
+            lines.append(
+                f"`{stage:<20}` n={h.count} p50<={h.quantile(0.5)}s "
+                f"p95<={h.quantile(0.95)}s"
+            )
+        e.add_field(
+            name="Stages", value="\n".join(lines) or "Nothing yet.", inline=False
+        )
+        hit_rates = metrics.cache_hit_rates()
+        e.add_field(
+            name="Cache hit rates",
+            value="\n".join(f"`{c}` {rate:.0%}" for c, rate in hit_rates.items())
+            or "Nothing yet.",
+            inline=False,
+        )
+        e.add_field(
+            name="Creation sessions",
+            value=f"{self.creation_sessions.count(interaction.guild_id)} here, "
+            f"{len(self.creation_sessions)} total",
+            inline=False,
+        )
+        gauges = metrics.gauge_values()
+        gauges["subprocesses_started"] = metrics.counter_value(
+            "subprocesses_started_total"
+        )
+        e.add_field(
+            name="Gauges",
+            value="\n".join(f"`{name}` {value:g}" for name, value in gauges.items()),
+            inline=False,
+        )
+        await interaction.response.send_message(embed=e, ephemeral=True)
+
+    @app_commands.command()
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.describe(seconds="How long to profile the bot for.")
+    @timed_command
+    async def profile(
+        self, interaction: discord.Interaction, seconds: app_commands.Range[int, 1, 120]
+    ):
+        """Profile everything the bot does for a while."""
+        await interaction.response.defer(ephemeral=True)
+        try:
+            report = await capture_profile(seconds)
+        except ValueError:
+            await interaction.followup.send(
+                "Already profiling, try again once that's done.", ephemeral=True
+            )
+            return
+        await interaction.followup.send(
+            f"Profiled for {seconds}s. Loop stalls so far: "
+            f"{self._loop_lag_monitor.stalls}, worst lag "
+            f"{self._loop_lag_monitor.max_lag:.3f}s.",
+            file=discord.File(io.BytesIO(report.encode()), filename="profile.txt"),
+            ephemeral=True,
+        )
+
+    @app_commands.command()
+    @timed_command
     async def add_sound(
         self,
         interaction: discord.Interaction,
         youtube_url: str,
         name: app_commands.Range[str, 1, 12],
         emoji: str,
+        start: str | None = None,
+        end: str | None = None,
     ):
         """Create a new sound effect.
 
@@ -321,52 +657,82 @@ class BababooeyCog(discord.ext.commands.Cog):
             youtube_url: The youtube video you want to make into a sound effect.
             name: Must be unique and under 12 char.
             emoji: Must be unique. Select using the emoji picker on the right.
+            start: Roughly where the sound starts (1:20), only around it is downloaded.
+            end: Roughly where the sound ends (1:23), only around it is downloaded.
         """
-        for sfx in self.catalog.all():
-            if sfx.name == name:
-                await interaction.response.send_message(
-                    f"Sound effect name must be unique. `{name}` is already a sound effect."
-                )
-                return
-            # TODO: this failed when using :shield:
-            if sfx.emoji == emoji:
-                await interaction.response.send_message(
-                    f"Sound effect emoji must be unique. {emoji} is already a sound effect."
-                )
-                return
-
-        await interaction.response.defer()
-
-        # TODO: prevent downloading if it's larger than a limit.
-        file_path, duration_millis = await do_youtube_dl(youtube_url, self.bot.loop)
+        if self.catalog.by_name(name) is not None:
+            await interaction.response.send_message(
+                f"Sound effect name must be unique. `{name}` is already a sound effect."
+            )
+            return
+        # TODO: this failed when using :shield:
+        if self.catalog.by_emoji(emoji) is not None:
+            await interaction.response.send_message(
+                f"Sound effect emoji must be unique. {emoji} is already a sound effect."
+            )
+            return
+        try:
+            hint_start = None if start is None else str_to_millis(start)
+            hint_end = None if end is None else str_to_millis(end)
+            window = download_window(
+                hint_start, hint_end, int(DOWNLOAD_PADDING_SECONDS * 1000)
+            )
+        except ValueError as e:
+            await interaction.response.send_message(
+                f"Couldn't use the start/end hints: {e}", ephemeral=True
+            )
+            return
 
-        # ffprobe gives a higher resolution of the duration.
-        ffprobe_duration_millis = await read_audio_length(file_path)
-        if ffprobe_duration_millis is not None:
-            duration_millis = ffprobe_duration_millis
+        try:
+            session = self.creation_sessions.open(
+                interaction.user.id, interaction.guild.id
+            )
+        except ValueError as e:
+            await interaction.response.send_message(str(e), ephemeral=True)
+            return
+        try:
+            await interaction.response.defer()
 
-        partial_sfx_data = SoundEffectData(
-            num=-1,
-            name=name,
-            emoji=emoji,
-            yt_url=youtube_url,
-            file_path=file_path,
-            author=interaction.user.id,
-            guild=interaction.guild.id,
-            created_at=datetime.datetime.now(tz=datetime.timezone.utc),
-            start_millis=0,
-            end_millis=duration_millis,
-            tags=f"{name},",
-        )
+            # TODO: prevent downloading if it's larger than a limit.
+            try:
+                source = await download_source(youtube_url, window)
+            except ValueError as e:
+                await interaction.followup.send(str(e))
+                return
+            session.download_path = source.file_path
+
+            # Trim to the hints, the padding is there to widen it.
+            start_millis = 0 if hint_start is None else hint_start - source.offset_millis
+            end_millis = source.duration_millis
+            if hint_end is not None:
+                end_millis = min(end_millis, hint_end - source.offset_millis)
+            partial_sfx_data = SoundEffectData(
+                num=-1,
+                name=name,
+                emoji=emoji,
+                yt_url=youtube_url,
+                file_path=source.file_path,
+                author=interaction.user.id,
+                guild=interaction.guild.id,
+                created_at=datetime.datetime.now(tz=datetime.timezone.utc),
+                start_millis=max(0, start_millis),
+                end_millis=end_millis,
+                tags=f"{name},",
+            )
 
-        creation_manager = SoundEffectCreationManager(
-            partial_sfx_data=partial_sfx_data,
-            original_interaction=interaction,
-            voice_client_manager=self.voice_client_manager,
-            catalog=self.catalog,
-        )
+            creation_manager = SoundEffectCreationManager(
+                partial_sfx_data=partial_sfx_data,
+                original_interaction=interaction,
+                voice_client_manager=self.voice_client_manager,
+                catalog=self.catalog,
+                session=session,
+                source=source,
+                duplicate_finder=self._get_duplicate_finder(),
+            )
 
-        new_sfx = await creation_manager.manage()
+            new_sfx = await creation_manager.manage()
+        finally:
+            self.creation_sessions.close(session)
         if new_sfx is None:
             # Creation failed or was cancelled. It should have done its own
             # message.
@@ -385,6 +751,86 @@ class BababooeyCog(discord.ext.commands.Cog):
         )
 
     @app_commands.command()
+    @app_commands.default_permissions(administrator=True)
+    @timed_command
+    async def import_sounds(
+        self, interaction: discord.Interaction, manifest: discord.Attachment
+    ):
+        """Create many sound effects at once from files in the import directory.
+
+        Args:
+            manifest: CSV or JSON with name, emoji, source, start, end, tags.
+        """
+        if not manifest.filename.endswith((".csv", ".json")):
+            await interaction.response.send_message(
+                "The manifest must be a `.csv` or `.json` file.", ephemeral=True
+            )
+            return
+        await interaction.response.defer()
+
+        os.makedirs("data/tmp", exist_ok=True)
+        manifest_path = os.path.join("data/tmp", f"{interaction.id}-{manifest.filename}")
+        await manifest.save(manifest_path)
+        try:
+            # Sources are paths relative to the import directory.
+            entries = read_manifest(manifest_path, base_dir=IMPORT_SOURCE_DIR)
+        except (KeyError, ValueError) as e:
+            await interaction.followup.send(f"Couldn't read the manifest: `{e!r}`")
+            return
+        finally:
+            os.remove(manifest_path)
+
+        report = await run_import(
+            entries,
+            self.catalog,
+            author=interaction.user.id,
+            guild=interaction.guild.id,
+            allowed_dir=IMPORT_SOURCE_DIR,
+        )
+        status = "Nothing new, so the soundboard was left alone."
+        if report.created:
+            if self._duplicate_finder is not None:
+                self._duplicate_finder.refresh()
+            status = await self._do_soundboard_redraw(interaction.guild)
+        await interaction.followup.send(
+            embed=discord.Embed(
+                title="Import",
+                description=f"{report.summary()[:3500]}\n\n{status}",
+            )
+        )
+
+    @app_commands.command()
+    @timed_command
+    async def find_duplicates(self, interaction: discord.Interaction):
+        """List sound effects that sound like each other."""
+        duplicate_finder = self._get_duplicate_finder()
+        if duplicate_finder is None:
+            await interaction.response.send_message(
+                "Duplicate checking is off, it needs numpy installed.", ephemeral=True
+            )
+            return
+        await interaction.response.defer()
+        clusters = await duplicate_finder.clusters()
+        lines = [
+            " ".join(f"{sfx.emoji}`{sfx.name}`" for sfx in cluster)
+            for cluster in clusters
+        ]
+        description = "\n".join(lines) or "No duplicates found."
+        if len(description) > 4000:
+            description = description[:4000].rsplit("\n", 1)[0] + "\n..."
+        if not duplicate_finder.backfilled.is_set():
+            description += (
+                f"\n\nOnly {len(duplicate_finder.index)} of "
+                f"{len(self.catalog.all())} sound effects are fingerprinted so far."
+            )
+        await interaction.followup.send(
+            embed=discord.Embed(
+                title=f"{len(clusters)} groups of duplicates", description=description
+            )
+        )
+
+    @app_commands.command()
+    @timed_command
     async def guess_sound(self, interaction: discord.Interaction):
         """It\'s like Wheel of Fortune, but with sound effects."""
         sfx = random.choice(self.catalog.all())
@@ -404,61 +850,140 @@ class BababooeyCog(discord.ext.commands.Cog):
             )
 
         await interaction.response.send_message(embed=make_embed())
+        # Decode the clip once, every reveal plays a longer slice of it.
+        pcm = await decode_pcm(sfx.file_path, sfx.start_millis, sfx.end_millis)
+        # One subscription for the whole round, the first play of the answer
+        # wins and the ones right after it are the runners-up.
+        guesses = self.catalog.playback_events.subscribe(
+            lambda event: event.guild_id == interaction.guild_id
+            and event.sfx.num == sfx.num,
+            maxsize=RUNNERS_UP_SHOWN + 1,
+        )
+        winner_task = asyncio.create_task(guesses.get())
+        try:
+            start_time = datetime.datetime.utcnow()
+
+            while len(unrevealed) > 0:
+                revealed.add(unrevealed.pop(random.randint(0, len(unrevealed) - 1)))
+                if len(unrevealed) == 0:
+                    break
+
+                await asyncio.gather(
+                    interaction.edit_original_response(embed=make_embed()),
+                    self.voice_client_manager.play_source_for(
+                        interaction.user,
+                        PCMSliceSource(pcm.slice(0, len(revealed) * increment)),
+                    ),
+                )
+                finished, _ = await asyncio.wait([winner_task], timeout=10)
+                if winner_task in finished:
+                    break
+
+            if winner_task.done():
+                winning_play = winner_task.result()
+                winner = winning_play.user
+                time_taken = (
+                    winning_play.timestamp.replace(tzinfo=None) - start_time
+                ).total_seconds()
+                # Keep listening for a moment to see who else got it.
+                runners_up_task = asyncio.create_task(
+                    _collect_runners_up(guesses, winning_play)
+                )
+                embed = discord.Embed(
+                    title=f"{sfx.emoji} {sfx.name}",
+                    description=f"{chr(0x1f3c6)}Congratulation{chr(0x1f3c6)} to "
+                    f"**{winner.display_name}**!"
+                    f"\nSound effect found in `{time_taken:.2f}` seconds.",
+                )
+                view = discord.ui.View()
+                view.add_item(SoundEffectButton(sfx, row=1))
+                await interaction.edit_original_response(embed=embed, view=view)
+                await self.voice_client_manager.play_file_for(
+                    winner,
+                    "data/youtubedl/youtube-ixVSBGjfMoE-Vampire_Survivors_-_Small_Chest_Opening_Animation.webm",
+                    1000,
+                    9761,
+                )
+                await asyncio.sleep(3)
+
+                runners_up = await runners_up_task
+                result = await self.game_records.record_round_async(
+                    guild_id=interaction.guild_id,
+                    num=sfx.num,
+                    winner_id=winner.id,
+                    solve_seconds=time_taken,
+                    letters_hidden=len(sfx.name) - len(revealed),
+                    letters_total=len(sfx.name),
+                    runners_up=[
+                        RunnerUp(event.user.id, seconds_behind)
+                        for event, seconds_behind in runners_up
+                    ],
+                )
+                if result.personal_best:
+                    embed.description += (
+                        f"\nNew personal best, #{result.fastest_rank} fastest here."
+                    )
+                for event, seconds_behind in runners_up:
+                    embed.description += (
+                        f"\n{event.user.display_name} was `{seconds_behind:.2f}`"
+                        " seconds behind."
+                    )
+                embed.description += "\nYou have won..."
+                await interaction.edit_original_response(embed=embed, view=view)
+                await asyncio.sleep(4)
 
-        winner_task = asyncio.create_task(sfx.next_player())
-        start_time = datetime.datetime.utcnow()
-
-        while len(unrevealed) > 0:
-            revealed.add(unrevealed.pop(random.randint(0, len(unrevealed) - 1)))
-            if len(unrevealed) == 0:
-                break
-
-            await asyncio.gather(
-                interaction.edit_original_response(embed=make_embed()),
-                sfx.play_for_partial(
-                    interaction.user,
-                    sfx.start_millis,
-                    sfx.start_millis + (len(revealed) * increment),
-                ),
-            )
-            finished, _ = await asyncio.wait([winner_task], timeout=10)
-            if winner_task in finished:
-                break
-
-        if winner_task.done():
-            winner = winner_task.result()
-            time_taken = (datetime.datetime.utcnow() - start_time).total_seconds()
-            embed = discord.Embed(
-                title=f"{sfx.emoji} {sfx.name}",
-                description=f"{chr(0x1f3c6)}Congratulation{chr(0x1f3c6)} to "
-                f"**{winner.display_name}**!"
-                f"\nSound effect found in `{time_taken}` seconds.",
-            )
-            view = discord.ui.View()
-            view.add_item(SoundEffectButton(sfx, row=1))
-            await interaction.edit_original_response(embed=embed, view=view)
-            await self.voice_client_manager.play_file_for(
-                winner,
-                "data/youtubedl/youtube-ixVSBGjfMoE-Vampire_Survivors_-_Small_Chest_Opening_Animation.webm",
-                1000,
-                9761,
-            )
-            await asyncio.sleep(3)
-
-            embed.description += "\nYou have won..."
-            await interaction.edit_original_response(embed=embed, view=view)
-            await asyncio.sleep(4)
-
-            embed.description += f" **`{random.randint(0, 1000)}`** credits!"
-            await interaction.edit_original_response(embed=embed, view=view)
+                embed.description += (
+                    f" **`{result.credits}`** credits!"
+                    f" That makes **`{result.balance}`**."
+                )
+                await interaction.edit_original_response(embed=embed, view=view)
 
-        else:
-            await interaction.edit_original_response(
-                embed=discord.Embed(
-                    title=f"{sfx.emoji} {sfx.name}", description=f"Wow you all suck."
+            else:
+                await interaction.edit_original_response(
+                    embed=discord.Embed(
+                        title=f"{sfx.emoji} {sfx.name}", description=f"Wow you all suck."
+                    )
                 )
+                # Not play_for because it doesn't "count" as a user playing
+                await self.voice_client_manager.play_source_for(
+                    interaction.user, PCMSliceSource(pcm.slice())
+                )
+        finally:
+            # Nobody guessed it, stop listening.
+            winner_task.cancel()
+            guesses.close()
+            pcm.release()
+
+    @app_commands.command()
+    @app_commands.describe(board="Which record to rank by.")
+    @timed_command
+    async def leaderboard(
+        self, interaction: discord.Interaction, board: Board = Board.RICHEST
+    ):
+        """Who is the best at guess_sound."""
+        top = self.game_records.top(interaction.guild_id, board, LEADERBOARD_SIZE)
+        if not top:
+            await interaction.response.send_message(
+                "Nobody has won a guess_sound here yet."
             )
-            # play_for_partial because it doesn't "count" as a user playing
-            await sfx.play_for_partial(
-                interaction.user, sfx.start_millis, sfx.end_millis
-            )
+            return
+        lines = []
+        for i, (user_id, score) in enumerate(top):
+            if board is Board.FASTEST:
+                shown = f"{score:.2f}s"
+            else:
+                shown = f"{int(score)}"
+            # Mentions render as names without having to fetch the members.
+            lines.append(f"`{i + 1:>2}` <@{user_id}> **`{shown}`**")
+        own_rank = self.game_records.rank(
+            interaction.guild_id, board, interaction.user.id
+        )
+        if own_rank is not None and own_rank > LEADERBOARD_SIZE:
+            lines.append(f"...\nYou are #{own_rank}.")
+        await interaction.response.send_message(
+            embed=discord.Embed(
+                title=f"guess_sound leaderboard: {board.value}",
+                description="\n".join(lines),
+            ),
+            allowed_mentions=discord.AllowedMentions.none(),
+        )
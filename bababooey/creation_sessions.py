@@ -0,0 +1,142 @@
+"""Tracks in-progress /add_sound creations so abandoned ones go away.
+
+A session is opened before anything is downloaded, which is also where the
+per-user and per-guild caps are enforced. Every button press on the
+creation message keeps it alive. A sweeper expires sessions that have been
+idle for too long, and closing a session (however it ended) deletes the
+files it made that nothing else uses.
+"""
+from collections.abc import Awaitable, Callable
+import asyncio
+import logging
+import os
+import time
+
+from bababooey.metrics import metrics
+
+_log = logging.getLogger(__name__)
+
+# Interaction tokens last 15 minutes, expire before we can no longer edit
+# the message to say so.
+DEFAULT_IDLE_TTL_SECONDS = 10 * 60.0
+DEFAULT_MAX_PER_USER = 1
+DEFAULT_MAX_PER_GUILD = 5
+SWEEP_INTERVAL_SECONDS = 30.0
+
+
+class CreationSession:
+
+    def __init__(self, registry: 'CreationSessionRegistry', user_id: int,
+                 guild_id: int):
+        self._registry = registry
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.last_active = registry.clock()
+        # Set once there is a message to expire, see attach().
+        self._on_expire: Callable[[], Awaitable[None]] | None = None
+        self.download_path: str | None = None
+        # Earlier downloads this session swapped out, e.g. for a wider one.
+        self.replaced_downloads: set[str] = set()
+        self.temp_files: set[str] = set()
+        self.closed = False
+
+    def attach(self, on_expire: Callable[[], Awaitable[None]]) -> None:
+        """on_expire should disable the message and end the creation."""
+        self._on_expire = on_expire
+        self.touch()
+
+    def touch(self) -> None:
+        self.last_active = self._registry.clock()
+
+    def idle_for(self) -> float:
+        return self._registry.clock() - self.last_active
+
+
+class CreationSessionRegistry:
+
+    def __init__(self,
+                 in_use: Callable[[str], bool] = lambda path: False,
+                 *,
+                 idle_ttl: float = DEFAULT_IDLE_TTL_SECONDS,
+                 max_per_user: int = DEFAULT_MAX_PER_USER,
+                 max_per_guild: int = DEFAULT_MAX_PER_GUILD,
+                 clock: Callable[[], float] = time.monotonic):
+        """in_use tells whether something saved still needs a download."""
+        self._in_use = in_use
+        self.idle_ttl = idle_ttl
+        self.max_per_user = max_per_user
+        self.max_per_guild = max_per_guild
+        self.clock = clock
+        self._sessions: set[CreationSession] = set()
+        self._sweeper: asyncio.Task | None = None
+        metrics.gauge('creation_sessions_active', lambda: len(self))
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def count(self, guild_id: int) -> int:
+        return sum(1 for s in self._sessions if s.guild_id == guild_id)
+
+    def open(self, user_id: int, guild_id: int) -> CreationSession:
+        """Raises a ValueError if the user or guild is at its cap."""
+        if sum(1 for s in self._sessions
+               if s.user_id == user_id) >= self.max_per_user:
+            raise ValueError(
+                'You are already making a sound effect, finish or cancel '
+                'that one first.')
+        if self.count(guild_id) >= self.max_per_guild:
+            raise ValueError(
+                'Too many sound effects are being made here right now, try '
+                'again in a few minutes.')
+        session = CreationSession(self, user_id, guild_id)
+        self._sessions.add(session)
+        return session
+
+    def close(self, session: CreationSession) -> None:
+        """Forgets the session and deletes the files only it was using."""
+        if session.closed:
+            return
+        session.closed = True
+        self._sessions.discard(session)
+        paths = set(session.temp_files)
+        downloads = session.replaced_downloads | {session.download_path}
+        for download in downloads - {None}:
+            if not self._in_use(download) and not any(
+                    s.download_path == download for s in self._sessions):
+                paths.add(download)
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                _log.exception('Failed to clean up %s', path)
+
+    async def expire_idle(self) -> int:
+        """Expires every session idle past the TTL, returns how many."""
+        expired = 0
+        for session in list(self._sessions):
+            # Sessions still downloading have nothing to expire yet.
+            if session._on_expire is None or session.idle_for() < self.idle_ttl:
+                continue
+            expired += 1
+            metrics.increment('creation_sessions_expired_total')
+            try:
+                await session._on_expire()
+            except Exception:
+                _log.exception('Failed to expire a creation session')
+            self.close(session)
+        return expired
+
+    async def _sweep_forever(self) -> None:
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+            await self.expire_idle()
+
+    def start(self) -> None:
+        self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    def stop(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
@@ -0,0 +1,185 @@
+"""Fetches the source audio for /add_sound.
+
+Given rough start/end hints, only that window of the source plus some
+padding is downloaded, using yt-dlp's download_ranges. ffmpeg seeks into
+the stream with range requests, so the rest of a long video is never
+fetched. The clip's times are then relative to the downloaded window, and
+offset_millis maps them back to the source. When a trim needs audio outside
+the window, the caller downloads the whole source instead.
+"""
+import asyncio
+import dataclasses
+import logging
+import os
+import uuid
+
+from bababooey.metrics import metrics
+from bababooey.subprocess_scheduler import Priority, scheduler
+
+_log = logging.getLogger(__name__)
+
+DOWNLOAD_DIR = 'data/youtubedl'
+DEFAULT_PADDING_MILLIS = 15_000
+# How much after the start hint to fetch when there is no end hint.
+HINTLESS_CLIP_MILLIS = 30_000
+FFPROBE_TIMEOUT_SECONDS = 30
+
+
+@dataclasses.dataclass
+class SourceDownload:
+    url: str
+    file_path: str
+    # Length of file_path, not of the source.
+    duration_millis: int
+    # Where file_path starts in the source.
+    offset_millis: int = 0
+    # None if the site didn't say.
+    source_duration_millis: int | None = None
+    partial: bool = False
+
+    def covers(self, start_millis: int, end_millis: int | None) -> bool:
+        """Whether [start_millis, end_millis) of the file was downloaded."""
+        return 0 <= start_millis and (end_millis is None or
+                                      end_millis <= self.duration_millis)
+
+
+def download_window(start_millis: int | None,
+                    end_millis: int | None,
+                    padding_millis: int = DEFAULT_PADDING_MILLIS
+                   ) -> tuple[int, int] | None:
+    """The part of the source to fetch for the hints, None for all of it.
+
+    Raises a ValueError if the hints are backwards.
+    """
+    if start_millis is None and end_millis is None:
+        return None
+    start_millis = start_millis or 0
+    if end_millis is None:
+        end_millis = start_millis + HINTLESS_CLIP_MILLIS
+    if end_millis <= start_millis:
+        raise ValueError('The end hint must be after the start hint.')
+    return (max(0, start_millis - padding_millis), end_millis + padding_millis)
+
+
+async def read_audio_length(file_path: str) -> int | None:
+    """Returns the length of the audio in millis."""
+    try:
+        result = await scheduler.run([
+            'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+            '-of', 'default=noprint_wrappers=1:nokey=1', file_path
+        ],
+                                     priority=Priority.PREVIEW,
+                                     kind='ffprobe',
+                                     timeout=FFPROBE_TIMEOUT_SECONDS)
+    except TimeoutError:
+        _log.error('ffprobe took too long to read %s', file_path)
+        return None
+    except OSError:
+        _log.exception('Couldn\'t run ffprobe')
+        return None
+    if result.returncode != 0:
+        _log.error('ffprobe failed. Here is the stderr: %s',
+                   result.stderr.decode())
+        return None
+    output = result.stdout.decode().strip()
+    try:
+        return int(float(output) * 1000)
+    except ValueError:
+        _log.error('Failed to parse ffprobe output "%s"', output)
+        return None
+
+
+def _extract(url: str, window: tuple[int, int] | None) -> tuple[str, dict]:
+    # yt_dlp takes a while to import and only /add_sound needs it.
+    import yt_dlp as youtube_dl
+
+    youtube_dl.utils.bug_reports_message = lambda *args, **kwargs: ''
+
+    # Unique, so two sessions downloading the same video at once don't
+    # write to the same file, or delete it from under each other later.
+    outtmpl = (f'{DOWNLOAD_DIR}/%(extractor)s-%(id)s-%(title)s-'
+               f'{uuid.uuid4().hex[:8]}')
+    ytdl_format_options = {
+        'format': 'bestaudio/best',
+        'restrictfilenames': True,
+        'noplaylist': True,
+        'nocheckcertificate': True,
+        'ignoreerrors': False,
+        'logtostderr': False,
+        'quiet': False,
+        'no_warnings': False,
+        'default_search': 'auto',
+        # bind to ipv4 since ipv6 addresses cause issues sometimes
+        'source_address': '0.0.0.0',
+        # Use the oauth login method to avoid bot detection.
+        'username': 'oauth2',
+        'password': '',
+    }
+    if window is not None:
+        start_millis, end_millis = window
+        # Every frame of the audio codecs we get is a keyframe, so the cut
+        # lands where asked without re-encoding (force_keyframes_at_cuts).
+        ytdl_format_options['download_ranges'] = (
+            youtube_dl.utils.download_range_func(
+                None, [(start_millis / 1000, end_millis / 1000)]))
+        # Different windows of one video must not overwrite each other.
+        outtmpl += '-%(section_start)s-%(section_end)s'
+    ytdl_format_options['outtmpl'] = outtmpl + '.%(ext)s'
+
+    with youtube_dl.YoutubeDL(ytdl_format_options) as ytdl:
+        try:
+            data = ytdl.sanitize_info(ytdl.extract_info(url, download=True))
+        except youtube_dl.utils.YoutubeDLError as e:
+            raise ValueError(f'Couldn\'t download `{url}`.') from e
+        if 'entries' in data:
+            # take first item from a playlist
+            data = data['entries'][0]
+        downloads = data.get('requested_downloads') or []
+        if downloads and downloads[0].get('filepath'):
+            filename = downloads[0]['filepath']
+        else:
+            filename = ytdl.prepare_filename(data)
+    return os.path.relpath(filename), data
+
+
+async def download_source(url: str,
+                          window: tuple[int, int] | None = None
+                         ) -> SourceDownload:
+    """Downloads [start, end) millis of the source at url, or all of it.
+
+    Raises a ValueError if the download fails or the window is past the end
+    of the source.
+    """
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    kind = 'full' if window is None else 'window'
+    _log.info('Downloading %s of %s', window or 'all', url)
+    with metrics.timer(f'source_download_{kind}'):
+        file_path, data = await asyncio.to_thread(_extract, url, window)
+    metrics.increment('source_downloads_total', kind=kind)
+    metrics.increment('source_download_bytes_total',
+                      os.path.getsize(file_path),
+                      kind=kind)
+
+    source_duration_millis = None
+    if data.get('duration'):
+        source_duration_millis = int(data['duration'] * 1000)
+    start_millis, end_millis = window or (0, source_duration_millis)
+    if source_duration_millis is not None and end_millis is not None:
+        end_millis = min(end_millis, source_duration_millis)
+    # ffprobe gives a higher resolution of the duration.
+    duration_millis = await read_audio_length(file_path)
+    if duration_millis is None and end_millis is not None:
+        duration_millis = end_millis - start_millis
+    if not duration_millis or duration_millis <= 0:
+        os.remove(file_path)
+        raise ValueError('There is no audio there, is the start hint past '
+                         'the end of the video?')
+    # A window that reaches both ends of the source is all of it.
+    partial = window is not None and (start_millis > 0 or
+                                      end_millis != source_duration_millis)
+    return SourceDownload(url=url,
+                          file_path=file_path,
+                          duration_millis=duration_millis,
+                          offset_millis=start_millis,
+                          source_duration_millis=source_duration_millis,
+                          partial=partial)
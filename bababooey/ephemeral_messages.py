@@ -0,0 +1,123 @@
+"""Keeps each person's latest short-lived message, deleting the rest.
+
+Commands like /x leave a message per use that is only useful until the next
+one. The registry remembers the latest message per (user, guild), forgets it
+once the TTL passes and queues the ones that were superseded or expired for
+deletion. A single worker deletes the queue one message at a time, through
+each interaction's webhook, paced to stay under Discord's rate limits. Bulk
+deletes can't be used, they don't take interaction responses. Messages too
+old to delete any more (interaction tokens only last so long) are skipped.
+"""
+from collections.abc import Callable
+import asyncio
+import datetime
+import logging
+
+import discord
+
+from bababooey.metrics import metrics
+
+_log = logging.getLogger(__name__)
+
+# An interaction's token, which deletes its response, lasts 15 minutes.
+DEFAULT_MAX_AGE_SECONDS = 15 * 60.0
+DEFAULT_BATCH_SECONDS = 1.0
+# Deletes have a tight rate limit per channel, discord.py waits out any 429s
+# but pacing ourselves avoids them.
+DEFAULT_DELETES_PER_SECOND = 4.0
+
+
+class EphemeralMessageRegistry:
+
+    def __init__(self,
+                 ttl: float,
+                 *,
+                 max_age: float = DEFAULT_MAX_AGE_SECONDS,
+                 batch_seconds: float = DEFAULT_BATCH_SECONDS,
+                 deletes_per_second: float = DEFAULT_DELETES_PER_SECOND,
+                 clock: Callable[[], datetime.datetime] = discord.utils.utcnow):
+        """Messages are deleted once ttl passes, and not after max_age."""
+        self.ttl = ttl
+        self.max_age = max_age
+        self._batch_seconds = batch_seconds
+        self._delete_interval = 1 / deletes_per_second
+        self.clock = clock
+        # (user.id, guild.id) -> their latest message, oldest first.
+        self._latest: dict[tuple[int, int], discord.InteractionMessage] = {}
+        self._pending: list[discord.InteractionMessage] = []
+        self._worker: asyncio.Task | None = None
+        metrics.gauge('ephemeral_messages_tracked', lambda: len(self))
+        metrics.gauge('ephemeral_deletes_pending',
+                      lambda: len(self._pending))
+
+    def __len__(self) -> int:
+        return len(self._latest)
+
+    def _age(self, message: discord.InteractionMessage) -> float:
+        return (self.clock() - message.created_at).total_seconds()
+
+    def track(self, user_id: int, guild_id: int,
+              message: discord.InteractionMessage) -> None:
+        """Makes message the latest, the one it replaces gets deleted.
+
+        If a newer one was tracked while this was being sent, this one is
+        deleted instead.
+        """
+        key = (user_id, guild_id)
+        previous = self._latest.get(key)
+        if previous is not None and previous.created_at > message.created_at:
+            self._pending.append(message)
+            return
+        # Moved to the end, so the dict stays oldest first.
+        self._latest.pop(key, None)
+        self._latest[key] = message
+        if previous is not None:
+            self._pending.append(previous)
+
+    def _too_old(self, message: discord.InteractionMessage) -> bool:
+        if self._age(message) < self.max_age:
+            return False
+        metrics.increment('ephemeral_deletes_total', how='skipped')
+        return True
+
+    def _expire(self) -> None:
+        for key, message in list(self._latest.items()):
+            if self._age(message) < self.ttl:
+                break
+            del self._latest[key]
+            self._pending.append(message)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._batch_seconds)
+            try:
+                self._expire()
+                await self._flush()
+            except Exception:
+                # Whatever went wrong, the worker has to keep going.
+                _log.exception('Failed to delete expired messages')
+
+    async def _flush(self) -> None:
+        pending, self._pending = self._pending, []
+        for message in pending:
+            # The queue may have taken a while to get to it.
+            if not self._too_old(message):
+                await self._delete(message)
+
+    async def _delete(self, message: discord.InteractionMessage) -> None:
+        try:
+            await message.delete()
+            metrics.increment('ephemeral_deletes_total', how='deleted')
+        except discord.NotFound:
+            _log.debug('Message %d was already deleted', message.id)
+        except discord.HTTPException:
+            _log.exception('Failed to delete message %d', message.id)
+        await asyncio.sleep(self._delete_interval)
+
+    def start(self) -> None:
+        self._worker = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
@@ -0,0 +1,379 @@
+"""Audio fingerprints, to catch the same clip being added twice.
+
+A clip's fingerprint is one 32-bit word per ~11ms of audio, in the style of
+Haitsma and Kalker's: each bit is whether the energy difference between two
+neighbouring frequency bands went up or down since the previous frame. It
+survives re-encoding, volume changes and slightly different trims. Two clips
+are near duplicates when, lined up at the offset most of their words agree
+on, few enough bits differ.
+
+The index keeps every word of every sound effect in one sorted NumPy array,
+so the candidates for a clip are found by binary search on its words rather
+than comparing it to the whole library. Fingerprints are stored in their own
+shelve next to the catalog, and ones that are missing or out of date (the
+clip was edited) are computed in the background, at startup and after
+changes.
+
+NumPy is only needed when this is used.
+"""
+from collections import Counter
+from collections.abc import Sequence
+import asyncio
+import logging
+import shelve
+import threading
+
+from bababooey import SoundEffect, SoundEffectData
+from bababooey.catalog import Catalog
+from bababooey.metrics import metrics
+from bababooey.pcm import CHANNELS, SAMPLE_RATE, decode_pcm
+from bababooey.subprocess_scheduler import Priority
+
+_log = logging.getLogger(__name__)
+
+FINGERPRINTS_PATH = 'data/fingerprints'
+# Decoded audio is averaged down to 6kHz, plenty for the bands below.
+DOWNSAMPLE = 8
+FRAME_SAMPLES = 2048
+HOP_SAMPLES = 64
+BAND_LOW_HZ = 300
+BAND_HIGH_HZ = 2000
+# One more band than bits, bits compare neighbouring bands.
+BANDS = 33
+# Frames are transformed this many at a time, to bound memory on long clips.
+FRAMES_PER_CHUNK = 512
+# Candidates need this many words in common with the clip.
+MIN_COMMON_WORDS = 3
+# Words shared by more frames than this (e.g. near silence) say nothing.
+MAX_POSTINGS = 2000
+# Offsets tried per candidate, the ones most common words agree on.
+OFFSETS_TRIED = 3
+# Near duplicates differ in fewer than this fraction of bits where they
+# overlap, and overlap for at least this much of the longer one.
+MAX_BIT_ERROR_RATE = 0.3
+MIN_OVERLAP = 0.7
+
+ClipKey = tuple[str, int | None, int | None]
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise ValueError(
+            'Fingerprinting sound effects needs the `numpy` package installed.'
+        ) from e
+    return numpy
+
+
+def _clip_key(sfx_data: SoundEffectData) -> ClipKey:
+    return (sfx_data.file_path, sfx_data.start_millis, sfx_data.end_millis)
+
+
+def fingerprint_pcm(pcm: bytes | memoryview) -> bytes:
+    """The fingerprint of 48kHz 16-bit stereo PCM, as packed 32-bit words.
+
+    Empty if the audio is shorter than one frame.
+    """
+    np = _numpy()
+    samples = np.frombuffer(pcm, dtype='<i2').astype(np.float32)
+    mono = samples[:len(samples) // CHANNELS * CHANNELS].reshape(
+        -1, CHANNELS).mean(axis=1)
+    mono = mono[:len(mono) // DOWNSAMPLE * DOWNSAMPLE].reshape(
+        -1, DOWNSAMPLE).mean(axis=1)
+    if len(mono) < FRAME_SAMPLES + HOP_SAMPLES:
+        return b''
+    rate = SAMPLE_RATE / DOWNSAMPLE
+    edges = np.round(
+        np.geomspace(BAND_LOW_HZ, BAND_HIGH_HZ, BANDS + 1) * FRAME_SAMPLES /
+        rate).astype(np.intp)
+    window = np.hanning(FRAME_SAMPLES).astype(np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(mono,
+                                                      FRAME_SAMPLES)[::HOP_SAMPLES]
+    energies = []
+    for i in range(0, len(frames), FRAMES_PER_CHUNK):
+        spectrum = np.abs(
+            np.fft.rfft(frames[i:i + FRAMES_PER_CHUNK] * window, axis=1))**2
+        energies.append(
+            np.add.reduceat(spectrum[:, edges[0]:edges[-1]],
+                            edges[:-1] - edges[0],
+                            axis=1))
+    band_differences = np.diff(np.concatenate(energies), axis=1)
+    bits = (band_differences[1:] - band_differences[:-1]) > 0
+    return np.packbits(bits, axis=1, bitorder='little').view('<u4').tobytes()
+
+
+async def fingerprint_clip(
+        sfx_data: SoundEffectData,
+        priority: Priority = Priority.BACKGROUND) -> bytes:
+    """Decodes the sound effect's range and fingerprints it.
+
+    Raises a ValueError if it can't be decoded.
+    """
+    pcm = await decode_pcm(sfx_data.file_path,
+                           sfx_data.start_millis,
+                           sfx_data.end_millis,
+                           priority=priority)
+    try:
+        return await asyncio.to_thread(fingerprint_pcm, pcm.slice())
+    finally:
+        pcm.release()
+
+
+def _bit_error_rate(a, b) -> float:
+    """The fewest differing bits between a and b at a plausible offset.
+
+    1.0 if they don't overlap enough to compare.
+    """
+    np = _numpy()
+    _, in_a, in_b = np.intersect1d(a, b, return_indices=True)
+    best = 1.0
+    for offset, _ in Counter((in_b - in_a).tolist()).most_common(OFFSETS_TRIED):
+        # a[i] lines up with b[i + offset].
+        start = max(0, -offset)
+        end = min(len(a), len(b) - offset)
+        if end <= start or end - start < MIN_OVERLAP * max(len(a), len(b)):
+            continue
+        different = np.bitwise_xor(a[start:end], b[start + offset:end + offset])
+        errors = np.unpackbits(different.view(np.uint8)).sum()
+        best = min(best, float(errors / (32 * (end - start))))
+    return best
+
+
+class FingerprintIndex:
+    """Fingerprints by sound effect num, searchable by their words.
+
+    Safe to search from a thread while fingerprints are added or removed.
+    """
+
+    def __init__(self):
+        np = _numpy()
+        self._np = np
+        self._lock = threading.RLock()
+        self._fingerprints: dict = {}
+        # Every word and the num it came from, sorted by word. Rebuilt the
+        # next search after a change.
+        self._words = np.empty(0, dtype=np.uint32)
+        self._nums = np.empty(0, dtype=np.int64)
+        self._stale = False
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def __contains__(self, num: int) -> bool:
+        return num in self._fingerprints
+
+    def add(self, num: int, fingerprint: bytes) -> None:
+        with self._lock:
+            self._fingerprints[num] = self._np.frombuffer(fingerprint,
+                                                          dtype='<u4')
+            self._stale = True
+
+    def remove(self, num: int) -> None:
+        with self._lock:
+            if self._fingerprints.pop(num, None) is not None:
+                self._stale = True
+
+    def _rebuild(self) -> None:
+        np = self._np
+        if self._fingerprints:
+            words = np.concatenate(list(self._fingerprints.values()))
+            nums = np.concatenate([
+                np.full(len(fingerprint), num, dtype=np.int64)
+                for num, fingerprint in self._fingerprints.items()
+            ])
+        else:
+            words = np.empty(0, dtype=np.uint32)
+            nums = np.empty(0, dtype=np.int64)
+        order = np.argsort(words, kind='stable')
+        self._words = words[order]
+        self._nums = nums[order]
+        self._stale = False
+
+    def matches(self,
+                fingerprint: bytes,
+                exclude: int | None = None) -> list[tuple[int, float]]:
+        """(num, bit error rate) of near duplicates, closest first."""
+        with self._lock:
+            return self._matches(fingerprint, exclude)
+
+    def _matches(self, fingerprint: bytes,
+                 exclude: int | None) -> list[tuple[int, float]]:
+        np = self._np
+        if self._stale:
+            self._rebuild()
+        query = np.frombuffer(fingerprint, dtype='<u4')
+        if not len(query):
+            return []
+        words = np.unique(query)
+        left = np.searchsorted(self._words, words, side='left')
+        right = np.searchsorted(self._words, words, side='right')
+        counts = right - left
+        useful = (counts > 0) & (counts <= MAX_POSTINGS)
+        left, counts = left[useful], counts[useful]
+        # Every posting of every word, as indexes into _words.
+        postings = (np.repeat(left - np.cumsum(counts) + counts, counts) +
+                    np.arange(counts.sum()))
+        candidates, common = np.unique(self._nums[postings],
+                                       return_counts=True)
+        result = []
+        for num in candidates[common >= MIN_COMMON_WORDS].tolist():
+            if num == exclude:
+                continue
+            error_rate = _bit_error_rate(query, self._fingerprints[num])
+            if error_rate < MAX_BIT_ERROR_RATE:
+                result.append((num, error_rate))
+        result.sort(key=lambda match: match[1])
+        return result
+
+    def clusters(self) -> list[list[int]]:
+        """Groups of nums that are near duplicates of each other.
+
+        Transitively, if a matches b and b matches c they're all one group.
+        """
+        # On a copy, so it doesn't hold up adds for the whole library.
+        copy = FingerprintIndex()
+        with self._lock:
+            copy._fingerprints = dict(self._fingerprints)
+        copy._stale = True
+        return copy._clusters()
+
+    def _clusters(self) -> list[list[int]]:
+        parents = {num: num for num in self._fingerprints}
+
+        def root(num: int) -> int:
+            while parents[num] != num:
+                parents[num] = parents[parents[num]]
+                num = parents[num]
+            return num
+
+        for num, fingerprint in self._fingerprints.items():
+            for other, _ in self._matches(fingerprint.tobytes(), num):
+                parents[root(other)] = root(num)
+        groups: dict[int, list[int]] = {}
+        for num in parents:
+            groups.setdefault(root(num), []).append(num)
+        return sorted((sorted(g) for g in groups.values() if len(g) > 1),
+                      key=lambda g: g[0])
+
+
+class DuplicateFinder:
+    """Keeps a FingerprintIndex of the catalog, and stored, up to date."""
+
+    def __init__(self, catalog: Catalog):
+        self._catalog = catalog
+        self.index = FingerprintIndex()
+        self._task: asyncio.Task | None = None
+        # Set once everything in the catalog has been fingerprinted, or
+        # failed to be.
+        self.backfilled = asyncio.Event()
+        # Set when there may be sound effects without a fingerprint.
+        self._missing = asyncio.Event()
+        # Clips that couldn't be decoded, not retried until they're edited.
+        self._failed: set[ClipKey] = set()
+        # Deleted nums still to be dropped from the shelve.
+        self._deleted: set[int] = set()
+        catalog.add_change_listener(self._forget_changed)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _forget_changed(self, before: SoundEffectData,
+                        after: SoundEffectData | None) -> None:
+        if after is not None and _clip_key(before) == _clip_key(after):
+            return
+        self.index.remove(before.num)
+        if after is None:
+            self._deleted.add(before.num)
+        self._missing.set()
+
+    def refresh(self) -> None:
+        """Fingerprints new sound effects in the background."""
+        self._missing.set()
+
+    def _load(self) -> dict[int, tuple[ClipKey, bytes]]:
+        with shelve.open(FINGERPRINTS_PATH) as s:
+            return {int(num): stored for num, stored in s.items()}
+
+    def _store(self, num: int, key: ClipKey, fingerprint: bytes) -> None:
+        with shelve.open(FINGERPRINTS_PATH) as s:
+            s[str(num)] = (key, fingerprint)
+
+    def _drop(self, nums: set[int]) -> None:
+        with shelve.open(FINGERPRINTS_PATH) as s:
+            for num in nums:
+                s.pop(str(num), None)
+
+    async def _drop_deleted(self, stored: dict[int, tuple[ClipKey,
+                                                          bytes]]) -> None:
+        deleted, self._deleted = self._deleted, set()
+        deleted.intersection_update(stored)
+        if not deleted:
+            return
+        await asyncio.to_thread(self._drop, deleted)
+        for num in deleted:
+            del stored[num]
+
+    async def _run(self) -> None:
+        stored = await asyncio.to_thread(self._load)
+        # Deleted while nothing was listening.
+        self._deleted.update(
+            num for num in stored if self._catalog.by_num(num) is None)
+        while True:
+            self._missing.clear()
+            await self._drop_deleted(stored)
+            await self._backfill(stored)
+            self.backfilled.set()
+            _log.info('Fingerprinted %d sound effects', len(self.index))
+            await self._missing.wait()
+
+    async def _backfill(self, stored: dict[int, tuple[ClipKey,
+                                                      bytes]]) -> None:
+        for sfx in self._catalog.all():
+            key = _clip_key(sfx.data)
+            if sfx.num in self.index or key in self._failed:
+                continue
+            previous = stored.get(sfx.num)
+            if previous is not None and previous[0] == key:
+                self.index.add(sfx.num, previous[1])
+                continue
+            try:
+                fingerprint = await fingerprint_clip(sfx.data)
+            except ValueError:
+                _log.exception('Failed to fingerprint %s', sfx.name)
+                self._failed.add(key)
+                continue
+            # It may have been edited or deleted while this was decoding.
+            if _clip_key(sfx.data) != key or self._catalog.by_num(
+                    sfx.num) is None:
+                continue
+            await asyncio.to_thread(self._store, sfx.num, key, fingerprint)
+            stored[sfx.num] = (key, fingerprint)
+            self.index.add(sfx.num, fingerprint)
+            metrics.increment('fingerprints_computed_total')
+
+    async def find(self, sfx_data: SoundEffectData) -> Sequence[SoundEffect]:
+        """Existing sound effects that sound like sfx_data, closest first.
+
+        Raises a ValueError if its audio can't be decoded.
+        """
+        fingerprint = await fingerprint_clip(sfx_data, Priority.PREVIEW)
+        matches = await asyncio.to_thread(self.index.matches, fingerprint,
+                                          sfx_data.num)
+        return [
+            sfx for num, _ in matches
+            if (sfx := self._catalog.by_num(num)) is not None
+        ]
+
+    async def clusters(self) -> list[list[SoundEffect]]:
+        """Every group of sound effects that are near duplicates."""
+        clusters = await asyncio.to_thread(self.index.clusters)
+        return [[
+            sfx for num in cluster
+            if (sfx := self._catalog.by_num(num)) is not None
+        ] for cluster in clusters]
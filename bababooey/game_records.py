@@ -0,0 +1,304 @@
+"""Results of guess_sound rounds, the credits ledger and leaderboards.
+
+Every round and credit change is written to SQLite. The leaderboards are
+kept in memory, counted in Fenwick trees, so /leaderboard never has to
+aggregate the results table; they are rebuilt from SQLite once at startup and then
+updated in place after each round.
+"""
+from collections.abc import Sequence
+import asyncio
+import bisect
+import dataclasses
+import datetime
+import enum
+import math
+import os
+import sqlite3
+import threading
+
+GAME_RECORDS_DB_PATH = 'data/game_records.db'
+
+MIN_CREDITS = 100
+MAX_CREDITS = 1000
+# Scores are counted in buckets this fine, ties within one are sorted exactly.
+_BUCKETS_PER_UNIT = 1000
+# Every bucket, negative or not, is offset into 1..2**_INDEX_BITS.
+_INDEX_BITS = 64
+_INDEX_OFFSET = 2**(_INDEX_BITS - 1)
+
+
+class Board(enum.Enum):
+    FASTEST = 'fastest'
+    WINS = 'wins'
+    RICHEST = 'richest'
+
+
+@dataclasses.dataclass
+class RunnerUp:
+    user_id: int
+    seconds_behind: float
+
+
+@dataclasses.dataclass
+class RoundResult:
+    round_id: int
+    credits: int
+    balance: int
+    # 1 based rank on the fastest board, with this round included.
+    fastest_rank: int
+    personal_best: bool
+
+
+def credits_for(letters_hidden: int, letters_total: int) -> int:
+    """The fewer letters it took, the bigger the prize."""
+    if letters_total <= 0:
+        return MIN_CREDITS
+    return MIN_CREDITS + (MAX_CREDITS - MIN_CREDITS) * letters_hidden // letters_total
+
+
+class _FenwickTree:
+    """Counts per index in 1..2**bits, storing only the nodes in use."""
+
+    def __init__(self, bits: int):
+        self._size = 2**bits
+        self._tree: dict[int, int] = {}
+
+    def add(self, index: int, delta: int) -> None:
+        while index <= self._size:
+            count = self._tree.get(index, 0) + delta
+            if count:
+                self._tree[index] = count
+            else:
+                del self._tree[index]
+            index += index & -index
+
+    def prefix(self, index: int) -> int:
+        """How many are counted at index or below."""
+        total = 0
+        while index > 0:
+            total += self._tree.get(index, 0)
+            index -= index & -index
+        return total
+
+    def find(self, k: int) -> int:
+        """The lowest index with more than k counted at or below it."""
+        index = 0
+        step = self._size
+        while step:
+            count = self._tree.get(index + step, 0)
+            if index + step <= self._size and count <= k:
+                index += step
+                k -= count
+            step //= 2
+        return index + 1
+
+
+class _RankedBoard:
+    """Scores per user, ranked best first.
+
+    Users are counted per score bucket in a Fenwick tree, so inserts and
+    ranks take O(log) steps however many play. Each bucket keeps its few
+    users sorted to break ties exactly.
+    """
+
+    def __init__(self, higher_is_better: bool):
+        self._higher_is_better = higher_is_better
+        self._scores: dict[int, float] = {}
+        self._counts = _FenwickTree(_INDEX_BITS)
+        # Fenwick tree index -> the sorted keys in that bucket.
+        self._buckets: dict[int, list[tuple[float, int]]] = {}
+
+    def _key(self, user_id: int, score: float) -> tuple[float, int]:
+        return (-score if self._higher_is_better else score, user_id)
+
+    def _index(self, key: tuple[float, int]) -> int:
+        return math.floor(key[0] * _BUCKETS_PER_UNIT) + _INDEX_OFFSET + 1
+
+    def _insert(self, key: tuple[float, int]) -> None:
+        index = self._index(key)
+        bisect.insort(self._buckets.setdefault(index, []), key)
+        self._counts.add(index, 1)
+
+    def _remove(self, key: tuple[float, int]) -> None:
+        index = self._index(key)
+        bucket = self._buckets[index]
+        del bucket[bisect.bisect_left(bucket, key)]
+        if not bucket:
+            del self._buckets[index]
+        self._counts.add(index, -1)
+
+    def load(self, scores: dict[int, float]) -> None:
+        self._scores = {}
+        self._counts = _FenwickTree(_INDEX_BITS)
+        self._buckets = {}
+        for user_id, score in scores.items():
+            self.set(user_id, score)
+
+    def get(self, user_id: int) -> float | None:
+        return self._scores.get(user_id)
+
+    def set(self, user_id: int, score: float) -> None:
+        if user_id in self._scores:
+            self._remove(self._key(user_id, self._scores[user_id]))
+        self._scores[user_id] = score
+        self._insert(self._key(user_id, score))
+
+    def rank(self, user_id: int) -> int | None:
+        if user_id not in self._scores:
+            return None
+        key = self._key(user_id, self._scores[user_id])
+        index = self._index(key)
+        return (self._counts.prefix(index - 1) +
+                bisect.bisect_left(self._buckets[index], key) + 1)
+
+    def top(self, n: int) -> list[tuple[int, float]]:
+        n = min(n, len(self._scores))
+        top = []
+        while len(top) < n:
+            bucket = self._buckets[self._counts.find(len(top))]
+            top.extend((user_id, self._scores[user_id])
+                       for _, user_id in bucket[:n - len(top)])
+        return top
+
+
+class _GuildBoards:
+
+    def __init__(self):
+        self.fastest = _RankedBoard(higher_is_better=False)
+        self.wins = _RankedBoard(higher_is_better=True)
+        self.richest = _RankedBoard(higher_is_better=True)
+
+    def board(self, board: Board) -> _RankedBoard:
+        return getattr(self, board.value)
+
+
+class GameRecords:
+    """Stores guess_sound results and credits, and ranks players."""
+
+    def __init__(self, db_path: str = GAME_RECORDS_DB_PATH):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._con = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._create_tables_if_missing()
+        self._boards: dict[int, _GuildBoards] = {}
+        self._load_boards()
+
+    def _create_tables_if_missing(self) -> None:
+        with self._lock, self._con:
+            self._con.execute('CREATE TABLE IF NOT EXISTS guess_rounds('
+                              'id INTEGER PRIMARY KEY, datetime, guild_id, '
+                              'num, winner_id, solve_seconds, letters_hidden, '
+                              'letters_total)')
+            self._con.execute('CREATE TABLE IF NOT EXISTS guess_runners_up('
+                              'round_id, user_id, seconds_behind)')
+            self._con.execute('CREATE TABLE IF NOT EXISTS credits_ledger('
+                              'id INTEGER PRIMARY KEY, datetime, guild_id, '
+                              'user_id, delta, reason, round_id)')
+
+    def _guild(self, guild_id: int) -> _GuildBoards:
+        if guild_id not in self._boards:
+            self._boards[guild_id] = _GuildBoards()
+        return self._boards[guild_id]
+
+    def _load_boards(self) -> None:
+        fastest: dict[int, dict[int, float]] = {}
+        wins: dict[int, dict[int, float]] = {}
+        richest: dict[int, dict[int, float]] = {}
+        with self._lock:
+            for guild_id, user_id, best, count in self._con.execute(
+                    'SELECT guild_id, winner_id, MIN(solve_seconds), COUNT(*) '
+                    'FROM guess_rounds GROUP BY guild_id, winner_id'):
+                fastest.setdefault(guild_id, {})[user_id] = best
+                wins.setdefault(guild_id, {})[user_id] = count
+            for guild_id, user_id, balance in self._con.execute(
+                    'SELECT guild_id, user_id, SUM(delta) FROM credits_ledger '
+                    'GROUP BY guild_id, user_id'):
+                richest.setdefault(guild_id, {})[user_id] = balance
+        for guild_id in fastest.keys() | richest.keys():
+            boards = self._guild(guild_id)
+            boards.fastest.load(fastest.get(guild_id, {}))
+            boards.wins.load(wins.get(guild_id, {}))
+            boards.richest.load(richest.get(guild_id, {}))
+
+    def _write_round(self, guild_id: int, num: int, winner_id: int,
+                     solve_seconds: float, letters_hidden: int,
+                     letters_total: int, runners_up: Sequence[RunnerUp],
+                     credits: int) -> int:
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        with self._lock, self._con:
+            round_id = self._con.execute(
+                'INSERT INTO guess_rounds(datetime, guild_id, num, winner_id, '
+                'solve_seconds, letters_hidden, letters_total) '
+                'VALUES(?, ?, ?, ?, ?, ?, ?)',
+                (now, guild_id, num, winner_id, solve_seconds, letters_hidden,
+                 letters_total)).lastrowid
+            self._con.executemany(
+                'INSERT INTO guess_runners_up VALUES(?, ?, ?)',
+                [(round_id, r.user_id, r.seconds_behind) for r in runners_up])
+            self._con.execute(
+                'INSERT INTO credits_ledger(datetime, guild_id, user_id, '
+                'delta, reason, round_id) VALUES(?, ?, ?, ?, ?, ?)',
+                (now, guild_id, winner_id, credits, 'guess_sound', round_id))
+        return round_id
+
+    def _apply_round(self, round_id: int, guild_id: int, winner_id: int,
+                     solve_seconds: float, credits: int) -> RoundResult:
+        boards = self._guild(guild_id)
+        previous_best = boards.fastest.get(winner_id)
+        personal_best = previous_best is None or solve_seconds < previous_best
+        if personal_best:
+            boards.fastest.set(winner_id, solve_seconds)
+        boards.wins.set(winner_id, (boards.wins.get(winner_id) or 0) + 1)
+        balance = (boards.richest.get(winner_id) or 0) + credits
+        boards.richest.set(winner_id, balance)
+        return RoundResult(round_id=round_id,
+                           credits=credits,
+                           balance=balance,
+                           fastest_rank=boards.fastest.rank(winner_id),
+                           personal_best=personal_best)
+
+    def record_round(self, *, guild_id: int, num: int, winner_id: int,
+                     solve_seconds: float, letters_hidden: int,
+                     letters_total: int,
+                     runners_up: Sequence[RunnerUp]) -> RoundResult:
+        """Saves a solved round and pays the winner, all or nothing."""
+        credits = credits_for(letters_hidden, letters_total)
+        round_id = self._write_round(guild_id, num, winner_id, solve_seconds,
+                                     letters_hidden, letters_total, runners_up,
+                                     credits)
+        return self._apply_round(round_id, guild_id, winner_id, solve_seconds,
+                                 credits)
+
+    async def record_round_async(self, *, guild_id: int, num: int,
+                                 winner_id: int, solve_seconds: float,
+                                 letters_hidden: int, letters_total: int,
+                                 runners_up: Sequence[RunnerUp]) -> RoundResult:
+        """record_round, with the SQLite write off the event loop.
+
+        The leaderboards are only updated back on the loop, once the
+        transaction has committed, so readers never see a half applied round.
+        """
+        credits = credits_for(letters_hidden, letters_total)
+        round_id = await asyncio.to_thread(self._write_round, guild_id, num,
+                                           winner_id, solve_seconds,
+                                           letters_hidden, letters_total,
+                                           runners_up, credits)
+        return self._apply_round(round_id, guild_id, winner_id, solve_seconds,
+                                 credits)
+
+    def top(self, guild_id: int, board: Board,
+            n: int = 10) -> list[tuple[int, float]]:
+        """Returns [(user_id, score)] best first."""
+        if guild_id not in self._boards:
+            return []
+        return self._boards[guild_id].board(board).top(n)
+
+    def rank(self, guild_id: int, board: Board, user_id: int) -> int | None:
+        if guild_id not in self._boards:
+            return None
+        return self._boards[guild_id].board(board).rank(user_id)
+
+    def balance(self, guild_id: int, user_id: int) -> int:
+        if guild_id not in self._boards:
+            return 0
+        return int(self._boards[guild_id].richest.get(user_id) or 0)
@@ -1,10 +1,16 @@
-from collections.abc import Sequence
+from collections.abc import Iterator, Sequence
+import asyncio
+import contextlib
 import datetime
+import math
 import os
 import sqlite3
+import threading
 
 import discord
 
+HISTORY_DB_PATH = 'data/user_sound_effect_history.db'
+
 
 class UserSoundEffectHistory:
     """Stores a mapping from users to sound effect usage history."""
@@ -12,39 +18,67 @@ class UserSoundEffectHistory:
     def __init__(self):
         if not os.path.exists('data/'):
             os.makedirs('data/')
-        self._con = sqlite3.connect('data/user_sound_effect_history.db')
+        # Writes happen off the event loop, the lock keeps each use of the
+        # connection to one thread at a time.
+        self._con = sqlite3.connect(HISTORY_DB_PATH, check_same_thread=False)
+        self._lock = threading.Lock()
         self._create_table_if_missing()
 
     def _create_table_if_missing(self):
         cur = self._con.cursor()
-        res = cur.execute('SELECT name FROM sqlite_master').fetchone()
-        if res is not None and 'user_history' in res:
-            return
-        cur.execute(
-            'CREATE TABLE user_history(datetime, user_id, guild_id, num)')
+        # Readers on their own connections then never block plays being
+        # recorded, nor the other way around.
+        cur.execute('PRAGMA journal_mode=WAL')
+        cur.execute('CREATE TABLE IF NOT EXISTS '
+                    'user_history(datetime, user_id, guild_id, num)')
+        # Everything that reads a lot of history reads the newest first.
+        cur.execute('CREATE INDEX IF NOT EXISTS '
+                    'user_history_datetime ON user_history(datetime)')
         self._con.commit()
         cur.close()
 
+    @contextlib.contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """A connection of its own for long reads, which skip the lock."""
+        con = sqlite3.connect(HISTORY_DB_PATH)
+        # SQLite's own exp() is only there when compiled in.
+        con.create_function('py_exp', 1, math.exp, deterministic=True)
+        try:
+            yield con
+        finally:
+            con.close()
+
     def record_usage(self, user: discord.Member, effect_num: int) -> None:
         """Records user playing sound effect with effect_num."""
         now = datetime.datetime.now(datetime.timezone.utc).isoformat()
-        cur = self._con.cursor()
-        cur.execute('INSERT INTO user_history VALUES(?, ?, ?, ?)',
-                    (now, user.id, user.guild.id, effect_num))
-        self._con.commit()
-        cur.close()
+        with self._lock:
+            cur = self._con.cursor()
+            cur.execute('INSERT INTO user_history VALUES(?, ?, ?, ?)',
+                        (now, user.id, user.guild.id, effect_num))
+            self._con.commit()
+            cur.close()
+
+    async def record_usage_async(self, user: discord.Member,
+                                 effect_num: int) -> None:
+        """Like record_usage, but the commit doesn't block the event loop."""
+        await asyncio.to_thread(self.record_usage, user, effect_num)
 
     def users_most_recent(self, user: discord.Member,
                           limit: int) -> Sequence[int]:
         """Returns at most limit number of most recent sfx_nums that user used."""
-        cur = self._con.cursor()
-        res = [
-            row[1] for row in cur.execute(
-                'SELECT MAX(datetime) AS most_recent_use, num FROM user_history WHERE user_id=? GROUP BY num ORDER BY most_recent_use DESC',
-                (user.id,))
-        ]
+        with self._lock:
+            cur = self._con.cursor()
+            res = [
+                row[1] for row in cur.execute(
+                    'SELECT MAX(datetime) AS most_recent_use, num FROM user_history WHERE user_id=? GROUP BY num ORDER BY most_recent_use DESC',
+                    (user.id,))
+            ]
         return res[0:limit]
 
+    async def users_most_recent_async(self, user: discord.Member,
+                                      limit: int) -> Sequence[int]:
+        return await asyncio.to_thread(self.users_most_recent, user, limit)
+
     def fetch_all_history(
             self) -> Sequence[tuple[datetime.datetime, int, int, int]]:
         """Return all the history.
@@ -52,10 +86,45 @@ class UserSoundEffectHistory:
         Each row is in this format:
         (utc_datetime, user_id, guild_id, sfx_num)
         """
-        cur = self._con.cursor()
-        res = [[
-            datetime.datetime.fromisoformat(row[0]), row[1], row[2], row[3]
-        ] for row in cur.execute(
-            'SELECT datetime, user_id, guild_id, num FROM user_history')]
+        with self._reader() as con:
+            res = [[
+                datetime.datetime.fromisoformat(row[0]), row[1], row[2], row[3]
+            ] for row in con.execute(
+                'SELECT datetime, user_id, guild_id, num FROM user_history')]
         res.sort(key=lambda x: x[0], reverse=True)
-        return res
\ No newline at end of file
+        return res
+
+    def fetch_recent_history(
+            self,
+            limit: int,
+            guild_id: int | None = None
+    ) -> Sequence[tuple[datetime.datetime, int, int, int]]:
+        """Like fetch_all_history, but only the newest limit rows.
+
+        Optionally only those from guild_id.
+        """
+        query = 'SELECT datetime, user_id, guild_id, num FROM user_history'
+        params: tuple = ()
+        if guild_id is not None:
+            query += ' WHERE guild_id=?'
+            params = (guild_id,)
+        query += ' ORDER BY datetime DESC LIMIT ?'
+        with self._reader() as con:
+            return [(datetime.datetime.fromisoformat(row[0]), row[1], row[2],
+                     row[3]) for row in con.execute(query, params + (limit,))]
+
+    def fetch_decayed_counts(
+            self, rate: float, epoch: datetime.datetime
+    ) -> Sequence[tuple[int, int, int, float]]:
+        """Sums exp(rate * seconds from epoch) over each one's plays.
+
+        Each row is in this format:
+        (guild_id, user_id, sfx_num, decayed_count)
+        """
+        # julianday() reads the stored ISO strings, counting ones without an
+        # offset as UTC.
+        query = ('SELECT guild_id, user_id, num, SUM(py_exp(? * 86400.0 * '
+                 '(julianday(datetime) - julianday(?)))) FROM user_history '
+                 'GROUP BY guild_id, user_id, num')
+        with self._reader() as con:
+            return con.execute(query, (rate, epoch.isoformat())).fetchall()
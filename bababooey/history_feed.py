@@ -0,0 +1,211 @@
+"""A live message of recent plays at the bottom of each soundboard channel.
+
+Plays come off the catalog's event bus into a ring buffer per guild, and the
+message is re-rendered from that buffer. Each guild's message is edited at
+most once every min_edit_seconds: the first play after a quiet spell shows up
+straight away, and everything played while waiting goes into the next edit.
+However fast people play sounds, the feed costs a fixed number of API calls,
+well inside Discord's per-channel edit limits.
+
+Writes share a lock with soundboard redraws, which delete the feed and send
+the pages again. A new feed message is only sent once a redraw asks for it,
+so it can't land between the pages.
+"""
+from collections import deque
+from collections.abc import Mapping
+import asyncio
+import dataclasses
+import datetime
+import logging
+
+import discord
+
+from bababooey import Catalog, MemberResolver
+from bababooey.metrics import metrics
+from bababooey.ui import page_of_message
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_SIZE = 15
+# Discord allows around 5 edits per 5 seconds in a channel, and the
+# soundboard's own redraws share that.
+DEFAULT_MIN_EDIT_SECONDS = 3.0
+TITLE = '**Recently played**'
+
+
+@dataclasses.dataclass(frozen=True)
+class FeedEntry:
+    timestamp: datetime.datetime
+    display_name: str
+    # Looked up when rendering, so edits and deletes show up.
+    sfx_num: int
+
+
+class _GuildFeed:
+
+    def __init__(self, channel_id: int, size: int):
+        self.channel_id = channel_id
+        # Newest first.
+        self.entries: deque[FeedEntry] = deque(maxlen=size)
+        self.dirty = asyncio.Event()
+        self.message: discord.Message | None = None
+        # The message was deleted, nothing is sent until the next repost.
+        self.lost = False
+
+
+class HistoryFeed:
+    """Keeps one recent plays message per guild in channels up to date."""
+
+    def __init__(self,
+                 bot: discord.Client,
+                 catalog: Catalog,
+                 member_resolver: MemberResolver,
+                 channels: Mapping[int, int],
+                 size: int = DEFAULT_SIZE,
+                 min_edit_seconds: float = DEFAULT_MIN_EDIT_SECONDS,
+                 drawing_lock: asyncio.Lock | None = None):
+        """drawing_lock is held by whatever redraws the soundboards."""
+        self._bot = bot
+        self._catalog = catalog
+        self._member_resolver = member_resolver
+        self._min_edit_seconds = min_edit_seconds
+        self._drawing_lock = drawing_lock or asyncio.Lock()
+        # guild.id -> its feed, for every guild with a soundboard channel.
+        self._feeds = {
+            guild_id: _GuildFeed(channel_id, size)
+            for guild_id, channel_id in channels.items()
+        }
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def repost(self, guild_id: int) -> None:
+        """Sends a new message at the bottom of the channel next time.
+
+        For after a soundboard redraw, which deletes the old one.
+        """
+        feed = self._feeds.get(guild_id)
+        if feed is not None:
+            feed.message = None
+            feed.lost = False
+            feed.dirty.set()
+
+    def render(self, guild_id: int) -> str:
+        lines = [TITLE]
+        for entry in self._feeds[guild_id].entries:
+            sfx = self._catalog.by_num(entry.sfx_num)
+            if sfx is None:
+                label = f'{chr(0x274c)}`{"(deleted)":>12}`'
+            else:
+                label = f'{sfx.emoji}`{sfx.name:>12}`'
+            lines.append(f'{discord.utils.format_dt(entry.timestamp, "T")} '
+                         f'{label} {entry.display_name}')
+        if len(lines) == 1:
+            lines.append('Nothing yet.')
+        return '\n'.join(lines)
+
+    async def _seed(self, guild_id: int, feed: _GuildFeed) -> None:
+        history = await self._catalog.recent_history_async(
+            feed.entries.maxlen, guild_id)
+        guild = self._bot.get_guild(guild_id)
+        if guild is None:
+            names = {}
+        else:
+            names = {
+                user_id: info.display_name
+                for user_id, info in (await self._member_resolver.resolve_many(
+                    guild, (user_id for _, user_id, _, _ in history))).items()
+            }
+        # Newest first, like the buffer. Plays that arrived while seeding are
+        # already in it and newer than all of these.
+        for dt, user_id, _, sfx in history:
+            if len(feed.entries) == feed.entries.maxlen:
+                break
+            if feed.entries and dt >= feed.entries[-1].timestamp:
+                continue
+            if sfx is not None:
+                feed.entries.append(
+                    FeedEntry(dt, names.get(user_id, f'<@{user_id}>'),
+                              sfx.num))
+        feed.dirty.set()
+
+    async def _run(self) -> None:
+        # Subscribe before seeding so no play falls in between.
+        with self._catalog.playback_events.subscribe(
+                lambda event: event.guild_id in self._feeds) as plays:
+            writers = [
+                asyncio.create_task(self._write_forever(guild_id, feed))
+                for guild_id, feed in self._feeds.items()
+            ]
+            try:
+                for guild_id, feed in self._feeds.items():
+                    try:
+                        await self._seed(guild_id, feed)
+                    except Exception:
+                        _log.exception('Failed to seed the history feed for %d',
+                                       guild_id)
+                async for event in plays:
+                    feed = self._feeds[event.guild_id]
+                    feed.entries.appendleft(
+                        FeedEntry(event.timestamp, event.user.display_name,
+                                  event.sfx.num))
+                    feed.dirty.set()
+                    metrics.increment('history_feed_plays_total',
+                                      guild=event.guild_id)
+            finally:
+                for writer in writers:
+                    writer.cancel()
+
+    async def _write_forever(self, guild_id: int, feed: _GuildFeed) -> None:
+        while True:
+            await feed.dirty.wait()
+            feed.dirty.clear()
+            await self._flush(guild_id, feed)
+            # Plays during the wait are all shown by the next edit.
+            await asyncio.sleep(self._min_edit_seconds)
+
+    async def _flush(self, guild_id: int, feed: _GuildFeed) -> None:
+        # Waits out a redraw, which reposts the feed when it's done.
+        async with self._drawing_lock:
+            if feed.lost:
+                return
+            content = self.render(guild_id)
+            try:
+                if feed.message is None:
+                    feed.message = await self._find_or_send(feed, content)
+                else:
+                    await feed.message.edit(
+                        content=content,
+                        allowed_mentions=discord.AllowedMentions.none())
+                metrics.increment('history_feed_edits_total', guild=guild_id)
+            except discord.NotFound:
+                # Someone deleted it. Sending another now could put it above
+                # soundboard pages, so wait for the next redraw.
+                feed.message = None
+                feed.lost = True
+            except discord.HTTPException:
+                _log.exception('Failed to update the history feed for %d',
+                               guild_id)
+
+    async def _find_or_send(self, feed: _GuildFeed,
+                            content: str) -> discord.Message:
+        """Reuses the last message in the channel if it's a feed.
+
+        That's the one from before a restart. Otherwise sends a new one.
+        """
+        channel = await self._bot.fetch_channel(feed.channel_id)
+        async for msg in channel.history(limit=1):
+            if (msg.author.id == self._bot.user.id and
+                    page_of_message(msg) is None and
+                    msg.content.startswith(TITLE)):
+                await msg.edit(content=content,
+                               allowed_mentions=discord.AllowedMentions.none())
+                return msg
+        return await channel.send(
+            content, allowed_mentions=discord.AllowedMentions.none())
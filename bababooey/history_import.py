@@ -0,0 +1,258 @@
+"""Streaming import of sound effect history from the old bot's logs.
+
+The logs are far too big to load at once, so everything here is a generator
+pipeline: lines are parsed lazily, resolved to sound effect numbers, and
+written to `user_history` in fixed size batches. Each batch is its own short
+transaction so the live bot is never locked out of the database for long.
+"""
+from collections.abc import Callable, Iterable, Iterator
+import bisect
+import dataclasses
+import datetime
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+
+from bababooey.history import HISTORY_DB_PATH
+
+_log = logging.getLogger(__name__)
+
+# Matches lines like:
+#   2021-06-02 18:03:11,402 123456789012345678 987654321098765432 bababooey
+# The named groups are what matters, a different pattern can be supplied as
+# long as it provides datetime, user_id, guild_id and name.
+LEGACY_LINE_RE = re.compile(
+    r'^(?P<datetime>\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d(?:[.,]\d+)?)\s+'
+    r'(?P<user_id>\d+)\s+(?P<guild_id>\d+)\s+(?P<name>.+?)\s*$')
+
+DEFAULT_BATCH_SIZE = 50_000
+# Log timestamps and database timestamps come from different clocks, treat
+# plays of the same sound by the same user this close together as the same.
+DUPLICATE_TOLERANCE = datetime.timedelta(seconds=2)
+# Time to sleep between batches so the bot can get its own writes in.
+BATCH_PAUSE_SECONDS = 0.05
+
+
+@dataclasses.dataclass
+class LegacyPlay:
+    """A single parsed line of the legacy log."""
+    played_at: datetime.datetime
+    user_id: int
+    guild_id: int
+    name: str
+    # Byte offset just past this line, used for checkpointing.
+    end_offset: int
+
+
+@dataclasses.dataclass
+class ImportStats:
+    lines: int = 0
+    unparsable: int = 0
+    unknown_name: int = 0
+    duplicates: int = 0
+    inserted: int = 0
+    started_at: float = dataclasses.field(default_factory=time.monotonic)
+
+    def lines_per_second(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        if elapsed <= 0:
+            return 0.0
+        return self.lines / elapsed
+
+    def summary(self) -> str:
+        return (f'{self.lines} lines ({self.lines_per_second():.0f}/s), '
+                f'{self.inserted} inserted, {self.duplicates} duplicates, '
+                f'{self.unknown_name} unknown names, '
+                f'{self.unparsable} unparsable')
+
+
+def _parse_datetime(raw: str) -> datetime.datetime:
+    """Parses a log timestamp, naive timestamps are assumed to be UTC."""
+    dt = datetime.datetime.fromisoformat(raw.replace(',', '.'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.astimezone(datetime.timezone.utc)
+
+
+def _to_db_str(dt: datetime.datetime) -> str:
+    # Always include the microseconds so the strings sort consistently.
+    return dt.isoformat(timespec='microseconds')
+
+
+def parse_log(path: str,
+              start_offset: int = 0,
+              pattern: re.Pattern = LEGACY_LINE_RE,
+              stats: ImportStats | None = None) -> Iterator[LegacyPlay]:
+    """Lazily yields every play found in the log at path.
+
+    Lines that don't match pattern are counted in stats and skipped.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start_offset)
+        offset = start_offset
+        for raw_line in f:
+            offset += len(raw_line)
+            if stats is not None:
+                stats.lines += 1
+            m = pattern.match(raw_line.decode('utf-8', errors='replace'))
+            if m is None:
+                if stats is not None:
+                    stats.unparsable += 1
+                continue
+            try:
+                played_at = _parse_datetime(m['datetime'])
+            except ValueError:
+                if stats is not None:
+                    stats.unparsable += 1
+                continue
+            yield LegacyPlay(played_at=played_at,
+                             user_id=int(m['user_id']),
+                             guild_id=int(m['guild_id']),
+                             name=m['name'],
+                             end_offset=offset)
+
+
+def _batched(plays: Iterable[LegacyPlay],
+             batch_size: int) -> Iterator[list[LegacyPlay]]:
+    batch = []
+    for play in plays:
+        batch.append(play)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _Checkpoint:
+    """Remembers how far into each log file has been committed."""
+
+    def __init__(self, path: str | None):
+        self._path = path
+        self._offsets: dict[str, int] = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self._offsets = json.load(f)
+
+    def offset(self, log_path: str) -> int:
+        return self._offsets.get(os.path.abspath(log_path), 0)
+
+    def save(self, log_path: str, offset: int) -> None:
+        self._offsets[os.path.abspath(log_path)] = offset
+        if self._path is None:
+            return
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._offsets, f)
+        # Atomic, so a crash never leaves a half written checkpoint.
+        os.replace(tmp_path, self._path)
+
+
+class HistoryImporter:
+    """Imports legacy plays into the user_history table."""
+
+    def __init__(self,
+                 name_to_num: Callable[[str], int | None],
+                 db_path: str = HISTORY_DB_PATH,
+                 checkpoint_path: str | None = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 pattern: re.Pattern = LEGACY_LINE_RE):
+        self._name_to_num = name_to_num
+        self._batch_size = batch_size
+        self._pattern = pattern
+        self._checkpoint = _Checkpoint(checkpoint_path)
+        self.stats = ImportStats()
+        # Wait for the bot's own transactions instead of failing.
+        self._con = sqlite3.connect(db_path, timeout=30)
+        # WAL lets the bot keep reading the history while we write.
+        self._con.execute('PRAGMA journal_mode=WAL')
+        with self._con:
+            self._con.execute(
+                'CREATE TABLE IF NOT EXISTS '
+                'user_history(datetime, user_id, guild_id, num)')
+            self._con.execute('CREATE INDEX IF NOT EXISTS '
+                              'user_history_datetime ON user_history(datetime)')
+        # Only rows from before this run count as duplicates, so genuine
+        # repeat plays in the log aren't dropped. Rows from an earlier,
+        # interrupted run are below this too.
+        self._before_import = self._con.execute(
+            'SELECT COALESCE(MAX(rowid), 0) FROM user_history').fetchone()[0]
+
+    def close(self) -> None:
+        self._con.close()
+
+    def _existing_plays(
+        self, start: datetime.datetime, end: datetime.datetime
+    ) -> dict[tuple[int, int, int], list[datetime.datetime]]:
+        """Returns the sorted play times of every (user, guild, num) in range.
+
+        Only rows that were there before the import started.
+        """
+        existing: dict[tuple[int, int, int], list[datetime.datetime]] = {}
+        for dt_str, user_id, guild_id, num in self._con.execute(
+                'SELECT datetime, user_id, guild_id, num FROM user_history '
+                'WHERE datetime BETWEEN ? AND ? AND rowid <= ?',
+            (_to_db_str(start - DUPLICATE_TOLERANCE),
+             _to_db_str(end + DUPLICATE_TOLERANCE), self._before_import)):
+            existing.setdefault((user_id, guild_id, num), []).append(
+                datetime.datetime.fromisoformat(dt_str))
+        for times in existing.values():
+            times.sort()
+        return existing
+
+    def _is_duplicate(
+            self, existing: dict[tuple[int, int, int], list[datetime.datetime]],
+            key: tuple[int, int, int], played_at: datetime.datetime) -> bool:
+        times = existing.get(key)
+        if not times:
+            return False
+        i = bisect.bisect_left(times, played_at - DUPLICATE_TOLERANCE)
+        return i < len(times) and times[i] <= played_at + DUPLICATE_TOLERANCE
+
+    def _import_batch(self, batch: list[LegacyPlay]) -> None:
+        resolved = []
+        for play in batch:
+            num = self._name_to_num(play.name)
+            if num is None:
+                self.stats.unknown_name += 1
+                continue
+            resolved.append((play, num))
+        if not resolved:
+            return
+
+        existing = self._existing_plays(
+            min(play.played_at for play, _ in resolved),
+            max(play.played_at for play, _ in resolved))
+        rows = []
+        for play, num in resolved:
+            key = (play.user_id, play.guild_id, num)
+            if self._is_duplicate(existing, key, play.played_at):
+                self.stats.duplicates += 1
+                continue
+            rows.append((_to_db_str(play.played_at), play.user_id,
+                         play.guild_id, num))
+
+        with self._con:
+            self._con.executemany(
+                'INSERT INTO user_history VALUES(?, ?, ?, ?)', rows)
+        self.stats.inserted += len(rows)
+
+    def import_file(self, path: str) -> None:
+        """Imports one log file, resuming from the last checkpoint."""
+        start_offset = self._checkpoint.offset(path)
+        if start_offset:
+            _log.info('Resuming %s from byte %d', path, start_offset)
+        plays = parse_log(path,
+                          start_offset=start_offset,
+                          pattern=self._pattern,
+                          stats=self.stats)
+        for batch in _batched(plays, self._batch_size):
+            self._import_batch(batch)
+            self._checkpoint.save(path, batch[-1].end_offset)
+            _log.info('%s: %s', path, self.stats.summary())
+            time.sleep(BATCH_PAUSE_SECONDS)
+        # Trailing unparsable lines still count as done.
+        self._checkpoint.save(path, os.path.getsize(path))
@@ -0,0 +1,165 @@
+"""Looks up display names and avatars for user IDs, in batches.
+
+Pages like /history mention many users at once. Rather than a REST call per
+user that isn't in discord.py's member cache, the misses for a page are
+resolved together: through one gateway request per 100 users when the bot
+has the members intent, otherwise with concurrent fetch_member calls.
+Results, including users who have left the guild, are cached for a while.
+"""
+from collections.abc import Callable, Iterable
+import asyncio
+import dataclasses
+import logging
+import time
+
+import discord
+
+from bababooey.metrics import metrics
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 10 * 60.0
+# The most user_ids the gateway accepts in one query_members.
+QUERY_MEMBERS_LIMIT = 100
+# How many fetch_member and fetch_user calls to have in flight at once.
+MAX_CONCURRENT_FETCHES = 10
+
+
+@dataclasses.dataclass(frozen=True)
+class MemberInfo:
+    user_id: int
+    display_name: str
+    avatar_url: str | None
+    # False for users who are no longer in the guild.
+    in_guild: bool = True
+
+
+def _info_from(user: discord.User | discord.Member,
+               in_guild: bool = True) -> MemberInfo:
+    return MemberInfo(user_id=user.id,
+                      display_name=user.display_name,
+                      avatar_url=user.display_avatar.url,
+                      in_guild=in_guild)
+
+
+def _unknown(user_id: int) -> MemberInfo:
+    return MemberInfo(user_id=user_id,
+                      display_name=f'<@{user_id}>',
+                      avatar_url=None,
+                      in_guild=False)
+
+
+class MemberResolver:
+    """TTL cache of MemberInfo per (guild, user)."""
+
+    def __init__(self,
+                 client: discord.Client,
+                 ttl: float = DEFAULT_TTL_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self._client = client
+        self._ttl = ttl
+        self._clock = clock
+        # (guild_id, user_id) -> (expiry, info)
+        self._cache: dict[tuple[int, int], tuple[float, MemberInfo]] = {}
+        # Shared by every REST lookup, however many pages resolve at once.
+        self._fetches = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+
+    def _cached(self, guild_id: int, user_id: int) -> MemberInfo | None:
+        entry = self._cache.get((guild_id, user_id))
+        if entry is None:
+            return None
+        expiry, info = entry
+        if expiry < self._clock():
+            del self._cache[(guild_id, user_id)]
+            return None
+        return info
+
+    def _store(self, guild_id: int, info: MemberInfo) -> None:
+        self._cache[(guild_id, info.user_id)] = (self._clock() + self._ttl,
+                                                 info)
+
+    def invalidate(self, guild_id: int, user_id: int) -> None:
+        self._cache.pop((guild_id, user_id), None)
+
+    async def resolve(self, guild: discord.Guild, user_id: int) -> MemberInfo:
+        return (await self.resolve_many(guild, [user_id]))[user_id]
+
+    async def resolve_many(self, guild: discord.Guild,
+                           user_ids: Iterable[int]) -> dict[int, MemberInfo]:
+        """Resolves every user_id, never raises for ones that can't be found.
+
+        Users who left the guild are looked up as plain users, and if even
+        that fails they are shown as a mention.
+        """
+        resolved: dict[int, MemberInfo] = {}
+        missing: list[int] = []
+        for user_id in dict.fromkeys(user_ids):
+            info = self._cached(guild.id, user_id)
+            if info is None:
+                member = guild.get_member(user_id)
+                if member is not None:
+                    info = _info_from(member)
+                    self._store(guild.id, info)
+            if info is not None:
+                metrics.cache_hit('member')
+                resolved[user_id] = info
+            else:
+                metrics.cache_miss('member')
+                missing.append(user_id)
+        if not missing:
+            return resolved
+
+        with metrics.timer('member_resolve'):
+            members = await self._fetch_members(guild, missing)
+            departed = [u for u in missing if u not in members]
+            infos = [_info_from(members[u]) for u in missing if u in members]
+            infos += await asyncio.gather(*(self._departed(u) for u in departed))
+            for info in infos:
+                self._store(guild.id, info)
+                resolved[info.user_id] = info
+        return resolved
+
+    async def _fetch_members(
+            self, guild: discord.Guild,
+            user_ids: list[int]) -> dict[int, discord.Member]:
+        if self._client.intents.members:
+            found = {}
+            for i in range(0, len(user_ids), QUERY_MEMBERS_LIMIT):
+                chunk = user_ids[i:i + QUERY_MEMBERS_LIMIT]
+                try:
+                    members = await guild.query_members(user_ids=chunk,
+                                                        limit=len(chunk),
+                                                        cache=True)
+                except (asyncio.TimeoutError, discord.ClientException):
+                    _log.exception('query_members failed, fetching one by one')
+                    members = await self._fetch_concurrently(guild, chunk)
+                found.update((m.id, m) for m in members)
+            return found
+        return {
+            m.id: m for m in await self._fetch_concurrently(guild, user_ids)
+        }
+
+    async def _fetch_concurrently(self, guild: discord.Guild,
+                                  user_ids: list[int]) -> list[discord.Member]:
+        async def fetch(user_id: int) -> discord.Member | None:
+            async with self._fetches:
+                try:
+                    return await guild.fetch_member(user_id)
+                except discord.NotFound:
+                    return None
+                except discord.HTTPException:
+                    _log.exception('Failed to fetch member %d', user_id)
+                    return None
+
+        fetched = await asyncio.gather(*(fetch(u) for u in user_ids))
+        return [m for m in fetched if m is not None]
+
+    async def _departed(self, user_id: int) -> MemberInfo:
+        user = self._client.get_user(user_id)
+        if user is None:
+            try:
+                async with self._fetches:
+                    user = await self._client.fetch_user(user_id)
+            except discord.HTTPException:
+                return _unknown(user_id)
+        return _info_from(user, in_guild=False)
@@ -0,0 +1,307 @@
+"""In-process metrics with a Prometheus text exposition.
+
+Stage timings go into histograms labelled by guild and command. The command
+comes from a context variable that the cog sets when it starts handling an
+interaction, so code further down (voice, history) doesn't need to be told
+which command it is running for.
+
+Histograms can be observed from any thread; discord.py's audio player calls
+into us from its own thread.
+"""
+from collections.abc import Callable, Iterator
+import bisect
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+
+import discord
+
+_log = logging.getLogger(__name__)
+
+# Seconds. Covers a cached button press up to a cold voice connect.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+current_command: contextvars.ContextVar[str] = contextvars.ContextVar(
+    'current_command', default='')
+current_guild: contextvars.ContextVar[int | None] = contextvars.ContextVar(
+    'current_guild', default=None)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(**labels) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _format_labels(labels: Labels, extra: str = '') -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    if not parts:
+        return ''
+    return '{' + ','.join(parts) + '}'
+
+
+class Histogram:
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: 'Histogram') -> None:
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> float | None:
+        """Upper bound of the bucket the q-th quantile falls in."""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for i, c in enumerate(self.counts):
+            cumulative += c
+            if cumulative >= target:
+                return self.buckets[i] if i < len(
+                    self.buckets) else float('inf')
+        return float('inf')
+
+
+class Metrics:
+    """Registry of histograms, counters and gauges."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: dict[str, dict[Labels, Histogram]] = {}
+        self._counters: dict[str, dict[Labels, float]] = {}
+        self._gauges: dict[str, Callable[[], float]] = {}
+        self._gauge_values: dict[str, dict[Labels, float]] = {}
+
+    def observe(self,
+                stage: str,
+                seconds: float,
+                *,
+                guild_id: int | None = None,
+                command: str | None = None) -> None:
+        """Records how long a stage took.
+
+        guild_id and command default to the current interaction's.
+        """
+        if guild_id is None:
+            guild_id = current_guild.get()
+        if command is None:
+            command = current_command.get()
+        labels = _labels(guild=guild_id, command=command or None)
+        with self._lock:
+            by_labels = self._histograms.setdefault(stage, {})
+            if labels not in by_labels:
+                by_labels[labels] = Histogram()
+            by_labels[labels].observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage: str, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+    def increment(self, name: str, amount: float = 1, **labels) -> None:
+        key = _labels(**labels)
+        with self._lock:
+            by_labels = self._counters.setdefault(name, {})
+            by_labels[key] = by_labels.get(key, 0) + amount
+
+    def cache_hit(self, cache: str) -> None:
+        self.increment('cache_requests_total', cache=cache, result='hit')
+
+    def cache_miss(self, cache: str) -> None:
+        self.increment('cache_requests_total', cache=cache, result='miss')
+
+    def gauge(self, name: str, fn: Callable[[], float]) -> None:
+        """Registers a gauge, fn is called whenever metrics are read."""
+        self._gauges[name] = fn
+
+    def adjust_gauge(self, name: str, delta: float, **labels) -> None:
+        """For gauges that are tracked as they change rather than read."""
+        key = _labels(**labels)
+        with self._lock:
+            by_labels = self._gauge_values.setdefault(name, {})
+            by_labels[key] = by_labels.get(key, 0) + delta
+
+    def counter_value(self, name: str, **labels) -> float:
+        """Sum of a counter over every label set that includes labels."""
+        wanted = set(_labels(**labels))
+        with self._lock:
+            return sum(v for k, v in self._counters.get(name, {}).items()
+                       if wanted <= set(k))
+
+    def stage_summary(self, stage: str) -> Histogram:
+        """Merges a stage's histograms across every guild and command."""
+        total = Histogram()
+        with self._lock:
+            for histogram in self._histograms.get(stage, {}).values():
+                total.merge(histogram)
+        return total
+
+    def stages(self) -> list[str]:
+        with self._lock:
+            return sorted(self._histograms)
+
+    def cache_hit_rates(self) -> dict[str, float]:
+        caches: dict[str, list[float]] = {}
+        with self._lock:
+            for labels, value in self._counters.get('cache_requests_total',
+                                                    {}).items():
+                d = dict(labels)
+                hits_misses = caches.setdefault(d['cache'], [0, 0])
+                hits_misses[0 if d['result'] == 'hit' else 1] += value
+        return {
+            cache: hits / (hits + misses)
+            for cache, (hits, misses) in caches.items()
+            if hits + misses > 0
+        }
+
+    def gauge_values(self) -> dict[str, float]:
+        values = {}
+        with self._lock:
+            for name, by_labels in self._gauge_values.items():
+                values[name] = sum(by_labels.values())
+        for name, fn in list(self._gauges.items()):
+            try:
+                values[name] = fn()
+            except Exception:
+                _log.exception('Gauge %s failed', name)
+        return values
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for stage, by_labels in sorted(self._histograms.items()):
+                name = f'bababooey_{stage}_seconds'
+                lines.append(f'# TYPE {name} histogram')
+                for labels, h in sorted(by_labels.items()):
+                    cumulative = 0
+                    for bound, c in zip(h.buckets, h.counts):
+                        cumulative += c
+                        le = _format_labels(labels, f'le="{bound}"')
+                        lines.append(f'{name}_bucket{le} {cumulative}')
+                    le = _format_labels(labels, 'le="+Inf"')
+                    lines.append(f'{name}_bucket{le} {h.count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {h.sum}')
+                    lines.append(
+                        f'{name}_count{_format_labels(labels)} {h.count}')
+            for counter, by_labels in sorted(self._counters.items()):
+                name = f'bababooey_{counter}'
+                lines.append(f'# TYPE {name} counter')
+                for labels, value in sorted(by_labels.items()):
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+            for gauge, by_labels in sorted(self._gauge_values.items()):
+                name = f'bababooey_{gauge}'
+                lines.append(f'# TYPE {name} gauge')
+                for labels, value in sorted(by_labels.items()):
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+        for gauge, fn in sorted(self._gauges.items()):
+            name = f'bababooey_{gauge}'
+            lines.append(f'# TYPE {name} gauge')
+            try:
+                lines.append(f'{name} {fn()}')
+            except Exception:
+                _log.exception('Gauge %s failed', gauge)
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class FirstPacketTimer(discord.AudioSource):
+    """Wraps an AudioSource to time from creation to its first packet.
+
+    If the source runs a subprocess, give its kind to keep the running
+    subprocess gauge accurate, since discord.py reaps the process in
+    cleanup(). on_cleanup, if given, is called once from there too.
+    """
+
+    def __init__(self,
+                 source: discord.AudioSource,
+                 started: float,
+                 kind: str | None = None,
+                 on_cleanup: Callable[[], None] | None = None):
+        self._source = source
+        self._started = started
+        self._kind = kind
+        self._on_cleanup = on_cleanup
+        self._first = True
+        self._cleaned_up = False
+        # The player thread doesn't inherit our context, capture it now.
+        self._guild_id = current_guild.get()
+        self._command = current_command.get()
+        if kind is not None:
+            metrics.increment('subprocesses_started_total', kind=kind)
+            metrics.adjust_gauge('subprocesses_running', 1, kind=kind)
+
+    def read(self) -> bytes:
+        data = self._source.read()
+        if self._first:
+            self._first = False
+            metrics.observe('first_packet',
+                            time.perf_counter() - self._started,
+                            guild_id=self._guild_id,
+                            command=self._command)
+        return data
+
+    def is_opus(self) -> bool:
+        return self._source.is_opus()
+
+    def cleanup(self) -> None:
+        if not self._cleaned_up:
+            self._cleaned_up = True
+            if self._kind is not None:
+                metrics.adjust_gauge('subprocesses_running',
+                                     -1,
+                                     kind=self._kind)
+            if self._on_cleanup is not None:
+                self._on_cleanup()
+        self._source.cleanup()
+
+
+async def _handle_metrics(request):
+    from aiohttp import web
+    return web.Response(text=metrics.render_prometheus(),
+                        content_type='text/plain',
+                        charset='utf-8')
+
+
+async def start_metrics_server(host: str, port: int):
+    """Serves /metrics for Prometheus, returns the aiohttp runner."""
+    # aiohttp comes with discord.py, but only the server needs the web bits.
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get('/metrics', _handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    _log.info('Serving metrics on http://%s:%d/metrics', host, port)
+    return runner
+
+
+def begin_interaction(interaction: discord.Interaction, command: str) -> None:
+    """Labels everything that follows with this interaction's command/guild.
+
+    Also records how long the interaction took to reach us.
+    """
+    current_command.set(command)
+    current_guild.set(interaction.guild_id)
+    receipt = discord.utils.utcnow() - interaction.created_at
+    metrics.observe('interaction_receipt', max(0.0, receipt.total_seconds()))
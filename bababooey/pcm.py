@@ -0,0 +1,128 @@
+"""Decoded audio kept in memory, for playing the same clip many times.
+
+A clip is decoded by ffmpeg once into raw PCM in the format discord.py's
+encoder wants. Any prefix or window of it can then be played as a
+memoryview slice of that one buffer, without starting ffmpeg again.
+"""
+import datetime
+import logging
+
+import discord
+
+from bababooey.subprocess_scheduler import Priority, scheduler
+
+_log = logging.getLogger(__name__)
+
+SAMPLE_RATE = discord.opus.Encoder.SAMPLING_RATE
+CHANNELS = discord.opus.Encoder.CHANNELS
+SAMPLE_WIDTH = 2
+BYTES_PER_MILLI = SAMPLE_RATE * CHANNELS * SAMPLE_WIDTH // 1000
+FRAME_BYTES = discord.opus.Encoder.FRAME_SIZE
+DECODE_TIMEOUT_SECONDS = 60
+
+
+class PCMBuffer:
+    """A decoded clip, 48kHz 16-bit stereo."""
+
+    def __init__(self, data: bytes):
+        self._view = memoryview(data)
+
+    @property
+    def nbytes(self) -> int:
+        return self._view.nbytes
+
+    @property
+    def duration_millis(self) -> int:
+        return self._view.nbytes // BYTES_PER_MILLI
+
+    def slice(self, start_millis: int = 0,
+              end_millis: int | None = None) -> memoryview:
+        """Zero-copy view of [start_millis, end_millis) of the clip."""
+        start = start_millis * BYTES_PER_MILLI
+        end = None if end_millis is None else end_millis * BYTES_PER_MILLI
+        return self._view[start:end]
+
+    def release(self) -> None:
+        """Drops the buffer.
+
+        Slices that are still being played keep the memory alive until they
+        finish, after that it is freed.
+        """
+        self._view.release()
+
+
+class PCMSliceSource(discord.AudioSource):
+    """Plays a slice of a PCMBuffer."""
+
+    def __init__(self, pcm: memoryview):
+        self._pcm = pcm
+        self._pos = 0
+
+    def read(self) -> bytes:
+        frame = self._pcm[self._pos:self._pos + FRAME_BYTES]
+        self._pos += FRAME_BYTES
+        if len(frame) == 0:
+            return b''
+        if len(frame) < FRAME_BYTES:
+            # The encoder only takes whole frames, pad the tail with silence.
+            return bytes(frame) + bytes(FRAME_BYTES - len(frame))
+        return bytes(frame)
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self) -> None:
+        self._pcm.release()
+
+
+def ffmpeg_trim_args(start_millis: int | None,
+                     end_millis: int | None) -> list[str]:
+    """Input options that read only [start_millis, end_millis) of a file.
+
+    Given before -i, ffmpeg seeks rather than decoding and dropping the
+    audio before start_millis. It has no end time option, only a duration.
+    """
+    args = []
+    if start_millis:
+        args += ['-ss', str(datetime.timedelta(milliseconds=start_millis))]
+    if end_millis is not None:
+        args += [
+            '-t',
+            str(datetime.timedelta(milliseconds=end_millis - (start_millis or 0)))
+        ]
+    return args
+
+
+def ffmpeg_pcm_args(file_path: str, start_millis: int | None,
+                    end_millis: int | None) -> list[str]:
+    args = ['ffmpeg', '-nostdin', '-v', 'error']
+    args += ffmpeg_trim_args(start_millis, end_millis)
+    args += [
+        '-i', file_path, '-filter:a', 'loudnorm', '-f', 's16le', '-ar',
+        str(SAMPLE_RATE), '-ac',
+        str(CHANNELS), 'pipe:1'
+    ]
+    return args
+
+
+async def decode_pcm(file_path: str,
+                     start_millis: int | None,
+                     end_millis: int | None,
+                     priority: Priority = Priority.PLAYBACK) -> PCMBuffer:
+    """Decodes [start_millis, end_millis) of file_path into memory.
+
+    Raises a ValueError if ffmpeg fails or takes too long.
+    """
+    try:
+        result = await scheduler.run(ffmpeg_pcm_args(file_path, start_millis,
+                                                     end_millis),
+                                     priority=priority,
+                                     kind='pcm_decode',
+                                     timeout=DECODE_TIMEOUT_SECONDS)
+    except TimeoutError as e:
+        raise ValueError(f'Took too long to decode `{file_path}`.') from e
+    if result.returncode != 0:
+        _log.error('ffmpeg failed to decode %s: %s', file_path,
+                   result.stderr.decode(errors='replace'))
+        raise ValueError(f'Couldn\'t decode `{file_path}`.')
+    return PCMBuffer(result.stdout)
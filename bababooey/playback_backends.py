@@ -0,0 +1,215 @@
+"""Ways of turning a clip of an audio file into a discord.AudioSource.
+
+Every backend plays [start_millis, end_millis) of the file, where either
+may be None for the start or end of the file, loudness normalized.
+
+ffmpeg: A subprocess per play, the original behaviour. Handles anything
+    ffmpeg does, but starting the process is most of the cost of a short
+    clip.
+pyav: Decodes, normalizes and resamples in-process with PyAV (the `av`
+    package, imported only when this backend is used). discord.py then
+    encodes to opus on its player thread, so no process is forked.
+stub: Plays silence for the length of the clip and records what it was
+    asked to play, for tests and benchmarks without ffmpeg.
+"""
+import abc
+import logging
+import shlex
+import threading
+
+import discord
+
+from bababooey.pcm import (BYTES_PER_MILLI, CHANNELS, FRAME_BYTES,
+                           SAMPLE_RATE, SAMPLE_WIDTH, PCMSliceSource,
+                           ffmpeg_trim_args)
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = 'ffmpeg'
+
+
+class PlaybackBackend(abc.ABC):
+    name: str = ''
+    # Given to FirstPacketTimer, for backends that start a subprocess per play.
+    subprocess_kind: str | None = None
+
+    @abc.abstractmethod
+    def open(self, file_path: str, start_millis: int | None,
+             end_millis: int | None) -> discord.AudioSource:
+        """Returns a source for the clip, without blocking on any I/O."""
+
+    def subprocess_kind_for(self, source: discord.AudioSource) -> str | None:
+        return self.subprocess_kind
+
+
+class FFmpegBackend(PlaybackBackend):
+    name = 'ffmpeg'
+    subprocess_kind = 'ffmpeg'
+
+    def open(self, file_path: str, start_millis: int | None,
+             end_millis: int | None) -> discord.AudioSource:
+        # Use FFmpegOpusAudio instead of FFmpegPCMAudio
+        # This is in case the file we are loading is already opus encoded, preventing double-encoding
+        # Consider trying to store audio files in Opus format to decrease load
+        return discord.FFmpegOpusAudio(file_path,
+                                       before_options=shlex.join(
+                                           ffmpeg_trim_args(
+                                               start_millis, end_millis)),
+                                       options='-filter:a loudnorm')
+
+
+class _PyAVSource(discord.AudioSource):
+    """Decodes a clip with PyAV as the player thread asks for frames.
+
+    The file is only opened on the first read(), which happens on the
+    player thread rather than the event loop.
+    """
+
+    def __init__(self, av, file_path: str, start_millis: int | None,
+                 end_millis: int | None):
+        self._av = av
+        self._file_path = file_path
+        self._start_millis = start_millis or 0
+        self._container = None
+        self._graph = None
+        self._frames = None
+        self._eof = False
+        self._buffer = bytearray()
+        # Bytes still to drop before start_millis, known once the first
+        # frame tells us where the seek landed.
+        self._skip: int | None = None
+        self._remaining = (None if end_millis is None else
+                           (end_millis - self._start_millis) * BYTES_PER_MILLI)
+
+    def _open(self) -> None:
+        av = self._av
+        self._container = av.open(self._file_path)
+        stream = self._container.streams.audio[0]
+        if self._start_millis:
+            # Lands on or before start_millis, the rest is skipped by _drain.
+            self._container.seek(int(self._start_millis / 1000 /
+                                     stream.time_base),
+                                 stream=stream)
+        graph = av.filter.Graph()
+        source = graph.add_abuffer(template=stream)
+        loudnorm = graph.add('loudnorm')
+        aformat = graph.add(
+            'aformat', f'sample_fmts=s16:sample_rates={SAMPLE_RATE}:'
+            f'channel_layouts={"stereo" if CHANNELS == 2 else "mono"}')
+        sink = graph.add('abuffersink')
+        source.link_to(loudnorm)
+        loudnorm.link_to(aformat)
+        aformat.link_to(sink)
+        graph.configure()
+        self._graph = graph
+        self._frames = self._container.decode(stream)
+
+    def _drain(self) -> None:
+        while True:
+            try:
+                frame = self._graph.pull()
+            except (BlockingIOError, EOFError):
+                # PyAV's errors for "push more input" and "that's all".
+                return
+            data = bytes(frame.planes[0])[:frame.samples * CHANNELS *
+                                          SAMPLE_WIDTH]
+            if self._skip:
+                skipped = min(self._skip, len(data))
+                data = data[skipped:]
+                self._skip -= skipped
+            self._buffer += data
+
+    def _fill(self) -> None:
+        while len(self._buffer) < FRAME_BYTES and not self._eof:
+            try:
+                frame = next(self._frames)
+            except StopIteration:
+                self._eof = True
+                self._graph.push(None)
+            else:
+                if self._skip is None:
+                    landed_millis = (frame.time or 0) * 1000
+                    skip_millis = max(0, self._start_millis - landed_millis)
+                    # Whole samples only, or the channels would swap.
+                    self._skip = int(skip_millis * BYTES_PER_MILLI) // (
+                        CHANNELS * SAMPLE_WIDTH) * CHANNELS * SAMPLE_WIDTH
+                self._graph.push(frame)
+            self._drain()
+
+    def read(self) -> bytes:
+        if self._container is None:
+            self._open()
+        if self._remaining is not None and self._remaining <= 0:
+            return b''
+        self._fill()
+        data = bytes(self._buffer[0:FRAME_BYTES])
+        del self._buffer[0:FRAME_BYTES]
+        if self._remaining is not None:
+            data = data[0:self._remaining]
+            self._remaining -= len(data)
+        if not data:
+            return b''
+        if len(data) < FRAME_BYTES:
+            # The encoder only takes whole frames, pad the tail with silence.
+            data += bytes(FRAME_BYTES - len(data))
+        return data
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self) -> None:
+        if self._container is not None:
+            self._container.close()
+            self._container = None
+
+
+class PyAVBackend(PlaybackBackend):
+    name = 'pyav'
+
+    def __init__(self):
+        try:
+            import av
+        except ImportError as e:
+            raise ValueError(
+                'The pyav playback backend needs the `av` package installed.'
+            ) from e
+        self._av = av
+
+    def open(self, file_path: str, start_millis: int | None,
+             end_millis: int | None) -> discord.AudioSource:
+        return _PyAVSource(self._av, file_path, start_millis, end_millis)
+
+
+class StubBackend(PlaybackBackend):
+    """Silence as long as the clip, or default_millis if it has no end."""
+    name = 'stub'
+
+    def __init__(self, default_millis: int = 1000):
+        self.default_millis = default_millis
+        # (file_path, start_millis, end_millis) of every open().
+        self.opened: list[tuple[str, int | None, int | None]] = []
+        self._lock = threading.Lock()
+
+    def open(self, file_path: str, start_millis: int | None,
+             end_millis: int | None) -> discord.AudioSource:
+        with self._lock:
+            self.opened.append((file_path, start_millis, end_millis))
+        if end_millis is None:
+            millis = self.default_millis
+        else:
+            millis = end_millis - (start_millis or 0)
+        return PCMSliceSource(memoryview(bytes(millis * BYTES_PER_MILLI)))
+
+
+BACKENDS: dict[str, type[PlaybackBackend]] = {
+    backend.name: backend
+    for backend in (FFmpegBackend, PyAVBackend, StubBackend)
+}
+
+
+def make_backend(name: str) -> PlaybackBackend:
+    """Raises a ValueError for unknown or unavailable backends."""
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown playback backend "{name}", expected one of '
+                         f'{", ".join(BACKENDS)}.')
+    return BACKENDS[name]()
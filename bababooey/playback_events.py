@@ -0,0 +1,114 @@
+"""A publish/subscribe stream of every sound effect that gets played.
+
+Subscribers get their own bounded queue of the events that match their
+filter. A slow subscriber only loses its own oldest events, it never holds
+up playback or other subscribers. Subscriptions are context managers, so
+leaving the block (including through cancellation or a timeout) removes
+them from the bus.
+"""
+from collections.abc import Callable
+import asyncio
+import dataclasses
+import datetime
+import logging
+
+import discord
+
+from bababooey.metrics import metrics
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 100
+
+
+@dataclasses.dataclass(frozen=True)
+class PlaybackEvent:
+    guild_id: int
+    user: discord.Member
+    # A SoundEffect, not annotated to avoid the import cycle.
+    sfx: object
+    timestamp: datetime.datetime
+
+
+EventFilter = Callable[[PlaybackEvent], bool]
+
+
+class Subscription:
+    """One subscriber's view of the bus."""
+
+    def __init__(self, bus: 'PlaybackEventBus', event_filter: EventFilter | None,
+                 maxsize: int):
+        self._bus = bus
+        self._filter = event_filter
+        self._queue: asyncio.Queue[PlaybackEvent] = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def _offer(self, event: PlaybackEvent) -> None:
+        if self._filter is not None and not self._filter(event):
+            return
+        if self._queue.full():
+            # Keep the most recent events, a stale backlog is less useful.
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(event)
+
+    async def get(self) -> PlaybackEvent:
+        return await self._queue.get()
+
+    def close(self) -> None:
+        self._bus._unsubscribe(self)
+
+    def __enter__(self) -> 'Subscription':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __aiter__(self) -> 'Subscription':
+        return self
+
+    async def __anext__(self) -> PlaybackEvent:
+        return await self.get()
+
+
+class PlaybackEventBus:
+
+    def __init__(self):
+        self._subscriptions: set[Subscription] = set()
+        metrics.gauge('playback_subscribers', lambda: len(self))
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self,
+                  event_filter: EventFilter | None = None,
+                  maxsize: int = DEFAULT_QUEUE_SIZE) -> Subscription:
+        """Starts receiving events matching event_filter.
+
+        Use the subscription as a context manager, or close() it when done.
+        """
+        subscription = Subscription(self, event_filter, maxsize)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription) -> None:
+        self._subscriptions.discard(subscription)
+
+    def publish(self, event: PlaybackEvent) -> None:
+        """Hands event to every matching subscriber, never blocks."""
+        for subscription in list(self._subscriptions):
+            try:
+                subscription._offer(event)
+            except Exception:
+                _log.exception('Playback event filter failed')
+
+    async def wait_for(self,
+                       event_filter: EventFilter,
+                       timeout: float | None = None) -> PlaybackEvent:
+        """Waits for the next matching event.
+
+        Raises asyncio.TimeoutError after timeout seconds. Either way, or if
+        cancelled, the subscription is removed.
+        """
+        with self.subscribe(event_filter, maxsize=1) as subscription:
+            return await asyncio.wait_for(subscription.get(), timeout)
@@ -0,0 +1,137 @@
+"""How much each sound effect gets played lately, in each guild and by each user.
+
+Every play adds one to the sound's count, and counts halve every half-life so
+last week's favourites outrank last year's. Rather than decaying every count
+as time passes, a play at time t adds 2^(t / half_life) (from a fixed epoch).
+Every count then shrinks by the same factor as time goes on, so comparing the
+stored values compares the decayed counts, and nothing has to be touched
+except the sound that was played.
+
+The counts are seeded at startup by summing the history table in SQL, and
+follow the catalog's event bus after that.
+"""
+from collections import Counter
+from collections.abc import Iterator
+import asyncio
+import datetime
+import logging
+import math
+
+from bababooey import SoundEffectData
+from bababooey.catalog import Catalog
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_HALF_LIFE_SECONDS = 14 * 24 * 3600.0
+# How much the user's own plays count next to the whole guild's.
+USER_WEIGHT = 0.5
+# Past this exponent the stored counts are scaled back down, far below where
+# floats overflow.
+_REBASE_EXPONENT = 200.0
+
+
+class _DecayedCounter:
+
+    def __init__(self):
+        self.counts: Counter[int] = Counter()
+        # Stored counts only go up, so the max only needs checking on adds
+        # and when the biggest is removed.
+        self.max = 0.0
+
+    def add(self, num: int, weight: float) -> None:
+        self.counts[num] += weight
+        self.max = max(self.max, self.counts[num])
+
+    def remove(self, num: int) -> None:
+        if self.counts.pop(num, 0.0) >= self.max:
+            self.max = max(self.counts.values(), default=0.0)
+
+    def relative(self, num: int) -> float:
+        """Between 0 and 1, where 1 is the most played."""
+        if not self.max:
+            return 0.0
+        return self.counts.get(num, 0.0) / self.max
+
+    def scale(self, factor: float) -> None:
+        for num in self.counts:
+            self.counts[num] *= factor
+        self.max *= factor
+
+
+class Popularity:
+    """Decayed play counts per guild and per user, kept up to date."""
+
+    def __init__(self,
+                 catalog: Catalog,
+                 half_life_seconds: float = DEFAULT_HALF_LIFE_SECONDS):
+        self._catalog = catalog
+        self._rate = math.log(2) / half_life_seconds
+        self._epoch = datetime.datetime.now(tz=datetime.timezone.utc)
+        self._guilds: dict[int, _DecayedCounter] = {}
+        self._users: dict[int, _DecayedCounter] = {}
+        self._task: asyncio.Task | None = None
+        catalog.add_change_listener(self._forget_deleted)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _counters(self) -> Iterator[_DecayedCounter]:
+        yield from self._guilds.values()
+        yield from self._users.values()
+
+    def _forget_deleted(self, before: SoundEffectData,
+                        after: SoundEffectData | None) -> None:
+        if after is not None:
+            return
+        for counter in self._counters():
+            counter.remove(before.num)
+
+    def observe(self, guild_id: int, user_id: int, num: int,
+                when: datetime.datetime) -> None:
+        if when.tzinfo is None:
+            # Old imported history was stored without one.
+            when = when.replace(tzinfo=datetime.timezone.utc)
+        exponent = self._rate * (when - self._epoch).total_seconds()
+        if exponent > _REBASE_EXPONENT:
+            for counter in self._counters():
+                counter.scale(math.exp(-exponent))
+            self._epoch = when
+            exponent = 0.0
+        weight = math.exp(exponent)
+        self._guilds.setdefault(guild_id, _DecayedCounter()).add(num, weight)
+        self._users.setdefault(user_id, _DecayedCounter()).add(num, weight)
+
+    def score(self, guild_id: int, user_id: int, num: int) -> float:
+        """Between 0 and 1, how popular num is with the guild and the user."""
+        guild = self._guilds.get(guild_id)
+        user = self._users.get(user_id)
+        total = ((guild.relative(num) if guild else 0.0) +
+                 USER_WEIGHT * (user.relative(num) if user else 0.0))
+        return total / (1 + USER_WEIGHT)
+
+    def _seed(self) -> tuple[dict[int, _DecayedCounter],
+                             dict[int, _DecayedCounter]]:
+        # Run on a thread, so it builds new counters rather than touching the
+        # live ones.
+        guilds: dict[int, _DecayedCounter] = {}
+        users: dict[int, _DecayedCounter] = {}
+        counts = self._catalog.decayed_play_counts(self._rate, self._epoch)
+        for guild_id, user_id, sfx, count in counts:
+            guilds.setdefault(guild_id, _DecayedCounter()).add(sfx.num, count)
+            users.setdefault(user_id, _DecayedCounter()).add(sfx.num, count)
+        _log.info('Popularity seeded from %d counts', len(counts))
+        return guilds, users
+
+    async def _run(self) -> None:
+        # Subscribe before seeding so no play falls in between. Plays only
+        # come off the bus once the seeded counters are swapped in.
+        with self._catalog.playback_events.subscribe() as plays:
+            self._guilds, self._users = await asyncio.to_thread(self._seed)
+            async for event in plays:
+                self.observe(event.guild_id, event.user.id, event.sfx.num,
+                             event.timestamp)
@@ -0,0 +1,210 @@
+"""Decodes the clips that are likely to be played next before they are.
+
+Sound effects come in runs ("bruh" is followed by "vine boom"), so after
+every play we look at what has followed that sound in the same guild, plus
+what the player likes in general, and decode the top few into memory.
+When one of them is played next, the PreloadingBackend plays the decoded
+buffer instead of starting a decoder.
+"""
+from collections import Counter, OrderedDict
+from collections.abc import Sequence
+import asyncio
+import logging
+
+import discord
+
+from bababooey import SoundEffectData
+from bababooey.catalog import Catalog
+from bababooey.metrics import metrics
+from bababooey.pcm import PCMBuffer, PCMSliceSource, decode_pcm
+from bababooey.playback_backends import PlaybackBackend
+from bababooey.subprocess_scheduler import Priority
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_BUDGET_BYTES = 64 * 1024 * 1024
+DEFAULT_TOP_K = 3
+# Only the newest plays seed the model, older habits matter little and the
+# whole history can be millions of rows.
+DEFAULT_SEED_PLAYS = 50_000
+# How much a user's favourites count next to what followed in the guild.
+FAVORITE_WEIGHT = 0.25
+
+ClipKey = tuple[str, int | None, int | None]
+
+
+class TransitionModel:
+    """First-order "what gets played after what" counts, per guild."""
+
+    def __init__(self):
+        # guild_id -> previous num -> Counter of next nums
+        self._transitions: dict[int, dict[int, Counter]] = {}
+        # user_id -> Counter of nums
+        self._favorites: dict[int, Counter] = {}
+        # guild_id -> most recently played num
+        self._last: dict[int, int] = {}
+
+    def observe(self, guild_id: int, user_id: int, num: int) -> None:
+        previous = self._last.get(guild_id)
+        if previous is not None:
+            self._transitions.setdefault(guild_id, {}).setdefault(
+                previous, Counter())[num] += 1
+        self._last[guild_id] = num
+        self._favorites.setdefault(user_id, Counter())[num] += 1
+
+    def predict(self, guild_id: int, user_id: int, k: int) -> list[int]:
+        """The k nums most likely to be played next in guild_id."""
+        scores: Counter = Counter()
+        previous = self._last.get(guild_id)
+        following = self._transitions.get(guild_id, {}).get(previous)
+        if following:
+            total = sum(following.values())
+            for num, count in following.items():
+                scores[num] += count / total
+        favorites = self._favorites.get(user_id)
+        if favorites:
+            total = sum(favorites.values())
+            for num, count in favorites.most_common(k):
+                scores[num] += FAVORITE_WEIGHT * count / total
+        return [num for num, _ in scores.most_common(k)]
+
+
+class PCMCache:
+    """Decoded clips, least recently used evicted past a memory budget."""
+
+    def __init__(self, budget_bytes: int = DEFAULT_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self._buffers: OrderedDict[ClipKey, PCMBuffer] = OrderedDict()
+        self._nbytes = 0
+        metrics.gauge('preload_cache_bytes', lambda: self._nbytes)
+
+    def __contains__(self, key: ClipKey) -> bool:
+        return key in self._buffers
+
+    def get(self, key: ClipKey) -> PCMBuffer | None:
+        buffer = self._buffers.get(key)
+        if buffer is not None:
+            self._buffers.move_to_end(key)
+        return buffer
+
+    def put(self, key: ClipKey, buffer: PCMBuffer) -> None:
+        if buffer.nbytes > self.budget_bytes:
+            return
+        if key in self._buffers:
+            self._nbytes -= self._buffers.pop(key).nbytes
+        self._buffers[key] = buffer
+        self._nbytes += buffer.nbytes
+        while self._nbytes > self.budget_bytes:
+            # Dropped rather than released, it may still be playing.
+            _, evicted = self._buffers.popitem(last=False)
+            self._nbytes -= evicted.nbytes
+
+    def discard(self, key: ClipKey) -> None:
+        buffer = self._buffers.pop(key, None)
+        if buffer is not None:
+            self._nbytes -= buffer.nbytes
+
+
+class PreloadingBackend(PlaybackBackend):
+    """Plays from the PCMCache when it can, otherwise from backend."""
+
+    def __init__(self, backend: PlaybackBackend, cache: PCMCache):
+        self.backend = backend
+        self.cache = cache
+        self.name = f'preloading_{backend.name}'
+
+    def subprocess_kind_for(self, source: discord.AudioSource) -> str | None:
+        if isinstance(source, _CachedSource):
+            return None
+        return self.backend.subprocess_kind_for(source)
+
+    def open(self, file_path: str, start_millis: int | None,
+             end_millis: int | None) -> discord.AudioSource:
+        buffer = self.cache.get((file_path, start_millis, end_millis))
+        if buffer is None:
+            metrics.cache_miss('preload')
+            return self.backend.open(file_path, start_millis, end_millis)
+        metrics.cache_hit('preload')
+        return _CachedSource(buffer.slice())
+
+
+class _CachedSource(PCMSliceSource):
+    """A cached clip, which unlike the wrapped backend runs no subprocess."""
+
+
+class Preloader:
+    """Follows plays on the catalog's event bus and fills the PCMCache."""
+
+    def __init__(self,
+                 catalog: Catalog,
+                 cache: PCMCache,
+                 top_k: int = DEFAULT_TOP_K,
+                 seed_plays: int = DEFAULT_SEED_PLAYS):
+        self._catalog = catalog
+        self._cache = cache
+        self._top_k = top_k
+        self._seed_plays = seed_plays
+        self.model = TransitionModel()
+        self._task: asyncio.Task | None = None
+        # Only the latest predictions matter, older ones are replaced.
+        self._wanted: asyncio.Queue[Sequence[int]] = asyncio.Queue(maxsize=1)
+        catalog.add_change_listener(self._forget_changed)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _forget_changed(self, before: SoundEffectData,
+                        after: SoundEffectData | None) -> None:
+        # Only the old clip is stale, it's decoded again if it's predicted.
+        key = (before.file_path, before.start_millis, before.end_millis)
+        if after is None or key != (after.file_path, after.start_millis,
+                                    after.end_millis):
+            self._cache.discard(key)
+
+    async def _seed(self) -> None:
+        history = await self._catalog.recent_history_async(self._seed_plays)
+        # Newest first, the model wants them in the order they were played.
+        for _, user_id, guild_id, sfx in reversed(history):
+            if sfx is not None:
+                self.model.observe(guild_id, user_id, sfx.num)
+        _log.info('Preloader seeded from %d plays', len(history))
+
+    async def _run(self) -> None:
+        # Subscribe before seeding so no play falls in between.
+        with self._catalog.playback_events.subscribe() as plays:
+            await self._seed()
+            warmer = asyncio.create_task(self._warm_forever())
+            try:
+                async for event in plays:
+                    self.model.observe(event.guild_id, event.user.id,
+                                       event.sfx.num)
+                    predicted = self.model.predict(event.guild_id,
+                                                   event.user.id, self._top_k)
+                    if self._wanted.full():
+                        self._wanted.get_nowait()
+                    self._wanted.put_nowait(predicted)
+            finally:
+                warmer.cancel()
+
+    async def _warm_forever(self) -> None:
+        while True:
+            for num in await self._wanted.get():
+                sfx = self._catalog.by_num(num)
+                if sfx is None:
+                    continue
+                key = (sfx.file_path, sfx.start_millis, sfx.end_millis)
+                if key in self._cache:
+                    # Mark it recently used so it outlives colder clips.
+                    self._cache.get(key)
+                    continue
+                try:
+                    with metrics.timer('preload_decode'):
+                        self._cache.put(
+                            key, await decode_pcm(*key, Priority.BACKGROUND))
+                except ValueError:
+                    _log.exception('Failed to preload %s', sfx.name)
@@ -0,0 +1,176 @@
+"""Tools for finding what blocks the event loop.
+
+LoopLagMonitor watches the loop from a separate thread: a heartbeat task
+ticks on the loop, and if it stops ticking for longer than the threshold
+the watchdog logs what the loop's thread is stuck doing.
+
+timed_command wraps a command callback to measure its wall clock and the
+CPU time spent in its own steps (not in other tasks that ran while it was
+awaiting), logging the slow ones.
+"""
+from collections.abc import Callable, Coroutine
+import asyncio
+import cProfile
+import functools
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+import traceback
+import types
+
+from bababooey.metrics import metrics
+
+_log = logging.getLogger(__name__)
+
+# A callback holding the loop longer than this gets its stack logged.
+DEFAULT_LAG_THRESHOLD_SECONDS = 0.25
+# Commands slower than this get their timings logged.
+SLOW_COMMAND_SECONDS = 1.0
+
+
+class LoopLagMonitor:
+    """Logs the stack of anything that holds the event loop too long."""
+
+    def __init__(self,
+                 threshold: float = DEFAULT_LAG_THRESHOLD_SECONDS,
+                 interval: float = 0.05):
+        self.threshold = threshold
+        self.interval = interval
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: int | None = None
+        self._heartbeat: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat = asyncio.create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch,
+                                          name='loop-lag-watchdog',
+                                          daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+    async def _beat(self) -> None:
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            # How much later than asked for we woke up.
+            lag = max(0.0, now - before - self.interval)
+            metrics.observe('loop_lag', lag, guild_id=0, command='')
+            self.max_lag = max(self.max_lag, lag)
+            self._last_beat = now
+
+    def _watch(self) -> None:
+        reported_beat = None
+        while not self._stopped.wait(self.threshold / 2):
+            last_beat = self._last_beat
+            stalled_for = time.monotonic() - last_beat
+            if stalled_for < self.threshold + self.interval:
+                continue
+            # Only report each stall once.
+            if reported_beat == last_beat:
+                continue
+            reported_beat = last_beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame else '?'
+            _log.warning('Event loop blocked for over %.3fs, currently in:\n%s',
+                         stalled_for, stack)
+
+
+# Only one profiler can be hooked in at a time, a second would replace it.
+_profiling = asyncio.Lock()
+
+
+async def capture_profile(seconds: float) -> str:
+    """Profiles the loop's thread for seconds, returns a pstats report.
+
+    Everything that runs on the loop while we sleep is captured, which is
+    everything the bot does apart from executor and audio threads.
+
+    Raises a ValueError if a profile is already being captured.
+    """
+    if _profiling.locked():
+        raise ValueError('Already profiling.')
+    async with _profiling:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(60)
+    out.write('\n')
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(30)
+    return out.getvalue()
+
+
+class _CpuTime:
+    seconds = 0.0
+
+
+@types.coroutine
+def _run_counting_cpu(coro: Coroutine, cpu: _CpuTime):
+    """Drives coro like a Task would, adding its CPU time to cpu.
+
+    CPU time is only counted while coro itself is running, so time spent in
+    other tasks while it is suspended isn't charged to it.
+    """
+    to_send = None
+    to_throw = None
+    while True:
+        start = time.thread_time()
+        try:
+            if to_throw is not None:
+                yielded = coro.throw(to_throw)
+            else:
+                yielded = coro.send(to_send)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            cpu.seconds += time.thread_time() - start
+        try:
+            to_send = yield yielded
+            to_throw = None
+        except BaseException as e:
+            to_send = None
+            to_throw = e
+
+
+def timed_command(fn: Callable[..., Coroutine]) -> Callable[..., Coroutine]:
+    """Logs the wall clock and CPU time of slow calls to a command.
+
+    The signature is preserved so discord.py still sees the parameters.
+    """
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        wall_start = time.perf_counter()
+        cpu = _CpuTime()
+        try:
+            return await _run_counting_cpu(fn(*args, **kwargs), cpu)
+        finally:
+            wall = time.perf_counter() - wall_start
+            metrics.observe('command_wall', wall, command=fn.__name__)
+            metrics.observe('command_cpu', cpu.seconds, command=fn.__name__)
+            if wall >= SLOW_COMMAND_SECONDS:
+                _log.warning('Slow command %s: %.3fs wall, %.3fs cpu',
+                             fn.__name__, wall, cpu.seconds)
+
+    return wrapper
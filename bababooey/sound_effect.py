@@ -1,35 +1,49 @@
 import asyncio
+import datetime
 import re
 from urllib.parse import parse_qs, urlencode, urlparse
 
 import discord
 
 from bababooey import (
+    MemberResolver,
+    PlaybackEvent,
+    PlaybackEventBus,
     SoundEffectData,
     UserSoundEffectHistory,
     VoiceClientManager,
     millis_to_str,
 )
-
-
-class NextPlayerEvent:
-    def __init__(self):
-        self.someone_played = asyncio.Event()
-        self.the_caller: discord.Member = None
+from bababooey.metrics import metrics
 
 
 class SoundEffect:
 
+    __slots__ = ("_voice_client_manager", "_raw", "_history", "_playback_events")
+
     def __init__(
         self,
+        # Or a catalog_snapshot.SnapshotRecord, which reads the same.
         raw: SoundEffectData,
         history: UserSoundEffectHistory,
         voice_client_manager: VoiceClientManager,
+        playback_events: PlaybackEventBus,
     ):
         self._voice_client_manager = voice_client_manager
         self._raw = raw
         self._history = history
-        self._waiters: list[NextPlayerEvent] = []
+        self._playback_events = playback_events
+
+    @property
+    def data(self) -> SoundEffectData:
+        """All the stored fields, decoded if they came from a snapshot."""
+        if isinstance(self._raw, SoundEffectData):
+            return self._raw
+        return self._raw.load()
+
+    def replace_data(self, raw: SoundEffectData) -> None:
+        """Swaps in edited fields, only the Catalog should call this."""
+        self._raw = raw
 
     @property
     def name(self) -> str:
@@ -64,7 +78,7 @@ class SoundEffect:
         yt_id = self.youtube_id()
         if yt_id is not None:
             return "https://www.youtube.com/watch?" + urlencode(
-                {"v": yt_id, "t": str(int(self.start_millis // 1000))}
+                {"v": yt_id, "t": str(int(self.source_start_millis // 1000))}
             )
         else:
             return self._raw.yt_url
@@ -73,6 +87,11 @@ class SoundEffect:
     def start_millis(self) -> int:
         return self._raw.start_millis
 
+    @property
+    def source_start_millis(self) -> int:
+        """Where the sound effect starts in the video at yt_url."""
+        return self._raw.start_millis + self._raw.source_offset_millis
+
     @property
     def end_millis(self) -> int:
         return self._raw.end_millis
@@ -85,6 +104,10 @@ class SoundEffect:
     def tags(self) -> str:
         return self._raw.tags
 
+    @property
+    def file_path(self) -> str:
+        return self._raw.file_path
+
     async def play_for_partial(
         self, user: discord.Member, start_millis: int, end_millis: int
     ):
@@ -93,24 +116,31 @@ class SoundEffect:
         )
 
     async def play_for(self, user: discord.Member):
-        for event in self._waiters:
-            event.the_caller = user
-            event.someone_played.set()
-        self._waiters.clear()
+        self._playback_events.publish(
+            PlaybackEvent(
+                guild_id=user.guild.id,
+                user=user,
+                sfx=self,
+                timestamp=datetime.datetime.now(tz=datetime.timezone.utc),
+            )
+        )
 
-        await self._voice_client_manager.play_file_for(
-            user, self._raw.file_path, self._raw.start_millis, self._raw.end_millis
+        # The history write doesn't need to wait for the sound to start.
+        await asyncio.gather(
+            self._voice_client_manager.play_file_for(
+                user, self._raw.file_path, self._raw.start_millis, self._raw.end_millis
+            ),
+            self._record_usage(user),
         )
-        self._history.record_usage(user, self.num)
 
-    async def next_player(self) -> discord.Member:
-        event = NextPlayerEvent()
-        self._waiters.append(event)
-        await event.someone_played.wait()
-        return event.the_caller
+    async def _record_usage(self, user: discord.Member):
+        with metrics.timer("history_write"):
+            await self._history.record_usage_async(user, self.num)
 
-    async def details_embed(self, guild: discord.Guild) -> discord.Embed:
-        author = await guild.fetch_member(self._raw.author)
+    async def details_embed(
+        self, guild: discord.Guild, member_resolver: MemberResolver
+    ) -> discord.Embed:
+        author = await member_resolver.resolve(guild, self._raw.author)
 
         e = discord.Embed(title=f"{self.emoji} {self.name}")
         e.add_field(name="Start", value=f"`{millis_to_str(self.start_millis)}`")
@@ -120,8 +150,8 @@ class SoundEffect:
             name="Created",
             value=f"`{self._raw.created_at.strftime('%Y-%m-%dT%H:%M:%S')}` (<t:{int(self._raw.created_at.timestamp())}:R>)\n",
         )
-        if author:
-            e.set_footer(text=author.nick, icon_url=author.avatar.url)
+        if author.in_guild:
+            e.set_footer(text=author.display_name, icon_url=author.avatar_url)
         else:
-            e.add_field(name="Creator", value=self._raw.author)
+            e.add_field(name="Creator", value=author.display_name)
         return e
@@ -1,6 +1,10 @@
 from dataclasses import dataclass
 import datetime
 
+MAX_SOUND_EFFECT_NAME_LENGTH = 12
+MIN_SOUND_EFFECT_NAME_LENGTH = 1
+
+
 @dataclass
 class SoundEffectData:
     num: int
@@ -14,3 +18,6 @@ class SoundEffectData:
     start_millis: int = 0
     end_millis: int | None = None
     tags: str = ''
+    # Where file_path starts in the video at yt_url, when only part of it was
+    # downloaded. start_millis and end_millis are in file_path.
+    source_offset_millis: int = 0
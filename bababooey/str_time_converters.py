@@ -1,6 +1,6 @@
 import re
 
-MILLIS_STR_RE = re.compile(r'^(((\d?\d:)?\d)?|\d{0,3})\d(\.\d\d{0,2})?$')
+MILLIS_STR_RE = re.compile(r'^(((\d{1,3}:)?\d)?|\d{0,3})\d(\.\d\d{0,2})?$')
 
 
 def split_millis(millis: int) -> tuple[int, int, int]:
@@ -0,0 +1,194 @@
+"""One place that starts ffmpeg/ffprobe jobs, so they can't starve playback.
+
+Jobs wait for one of a limited number of slots (one per core by default),
+and free slots go to the most important waiting job first. Playback's own
+ffmpeg is started by discord.py, so instead of queueing it we keep a slot
+that only PLAYBACK jobs may use, count each playing process as running
+(see claim_playback) and run the other classes at a lower OS priority.
+
+A job can name a supersede_key. Submitting another job with the same key
+cancels the older one, queued or running, which then raises
+SupersededError. Jobs run as argv lists, never through a shell.
+"""
+from collections.abc import Callable, Sequence
+import asyncio
+import dataclasses
+import enum
+import heapq
+import itertools
+import logging
+import os
+import subprocess
+import time
+
+from bababooey.metrics import metrics
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT_SECONDS = 60.0
+
+
+class Priority(enum.IntEnum):
+    # Lower runs first.
+    PLAYBACK = 0
+    PREVIEW = 1
+    BACKGROUND = 2
+
+
+# Added to the OS niceness of each class's processes.
+_NICENESS = {Priority.PLAYBACK: 0, Priority.PREVIEW: 5, Priority.BACKGROUND: 15}
+
+
+class SupersededError(Exception):
+    """A newer job with the same supersede_key replaced this one."""
+
+
+@dataclasses.dataclass
+class JobResult:
+    returncode: int
+    stdout: bytes
+    stderr: bytes
+
+
+class _Job:
+
+    def __init__(self, priority: Priority, supersede_key: object | None):
+        self.priority = priority
+        self.supersede_key = supersede_key
+        self.granted = asyncio.get_running_loop().create_future()
+        self.proc: asyncio.subprocess.Process | None = None
+        self.superseded = False
+
+
+def _lower_priority(niceness: int):
+    if niceness == 0 or not hasattr(os, 'nice'):
+        return None
+    return lambda: os.nice(niceness)
+
+
+class SubprocessScheduler:
+
+    def __init__(self, max_concurrent: int | None = None,
+                 reserved_for_playback: int = 1):
+        self.max_concurrent = max(2, max_concurrent or os.cpu_count() or 1)
+        self.reserved_for_playback = reserved_for_playback
+        self._running = 0
+        self._seq = itertools.count()
+        self._waiting: list[tuple[int, int, _Job]] = []
+        self._by_key: dict[object, _Job] = {}
+        metrics.gauge('subprocess_jobs_waiting', lambda: len(self._waiting))
+        metrics.gauge('subprocess_jobs_running', lambda: self._running)
+
+    def _may_start(self, priority: Priority) -> bool:
+        limit = self.max_concurrent
+        if priority != Priority.PLAYBACK:
+            limit -= self.reserved_for_playback
+        return self._running < limit
+
+    def _grant_waiting(self) -> None:
+        while self._waiting:
+            _, _, job = self._waiting[0]
+            if job.granted.done():
+                # Cancelled while waiting.
+                heapq.heappop(self._waiting)
+                continue
+            if not self._may_start(job.priority):
+                return
+            heapq.heappop(self._waiting)
+            self._running += 1
+            job.granted.set_result(None)
+
+    def _release(self) -> None:
+        self._running -= 1
+        self._grant_waiting()
+
+    def claim_playback(self) -> Callable[[], None]:
+        """Counts a playback process started outside the scheduler.
+
+        Playback never waits, so this takes a slot even past max_concurrent,
+        and other jobs wait for it instead. Returns the function that gives
+        the slot back, which may be called from any thread.
+        """
+        loop = asyncio.get_running_loop()
+        self._running += 1
+
+        def release() -> None:
+            try:
+                loop.call_soon_threadsafe(self._release)
+            except RuntimeError:
+                # The loop already closed, nothing left to schedule.
+                pass
+
+        return release
+
+    def _supersede(self, key: object) -> None:
+        older = self._by_key.get(key)
+        if older is None:
+            return
+        older.superseded = True
+        if not older.granted.done():
+            older.granted.set_exception(SupersededError())
+        elif older.proc is not None and older.proc.returncode is None:
+            older.proc.kill()
+
+    async def run(self,
+                  argv: Sequence[str],
+                  *,
+                  priority: Priority,
+                  kind: str,
+                  timeout: float | None = DEFAULT_TIMEOUT_SECONDS,
+                  supersede_key: object | None = None) -> JobResult:
+        """Runs argv once a slot is free and returns its output.
+
+        Raises SupersededError if replaced, TimeoutError if it ran longer
+        than timeout (the process is killed either way).
+        """
+        job = _Job(priority, supersede_key)
+        if supersede_key is not None:
+            self._supersede(supersede_key)
+            self._by_key[supersede_key] = job
+        try:
+            heapq.heappush(self._waiting, (int(priority), next(self._seq), job))
+            self._grant_waiting()
+            queued = time.perf_counter()
+            try:
+                await job.granted
+            except asyncio.CancelledError:
+                if not job.granted.cancelled():
+                    # Granted just as we were cancelled, hand the slot on.
+                    self._running -= 1
+                    self._grant_waiting()
+                raise
+            metrics.observe(f'subprocess_queue_{priority.name.lower()}',
+                            time.perf_counter() - queued)
+            try:
+                return await self._execute(job, argv, kind, timeout)
+            finally:
+                self._release()
+        finally:
+            if self._by_key.get(supersede_key) is job:
+                del self._by_key[supersede_key]
+
+    async def _execute(self, job: _Job, argv: Sequence[str], kind: str,
+                       timeout: float | None) -> JobResult:
+        metrics.increment('subprocesses_started_total', kind=kind)
+        job.proc = await asyncio.create_subprocess_exec(
+            *argv,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            preexec_fn=_lower_priority(_NICENESS[job.priority]))
+        try:
+            stdout, stderr = await asyncio.wait_for(job.proc.communicate(),
+                                                    timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if job.proc.returncode is None:
+                job.proc.kill()
+                await job.proc.wait()
+            raise
+        if job.superseded:
+            raise SupersededError()
+        return JobResult(job.proc.returncode, stdout, stderr)
+
+
+scheduler = SubprocessScheduler()
@@ -1,5 +1,7 @@
 from .edit_sound_effect import EditSoundEffectModal
 from .sound_effect_button import SoundEffectButton
 from .sound_effect_details import SoundEffectDetailButtons
-from .soundboard import make_soundboard_views
+from .soundboard import (SoundboardButton, make_soundboard_page,
+                         make_soundboard_views, page_of_message,
+                         soundboard_page)
 from .creation_manager import SoundEffectCreationManager
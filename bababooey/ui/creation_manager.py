@@ -1,38 +1,42 @@
 import asyncio
 import copy
+import dataclasses
 import logging
 import os
 import pathlib
-import subprocess
 from typing import Callable, Awaitable
 
 import discord
 
 from bababooey import millis_to_str, str_to_millis, SoundEffectData, SoundEffect, VoiceClientManager, Catalog
+from bababooey.creation_sessions import CreationSession
+from bababooey.downloads import SourceDownload, download_source
+from bababooey.fingerprints import DuplicateFinder
+from bababooey.metrics import metrics
+from bababooey.subprocess_scheduler import Priority, SupersededError, scheduler
+from bababooey.sound_effect_data import MAX_SOUND_EFFECT_NAME_LENGTH, MIN_SOUND_EFFECT_NAME_LENGTH
 from bababooey.ui import EditSoundEffectModal
-
-MAX_SOUND_EFFECT_NAME_LENGTH = 12
-MIN_SOUND_EFFECT_NAME_LENGTH = 1
+from bababooey.working_copy import DEFAULT_MARGIN_MILLIS, WorkingCopy, extract_working_copy, window_for
 
 _log = logging.getLogger(__name__)
 
+WAVEFORM_TIMEOUT_SECONDS = 30
+# The check runs before the Save press is answered, which has to be within
+# 3 seconds. Saving goes ahead unchecked if it takes longer.
+DUPLICATE_CHECK_TIMEOUT_SECONDS = 2.0
+
 
 class _PlaySoundEffectButton(discord.ui.Button):
 
-    def __init__(self, sfx_data: SoundEffectData,
-                 voice_client_manager: VoiceClientManager):
+    def __init__(self, play_callback: Callable[[discord.Member],
+                                               Awaitable[None]]):
         super().__init__(style=discord.ButtonStyle.green,
                          label='Play',
                          emoji=chr(0x25b6) + chr(0xfe0f))
-        self.sfx_data = sfx_data
-        self.voice_client_manager = voice_client_manager
+        self.play_callback = play_callback
 
     async def callback(self, interaction: discord.Interaction):
-        await self.voice_client_manager.play_file_for(
-            user=interaction.user,
-            file_path=self.sfx_data.file_path,
-            start_millis=self.sfx_data.start_millis,
-            end_millis=self.sfx_data.end_millis)
+        await self.play_callback(interaction.user)
         await interaction.response.edit_message(view=self.view)
 
 
@@ -109,11 +113,36 @@ class _CancelButton(discord.ui.Button):
         self.complete_event.set()
 
 
+class _CreationView(discord.ui.View):
+
+    def __init__(self, session: CreationSession | None):
+        # The session registry decides when this goes stale, not the view.
+        super().__init__(timeout=None)
+        self.session = session
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if self.session is not None:
+            self.session.touch()
+        return True
+
+
 class SoundEffectCreationManager:
 
-    def __init__(self, *, partial_sfx_data: SoundEffectData,
+    def __init__(self,
+                 *,
+                 partial_sfx_data: SoundEffectData,
                  original_interaction: discord.Interaction,
-                 voice_client_manager: VoiceClientManager, catalog: Catalog):
+                 voice_client_manager: VoiceClientManager,
+                 catalog: Catalog,
+                 session: CreationSession | None = None,
+                 source: SourceDownload | None = None,
+                 working_copy_margin_millis: int | None = DEFAULT_MARGIN_MILLIS,
+                 duplicate_finder: DuplicateFinder | None = None):
+        """working_copy_margin_millis of None previews from the download.
+
+        With a duplicate_finder, saving a clip that sounds like an existing
+        sound effect asks to save again first.
+        """
         self.partial_sfx_data = partial_sfx_data
         self.duration = self.partial_sfx_data.end_millis
         self.original_interaction = original_interaction
@@ -121,20 +150,44 @@ class SoundEffectCreationManager:
         self.catalog = catalog
         self.complete = asyncio.Event()
         self.complete_sfx: SoundEffect | None = None
+        self.session = session
+        if session is not None:
+            session.attach(self.expire)
+        # Times are shown and typed relative to the source, not the file.
+        self.source = source
+        self.working_copy_margin_millis = working_copy_margin_millis
+        self.working_copy: WorkingCopy | None = None
+        self._working_copy_lock = asyncio.Lock()
+        # Downloads a working copy couldn't be extracted from. Each attempt
+        # can take the whole extraction timeout, so they aren't retried.
+        self._working_copy_failed: set[str] = set()
+        # (start, end) millis of the file the waveform shows.
+        self._waveform_window: tuple[int, int] | None = None
+        self.duplicate_finder = duplicate_finder
+        # The clip the user was last warned about, saving it again goes ahead.
+        self._warned_duplicate: tuple[str, int, int | None] | None = None
 
     def create_embed(self,
                      use_attached_image: bool,
                      error: str | None = None) -> discord.Embed:
         e = discord.Embed(
             title=f'{self.partial_sfx_data.emoji} {self.partial_sfx_data.name}')
-        e.add_field(
-            name='Start',
-            value=f'`{millis_to_str(self.partial_sfx_data.start_millis)}`',
-            inline=True)
-        e.add_field(
-            name='End',
-            value=f'`{millis_to_str(self.partial_sfx_data.end_millis)}`',
-            inline=True)
+        shown = self._in_source_time()
+        e.add_field(name='Start',
+                    value=f'`{millis_to_str(shown.start_millis)}`',
+                    inline=True)
+        e.add_field(name='End',
+                    value=f'`{millis_to_str(shown.end_millis)}`',
+                    inline=True)
+        if self.source is not None and self.source.partial:
+            window_start = self.source.offset_millis
+            window_end = window_start + self.source.duration_millis
+            e.add_field(
+                name='Limited source',
+                value=f'Only `{millis_to_str(window_start)}` to '
+                f'`{millis_to_str(window_end)}` was downloaded. Editing the '
+                'times outside that downloads the whole video.',
+                inline=False)
         e.description = (
             f'Sauce:\n[`{self.partial_sfx_data.yt_url}`]'
             f'({self.partial_sfx_data.yt_url})\n'
@@ -142,6 +195,12 @@ class SoundEffectCreationManager:
         )
         if use_attached_image:
             e.set_image(url='attachment://image.png')
+            if self._waveform_window is not None:
+                window_start, window_end = (
+                    millis + self._offset_millis
+                    for millis in self._waveform_window)
+                e.set_footer(text=f'Waveform of {millis_to_str(window_start)} '
+                             f'to {millis_to_str(window_end)}')
         if error is not None:
             e.description = ('```diff\n-ERROR\n-' +
                              '\n-'.join(error.splitlines()) + '\n```' +
@@ -149,28 +208,143 @@ class SoundEffectCreationManager:
         return e
 
     def create_view(self) -> discord.ui.View:
-        view = discord.ui.View(timeout=None)
-        view.add_item(
-            _PlaySoundEffectButton(self.partial_sfx_data,
-                                   self.voice_client_manager))
+        view = _CreationView(self.session)
+        view.add_item(_PlaySoundEffectButton(self.play_preview))
         view.add_item(
-            _EditSoundEffectButton(self.partial_sfx_data, self.edit_callback))
+            _EditSoundEffectButton(self._in_source_time(), self.edit_callback))
         view.add_item(_SaveSoundEffectButton(self.save_sound_effect))
         view.add_item(_CancelButton(self.complete))
         return view
 
+    @property
+    def _offset_millis(self) -> int:
+        return 0 if self.source is None else self.source.offset_millis
+
+    def _in_source_time(self) -> SoundEffectData:
+        """partial_sfx_data with its times moved to the source's."""
+        return dataclasses.replace(
+            self.partial_sfx_data,
+            start_millis=self.partial_sfx_data.start_millis +
+            self._offset_millis,
+            end_millis=self.partial_sfx_data.end_millis + self._offset_millis)
+
+    async def _download_whole_source(self) -> None:
+        """Swaps the downloaded window for the whole source."""
+        window = self.source
+        await self.original_interaction.edit_original_response(
+            embed=discord.Embed(
+                title=f'{self.partial_sfx_data.emoji} '
+                f'{self.partial_sfx_data.name}',
+                description='Those times are outside what was downloaded, '
+                'downloading the whole video...'),
+            view=None,
+            attachments=[])
+        self.source = await download_source(window.url)
+        self.partial_sfx_data.file_path = self.source.file_path
+        self.partial_sfx_data.start_millis += window.offset_millis
+        self.partial_sfx_data.end_millis += window.offset_millis
+        self.duration = self.source.duration_millis
+        if self.session is not None:
+            self.session.replaced_downloads.add(window.file_path)
+            self.session.download_path = self.source.file_path
+
+    async def _current_working_copy(self) -> WorkingCopy | None:
+        """The working copy around the selection, extracted if it moved.
+
+        None if working copies are off, the selection is too long for one or
+        extraction failed for this download, then the download itself is
+        used.
+        """
+        if self.working_copy_margin_millis is None:
+            return None
+        # An edit and a Play press can both find the selection moved.
+        async with self._working_copy_lock:
+            data = self.partial_sfx_data
+            current = self.working_copy
+            if current is not None and current.covers(
+                    data.file_path, data.start_millis, data.end_millis):
+                metrics.cache_hit('working_copy')
+                return current
+            metrics.cache_miss('working_copy')
+            if data.file_path in self._working_copy_failed or window_for(
+                    data.start_millis, data.end_millis,
+                    self.working_copy_margin_millis) is None:
+                return None
+            out_path = 'data/tmp/' + pathlib.Path(
+                data.file_path).stem + f'-work-{data.start_millis}.wav'
+            if self.session is not None:
+                self.session.temp_files.add(out_path)
+            try:
+                self.working_copy = await extract_working_copy(
+                    data.file_path, data.start_millis, data.end_millis,
+                    out_path, self.working_copy_margin_millis)
+            except ValueError:
+                _log.exception('Failed to extract a working copy')
+                self._working_copy_failed.add(data.file_path)
+                return None
+            if current is not None and current.file_path != out_path:
+                current.remove()
+            return self.working_copy
+
+    async def play_preview(self, user: discord.Member) -> None:
+        data = self.partial_sfx_data
+        working_copy = await self._current_working_copy()
+        if working_copy is None:
+            await self.voice_client_manager.play_file_for(
+                user=user,
+                file_path=data.file_path,
+                start_millis=data.start_millis,
+                end_millis=data.end_millis)
+        else:
+            await self.voice_client_manager.play_source_for(
+                user, working_copy.play(data.start_millis, data.end_millis))
+
     async def generate_waveform(self) -> discord.File | None:
+        """Renders the clip's waveform, None if ffmpeg failed or timed out.
+
+        Raises SupersededError if a newer render of this creation started.
+        """
         os.makedirs('data/tmp/', exist_ok=True)
         image_path = 'data/tmp/' + pathlib.Path(
             self.partial_sfx_data.file_path).stem + '.png'
-        command = f'yes | ffmpeg -i {self.partial_sfx_data.file_path} -filter_complex "compand, showwavespic=colors=#5865F2|#5865F2:split_channels=1, drawbox=x=iw*{self.partial_sfx_data.start_millis/self.duration}:y=0:w=iw*{(self.partial_sfx_data.end_millis-self.partial_sfx_data.start_millis)/self.duration}:h=ih:t=fill:color=#57f287" -frames:v 1 {image_path}'
-        proc = await asyncio.create_subprocess_shell(command,
-                                                     stderr=subprocess.PIPE,
-                                                     stdout=subprocess.PIPE)
-        # TODO: detect if this command fails and handle correctly.
-        stdout, stderr = await proc.communicate()
-        if proc.returncode != 0:
-            _log.error('FFMPEG failed. Here is the stderr: %s', stderr.decode())
+        if self.session is not None:
+            self.session.temp_files.add(image_path)
+        working_copy = await self._current_working_copy()
+        if working_copy is None:
+            audio_path = self.partial_sfx_data.file_path
+            self._waveform_window = None
+            window_start, window_millis = 0, self.duration
+        else:
+            # Only the working copy is drawn, which also zooms in on the clip.
+            audio_path = working_copy.file_path
+            self._waveform_window = (working_copy.offset_millis,
+                                     working_copy.end_millis)
+            window_start = working_copy.offset_millis
+            window_millis = working_copy.pcm.duration_millis
+        start = (self.partial_sfx_data.start_millis -
+                 window_start) / window_millis
+        width = (self.partial_sfx_data.end_millis -
+                 self.partial_sfx_data.start_millis) / window_millis
+        # A newer edit re-renders the same image, so it supersedes this one.
+        try:
+            result = await scheduler.run(
+                [
+                    'ffmpeg', '-y', '-v', 'error', '-i', audio_path,
+                    '-filter_complex',
+                    'compand, showwavespic=colors=#5865F2|#5865F2:split_channels=1, '
+                    f'drawbox=x=iw*{start}:y=0:w=iw*{width}:h=ih:t=fill:color=#57f287',
+                    '-frames:v', '1', image_path
+                ],
+                priority=Priority.PREVIEW,
+                kind='waveform',
+                timeout=WAVEFORM_TIMEOUT_SECONDS,
+                supersede_key=('waveform', image_path))
+        except TimeoutError:
+            _log.error('FFMPEG took too long to render %s', image_path)
+            return None
+        if result.returncode != 0:
+            _log.error('FFMPEG failed. Here is the stderr: %s',
+                       result.stderr.decode(errors='replace'))
             return None
         return discord.File(image_path, filename='image.png')
 
@@ -192,7 +366,8 @@ class SoundEffectCreationManager:
             new_sfx_data.start_millis = 0
         else:
             try:
-                new_sfx_data.start_millis = str_to_millis(start_str)
+                new_sfx_data.start_millis = str_to_millis(
+                    start_str) - self._offset_millis
             except ValueError:
                 errors += f'The start time "{start_str}" doesn\'t parse. Try seconds (6.2) or minutes (1:20.1) or the full format (00:00.000).\n'
 
@@ -200,7 +375,8 @@ class SoundEffectCreationManager:
             new_sfx_data.end_millis = self.duration
         else:
             try:
-                new_sfx_data.end_millis = str_to_millis(end_str)
+                new_sfx_data.end_millis = str_to_millis(
+                    end_str) - self._offset_millis
             except ValueError:
                 errors += f'The end time "{end_str}" doesn\'t parse. Try seconds (6.2) or minutes (1:20.1) or the full format (00:00.000).\n'
 
@@ -212,7 +388,11 @@ class SoundEffectCreationManager:
             return errors
 
     async def edit_original_response(self, error: str = None) -> None:
-        waveform = await self.generate_waveform()
+        try:
+            waveform = await self.generate_waveform()
+        except SupersededError:
+            # A later edit is rendering, it will update the message.
+            return
         if waveform is None:
             attachments = []
         else:
@@ -229,24 +409,61 @@ class SoundEffectCreationManager:
         # new_sfx_data.
 
         res = self.sanitize_input(name, start_str, end_str, tags)
+        if (isinstance(res, SoundEffectData) and self.source is not None and
+                self.source.partial and
+                not self.source.covers(res.start_millis, res.end_millis)):
+            try:
+                await self._download_whole_source()
+            except ValueError as e:
+                await self.edit_original_response(
+                    error=f'Failed to download the whole video.\n{e}')
+                return
+            res = self.sanitize_input(name, start_str, end_str, tags)
         # If the sanitization failed, edit the message to show the error.
         if isinstance(res, str):
             await self.edit_original_response(error=res)
         elif isinstance(res, SoundEffectData):
             self.partial_sfx_data = res
             await self.edit_original_response()
-            await self.voice_client_manager.play_file_for(
-                user=self.original_interaction.user,
-                file_path=self.partial_sfx_data.file_path,
-                start_millis=self.partial_sfx_data.start_millis,
-                end_millis=self.partial_sfx_data.end_millis)
+            await self.play_preview(self.original_interaction.user)
         else:
             raise RuntimeError(
                 'Unexpected type received from self.sanatize_input()')
 
+    async def _find_duplicates(self) -> list[SoundEffect]:
+        data = self.partial_sfx_data
+        clip = (data.file_path, data.start_millis, data.end_millis)
+        if self.duplicate_finder is None or clip == self._warned_duplicate:
+            return []
+        try:
+            duplicates = await asyncio.wait_for(
+                self.duplicate_finder.find(data),
+                DUPLICATE_CHECK_TIMEOUT_SECONDS)
+        except TimeoutError:
+            _log.warning('Duplicate check took too long, saving anyway')
+            return []
+        except ValueError:
+            _log.exception('Failed to check for duplicates')
+            return []
+        if duplicates:
+            self._warned_duplicate = clip
+        return list(duplicates)
+
     async def save_sound_effect(self, interaction: discord.Interaction) -> None:
+        duplicates = await self._find_duplicates()
+        if duplicates:
+            await interaction.response.edit_message(view=self.create_view())
+            names = ', '.join(f'{d.emoji} `{d.name}`' for d in duplicates[:5])
+            await self.edit_original_response(
+                error=f'This sounds like {names}, which we already have. '
+                'Save again to add it anyway.')
+            return
         try:
-            sfx = self.catalog.create_new_sfx(self.partial_sfx_data)
+            # The times stay in the downloaded file, the offset keeps the
+            # link to the video at the right time.
+            sfx = self.catalog.create_new_sfx(
+                dataclasses.replace(self.partial_sfx_data,
+                                    source_offset_millis=self._offset_millis))
         except ValueError as e:
             context = ''
             if e.args:
@@ -264,11 +481,16 @@ class SoundEffectCreationManager:
                                                 attachments=[],
                                                 view=None)
         self.complete_sfx = sfx
+        if self.duplicate_finder is not None:
+            self.duplicate_finder.refresh()
         # Tell listeners that they can get the sound effect.
         self.complete.set()
 
     async def send_initial_message(self) -> None:
-        waveform = await self.generate_waveform()
+        try:
+            waveform = await self.generate_waveform()
+        except SupersededError:
+            waveform = None
         if waveform is None:
             await self.original_interaction.followup.send(
                 embed=self.create_embed(use_attached_image=False),
@@ -279,6 +501,22 @@ class SoundEffectCreationManager:
                 view=self.create_view(),
                 file=waveform)
 
+    async def expire(self) -> None:
+        """Ends an abandoned creation, its session is being closed."""
+        try:
+            await self.original_interaction.edit_original_response(
+                embed=discord.Embed(
+                    title='Expired',
+                    description=
+                    'This sound effect creation was left alone for too long. '
+                    'Start again with /add_sound.'),
+                view=None,
+                attachments=[])
+        except discord.HTTPException:
+            # The interaction token may have run out, nothing else to do.
+            _log.info('Couldn\'t edit an expired creation message')
+        self.complete.set()
+
     async def manage(self) -> SoundEffect | None:
         await self.send_initial_message()
         await self.complete.wait()
@@ -4,6 +4,8 @@ import discord
 from bababooey import SoundEffectData, millis_to_str
 
 EXAMPLE_TIMES = '0 or 0.042 or 69 or 1:09 or '
+# Long enough for sources over 100 minutes.
+MAX_TIME_LENGTH = len('000:00.000')
 
 
 class EditSoundEffectModal(discord.ui.Modal):
@@ -23,13 +25,13 @@ class EditSoundEffectModal(discord.ui.Modal):
         self.start = discord.ui.TextInput(
             label='Start Time',
             placeholder=EXAMPLE_TIMES + '00:00.000',
-            max_length=len('00:00.000'),
+            max_length=MAX_TIME_LENGTH,
             default=millis_to_str(sfx.start_millis),
             required=False)
         self.end = discord.ui.TextInput(label='End Time',
                                         placeholder=EXAMPLE_TIMES +
                                         millis_to_str(sfx.end_millis),
-                                        max_length=len('00:00.000'),
+                                        max_length=MAX_TIME_LENGTH,
                                         default=millis_to_str(sfx.end_millis),
                                         required=False)
         self.tags = discord.ui.TextInput(
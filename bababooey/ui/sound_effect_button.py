@@ -1,6 +1,12 @@
+import logging
+
 import discord
 
 from bababooey import SoundEffect
+from bababooey.metrics import begin_interaction, metrics
+from bababooey.voice_helpers import describe_play_error
+
+_log = logging.getLogger(__name__)
 
 
 def num_to_subscript(num: int) -> str:
@@ -26,7 +32,23 @@ class SoundEffectButton(discord.ui.Button):
 
     async def callback(self, interaction: discord.Interaction):
         assert self.view is not None
-        await self.sfx.play_for(interaction.user)
-        await interaction.response.edit_message(view=self.view)
+        await play_pressed(interaction, self.sfx)
+
+
+async def play_pressed(interaction: discord.Interaction,
+                       sfx: SoundEffect) -> None:
+    """Plays sfx for whoever pressed its button."""
+    begin_interaction(interaction, 'soundboard_button')
+    # Acknowledge first, playing can outlast the interaction deadline.
+    with metrics.timer('interaction_response'):
+        await interaction.response.defer()
+    try:
+        await sfx.play_for(interaction.user)
+    except Exception as e:
+        _log.exception('Failed to play %s', sfx.name)
+        await interaction.followup.send(
+            f'Couldn\'t play {sfx.emoji} `{sfx.name}`: '
+            f'{describe_play_error(e)}',
+            ephemeral=True)
 
 
@@ -47,18 +47,78 @@ class _EditSoundEffectButton(discord.ui.Button):
         self.edit_callback = edit_callback
 
     async def callback(self, interaction: discord.Interaction):
+        if not await self.view.allow_changes(interaction):
+            return
         await interaction.response.send_modal(
             EditSoundEffectModal(self.sfx_data,
                                  original_view=self.view,
                                  edit_callback=self.edit_callback))
 
 
-class SoundEffectDetailButtons(discord.ui.View):
+class _DeleteConfirmationModal(discord.ui.Modal):
+
+    def __init__(self, sfx_data: SoundEffectData,
+                 confirm_callback: Callable[[discord.Interaction],
+                                            Awaitable[None]]):
+        super().__init__(title=f'Delete {sfx_data.name}?')
+        self.confirm_callback = confirm_callback
+        message = ('It disappears from the soundboard and search. '
+                   'This can\'t be undone.')
+        self.add_item(
+            discord.ui.TextInput(
+                label='Warning',
+                style=discord.TextStyle.paragraph,
+                placeholder=message,
+                default=message,
+            ))
+
+    async def on_submit(self, interaction: discord.Interaction) -> None:
+        await self.confirm_callback(interaction)
+
+
+class _DeleteSoundEffectButton(discord.ui.Button):
 
     def __init__(self, sfx_data: SoundEffectData,
+                 delete_callback: Callable[[discord.Interaction],
+                                           Awaitable[None]]):
+        super().__init__(style=discord.ButtonStyle.red,
+                         label='Delete',
+                         emoji=chr(0x1f5d1) + chr(0xfe0f))
+        self.sfx_data = sfx_data
+        self.delete_callback = delete_callback
+
+    async def callback(self, interaction: discord.Interaction):
+        if not await self.view.allow_changes(interaction):
+            return
+        await interaction.response.send_modal(
+            _DeleteConfirmationModal(self.sfx_data,
+                                     confirm_callback=self.delete_callback))
+
+
+class SoundEffectDetailButtons(discord.ui.View):
+    """Play and Sauce for anyone, Edit and Delete if can_change allows it."""
+
+    def __init__(self,
+                 sfx_data: SoundEffectData,
                  voice_client_manager: VoiceClientManager,
-                 edit_callback: Callable[[], Awaitable[None]]):
-        super().__init__()
+                 edit_callback: Callable[[], Awaitable[None]],
+                 delete_callback: Callable[[discord.Interaction],
+                                           Awaitable[None]] | None = None,
+                 can_change: Callable[[discord.abc.User], bool] = lambda _: True,
+                 timeout: float | None = 180):
+        super().__init__(timeout=timeout)
+        self.can_change = can_change
         self.add_item(_PlaySoundEffectButton(sfx_data, voice_client_manager))
         self.add_item(_SoundEffectSauceButton(sfx_data))
         self.add_item(_EditSoundEffectButton(sfx_data, edit_callback))
+        if delete_callback is not None:
+            self.add_item(_DeleteSoundEffectButton(sfx_data, delete_callback))
+
+    async def allow_changes(self, interaction: discord.Interaction) -> bool:
+        if self.can_change(interaction.user):
+            return True
+        await interaction.response.send_message(
+            'Only whoever made this sound effect or a server manager can '
+            'change it.',
+            ephemeral=True)
+        return False
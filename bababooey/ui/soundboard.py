@@ -1,10 +1,19 @@
 from collections.abc import Sequence
 import itertools
+import re
 
 import discord
 
 from bababooey import SoundEffect
-from bababooey.ui import SoundEffectButton
+from bababooey.ui.sound_effect_button import play_pressed
+
+# The cog that owns the catalog the soundboard buttons play from.
+CATALOG_COG_NAME = 'BababooeyCog'
+# Sound effects per soundboard message, a page holds the nums
+# [page * PAGE_SIZE, (page + 1) * PAGE_SIZE).
+PAGE_SIZE = 20
+_CUSTOM_ID_TEMPLATE = r'persistent_soundboard:(?P<guild>\d+):(?P<num>\d+)'
+_CUSTOM_ID_RE = re.compile(_CUSTOM_ID_TEMPLATE)
 
 
 def _split_every(group_size: int,
@@ -15,13 +24,80 @@ def _split_every(group_size: int,
     ]
 
 
+class SoundboardButton(discord.ui.DynamicItem[discord.ui.Button],
+                       template=_CUSTOM_ID_TEMPLATE):
+    """A soundboard button, dispatched by its custom_id.
+
+    The bot registers this class once. Whenever any soundboard button is
+    pressed the sound effect is looked up by the num in its custom_id, so
+    nothing has to be registered per sound effect or per guild.
+    """
+
+    def __init__(self,
+                 guild_id: int,
+                 num: int,
+                 sfx: SoundEffect | None,
+                 row: int | None = None):
+        super().__init__(discord.ui.Button(
+            style=discord.ButtonStyle.grey,
+            label=sfx.name if sfx is not None else None,
+            emoji=sfx.emoji if sfx is not None else None,
+            custom_id=f'persistent_soundboard:{guild_id}:{num}'),
+                         row=row)
+        self.sfx = sfx
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction,
+                             item: discord.ui.Button, match):
+        catalog = interaction.client.get_cog(CATALOG_COG_NAME).catalog
+        num = int(match['num'])
+        return cls(int(match['guild']), num, catalog.by_num(num))
+
+    async def callback(self, interaction: discord.Interaction):
+        if self.sfx is None:
+            # The soundboard hasn't been redrawn since this one was removed.
+            await interaction.response.send_message(
+                'That sound effect doesn\'t exist anymore.', ephemeral=True)
+            return
+        await play_pressed(interaction, self.sfx)
+
+
+def soundboard_page(num: int) -> int:
+    return num // PAGE_SIZE
+
+
+def page_of_message(message: discord.Message) -> int | None:
+    """Which page a soundboard message shows, None if it isn't one."""
+    for row in message.components:
+        for component in getattr(row, 'children', ()):
+            match = _CUSTOM_ID_RE.fullmatch(
+                getattr(component, 'custom_id', None) or '')
+            if match is not None:
+                return soundboard_page(int(match['num']))
+    return None
+
+
+def _make_page_view(page: Sequence[SoundEffect],
+                    guild_id: int) -> discord.ui.View:
+    view = discord.ui.View(timeout=None)
+    for row, sfx_in_row in enumerate(_split_every(4, page)):
+        for sfx in sfx_in_row:
+            view.add_item(SoundboardButton(guild_id, sfx.num, sfx, row=row))
+    return view
+
+
 def make_soundboard_views(
         sfx_list: Sequence[SoundEffect], guild_id:int) -> Sequence[discord.ui.View]:
-    views = []
-    for group in _split_every(20, sfx_list):
-        view = discord.ui.View(timeout=None)
-        views.append(view)
-        for row, sfx_in_row in enumerate(_split_every(4, group)):
-            for sfx in sfx_in_row:
-                view.add_item(SoundEffectButton(sfx, row, custom_id=f'persistent_soundboard:{guild_id}:{sfx.num}'))
-    return views
+    return [
+        _make_page_view(group, guild_id)
+        for group in _split_every(PAGE_SIZE, sfx_list)
+    ]
+
+
+def make_soundboard_page(sfx_list: Sequence[SoundEffect], guild_id: int,
+                         page: int) -> discord.ui.View | None:
+    """The view for one page, None if nothing is on it anymore."""
+    group = [sfx for sfx in sfx_list if soundboard_page(sfx.num) == page]
+    if not group:
+        return None
+    return _make_page_view(group, guild_id)
@@ -1,8 +1,12 @@
 import asyncio
-import datetime
+import time
 
 import discord
 
+from bababooey.metrics import FirstPacketTimer, metrics
+from bababooey.playback_backends import FFmpegBackend, PlaybackBackend
+from bababooey.subprocess_scheduler import scheduler
+
 # Amount of time to wait after connecting to voice before making noise.
 CONNECTION_WAIT_TIME = 0.5
 DISCONNECT_POLL_SECONDS = 10
@@ -56,13 +60,24 @@ def _find_correct_voice_channel(member: discord.Member) -> discord.VoiceChannel:
     raise ValueError('The SFX bot needs the `CONNECT` and `SPEAK` permissions.')
 
 
+def describe_play_error(e: Exception) -> str:
+    """User facing explanation of why a sound couldn't be played."""
+    # ValueErrors from picking a voice channel are already written for users.
+    if isinstance(e, ValueError):
+        return str(e)
+    return 'Something went wrong connecting to voice, try again in a moment.'
+
+
 class VoiceClientManager:
 
-    def __init__(self):
+    def __init__(self, backend: PlaybackBackend | None = None):
+        # How clips are decoded, unless play_file_for is given another.
+        self.backend = backend if backend is not None else FFmpegBackend()
         # guild_id -> discord.VoiceClient
         self.clients: dict[int, discord.VoiceClient] = {}
         self.garbage_collection_task: asyncio.Task | None = None
         self._vc_connection_lock = asyncio.Lock()
+        metrics.gauge('voice_clients_active', lambda: len(self.clients))
 
     async def _maybe_garbage_collect_client(self, guild_id: int) -> None:
         """If necessary, disconnects and deletes a guild's voice client."""
@@ -87,11 +102,15 @@ class VoiceClientManager:
 
     async def _ensure_voice(self,
                             member: discord.Member) -> discord.VoiceClient:
+        guild = member.guild
+        lock_wait_start = time.perf_counter()
         async with self._vc_connection_lock:
+            metrics.observe('voice_lock_wait',
+                            time.perf_counter() - lock_wait_start,
+                            guild_id=guild.id)
             if self.garbage_collection_task is None:
                 self.garbage_collection_task = asyncio.create_task(
                     self._garbage_collection_loop())
-            guild = member.guild
             dest_channel = _find_correct_voice_channel(member)
 
             # If we're already connected somewhere, re-use that voice_client.
@@ -102,44 +121,44 @@ class VoiceClientManager:
                 # If we're already in the correct voice_channel just return that.
                 if voice_client.channel.id == dest_channel.id:
                     return voice_client
-                await voice_client.move_to(dest_channel)
-                await asyncio.sleep(CONNECTION_WAIT_TIME)
-                return voice_client
+                with metrics.timer('voice_move', guild_id=guild.id):
+                    await voice_client.move_to(dest_channel)
             else:
                 # Not yet connected anywhere.
-                voice_client = await dest_channel.connect()
+                with metrics.timer('voice_connect', guild_id=guild.id):
+                    voice_client = await dest_channel.connect()
                 self.clients[guild.id] = voice_client
+            with metrics.timer('voice_settle', guild_id=guild.id):
                 await asyncio.sleep(CONNECTION_WAIT_TIME)
-                return voice_client
+            return voice_client
 
-    async def play_file_for(self, user: discord.Member, file_path: str,
-                            start_millis: int, end_millis: int | None) -> None:
+    async def play_source_for(self, user: discord.Member,
+                              source: discord.AudioSource) -> None:
+        """Plays an already prepared source, replacing whatever is playing."""
         voice_client = await self._ensure_voice(user)
-
-        ffmpeg_options = ''
-        if start_millis is not None and start_millis > 0:
-            ffmpeg_options += ' -ss {}'.format(
-                datetime.timedelta(milliseconds=start_millis))
-
-        if end_millis is not None:
-            # Note: ffmpeg doesn't do end_time, instead it uses duration, time after start.
-            if start_millis is not None:
-                ffmpeg_options += ' -t {}'.format(
-                    datetime.timedelta(milliseconds=end_millis - start_millis))
-            else:
-                ffmpeg_options += ' -t {}'.format(
-                    datetime.timedelta(milliseconds=end_millis))
-
-        # Use FFmpegOpusAudio instead of FFmpegPCMAudio
-        # This is in case the file we are loading is already opus encoded, preventing double-encoding
-        # Consider trying to store audio files in Opus format to decrease load
-
-        # Use before_options to seek to start_time and not read beyond duration
-        # if we instead just use options, it will process the whole file but
-        # drop the unecessary audio on output
-        track = discord.FFmpegOpusAudio(file_path,
-                                        before_options=ffmpeg_options,
-                                        options='-filter:a loudnorm')
+        if voice_client.is_playing():
+            voice_client.stop()
+        voice_client.play(FirstPacketTimer(source, started=time.perf_counter()))
+
+    async def play_file_for(self,
+                            user: discord.Member,
+                            file_path: str,
+                            start_millis: int | None,
+                            end_millis: int | None,
+                            backend: PlaybackBackend | None = None) -> None:
+        voice_client = await self._ensure_voice(user)
+        if backend is None:
+            backend = self.backend
+
+        spawn_start = time.perf_counter()
+        source = backend.open(file_path, start_millis, end_millis)
+        kind = backend.subprocess_kind_for(source)
+        track = FirstPacketTimer(
+            source,
+            started=spawn_start,
+            kind=kind,
+            # Background ffmpeg waits while this one plays.
+            on_cleanup=scheduler.claim_playback() if kind is not None else None)
 
         if voice_client.is_playing():
             voice_client.stop()
@@ -0,0 +1,121 @@
+"""A small decoded piece of a download, around the clip being trimmed.
+
+/add_sound plays and re-renders the clip after every edit. Seeking into a
+long compressed download for each of those is slow, so the creation flow
+decodes the selection plus a margin once, into a WAV in the format
+discord.py's encoder wants. Previews play slices of it from memory and the
+waveform is rendered from the WAV. It is only extracted again when an edit
+moves the selection outside it. Selections too long to hold in memory are
+previewed from the download instead.
+"""
+import asyncio
+import dataclasses
+import logging
+import os
+import wave
+
+from bababooey.metrics import metrics
+from bababooey.pcm import (CHANNELS, SAMPLE_RATE, SAMPLE_WIDTH, PCMBuffer,
+                           PCMSliceSource, ffmpeg_trim_args)
+from bababooey.subprocess_scheduler import Priority, scheduler
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_MARGIN_MILLIS = 10_000
+EXTRACT_TIMEOUT_SECONDS = 60
+# Decoded audio is 192kB a second, so a working copy stays under ~23MB.
+MAX_WINDOW_MILLIS = 2 * 60_000
+
+
+@dataclasses.dataclass
+class WorkingCopy:
+    # The download this was cut from.
+    source_path: str
+    # The extracted WAV.
+    file_path: str
+    # Where the WAV starts in the download.
+    offset_millis: int
+    pcm: PCMBuffer
+
+    @property
+    def end_millis(self) -> int:
+        return self.offset_millis + self.pcm.duration_millis
+
+    def covers(self, source_path: str, start_millis: int,
+               end_millis: int) -> bool:
+        return (source_path == self.source_path and
+                self.offset_millis <= start_millis and
+                end_millis <= self.end_millis)
+
+    def play(self, start_millis: int, end_millis: int) -> PCMSliceSource:
+        """A source for [start_millis, end_millis) of the download."""
+        return PCMSliceSource(
+            self.pcm.slice(start_millis - self.offset_millis,
+                           end_millis - self.offset_millis))
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.file_path)
+        except FileNotFoundError:
+            pass
+
+
+def window_for(start_millis: int, end_millis: int,
+               margin_millis: int) -> tuple[int, int] | None:
+    """The part of the download to extract, None if it's too long."""
+    offset_millis = max(0, start_millis - margin_millis)
+    end_millis += margin_millis
+    if end_millis - offset_millis > MAX_WINDOW_MILLIS:
+        return None
+    return offset_millis, end_millis
+
+
+def _read_wav(path: str) -> PCMBuffer:
+    with wave.open(path, 'rb') as w:
+        # ffmpeg was asked for no more than this, don't trust the header.
+        max_frames = SAMPLE_RATE * MAX_WINDOW_MILLIS // 1000
+        return PCMBuffer(w.readframes(min(w.getnframes(), max_frames)))
+
+
+async def extract_working_copy(source_path: str,
+                               start_millis: int,
+                               end_millis: int,
+                               out_path: str,
+                               margin_millis: int = DEFAULT_MARGIN_MILLIS
+                              ) -> WorkingCopy:
+    """Decodes the selection plus margin_millis each side to out_path.
+
+    Raises a ValueError if that's longer than MAX_WINDOW_MILLIS, or if
+    ffmpeg fails or takes too long.
+    """
+    window = window_for(start_millis, end_millis, margin_millis)
+    if window is None:
+        raise ValueError('The selection is too long for a working copy.')
+    offset_millis, window_end_millis = window
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    metrics.increment('working_copy_extractions_total')
+    try:
+        with metrics.timer('working_copy_extract'):
+            result = await scheduler.run(
+                ['ffmpeg', '-nostdin', '-y', '-v', 'error'] +
+                ffmpeg_trim_args(offset_millis, window_end_millis) +
+                [
+                    '-i', source_path, '-filter:a', 'loudnorm', '-ar',
+                    str(SAMPLE_RATE), '-ac',
+                    str(CHANNELS), '-c:a', f'pcm_s{SAMPLE_WIDTH * 8}le',
+                    out_path
+                ],
+                priority=Priority.PREVIEW,
+                kind='working_copy',
+                timeout=EXTRACT_TIMEOUT_SECONDS)
+    except TimeoutError as e:
+        raise ValueError(
+            f'Took too long to extract from `{source_path}`.') from e
+    if result.returncode != 0:
+        _log.error('ffmpeg failed to extract from %s: %s', source_path,
+                   result.stderr.decode(errors='replace'))
+        raise ValueError(f'Couldn\'t extract from `{source_path}`.')
+    return WorkingCopy(source_path=source_path,
+                       file_path=out_path,
+                       offset_millis=offset_millis,
+                       pcm=await asyncio.to_thread(_read_wav, out_path))
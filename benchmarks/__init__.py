@@ -0,0 +1 @@
+"""Performance benchmarks and load tests, run from the repository root."""
@@ -0,0 +1,330 @@
+"""Just enough of discord.py's objects to drive the cog without Discord.
+
+These only implement the attributes and coroutines the bot actually touches.
+The voice client consumes audio frames on a thread like the real one does,
+optionally at real-time pace.
+"""
+import asyncio
+import datetime
+import itertools
+import threading
+import time
+
+import discord
+import discord.ext.commands
+
+# discord.py sends a 20ms frame at a time.
+FRAME_SECONDS = 0.02
+
+_ids = itertools.count(10**17)
+
+
+def next_id() -> int:
+    return next(_ids)
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(tz=datetime.timezone.utc)
+
+
+class FakePermissions:
+    connect = True
+    speak = True
+
+
+class FakeAsset:
+
+    def __init__(self, url: str):
+        self.url = url
+
+
+class FakeVoiceState:
+
+    def __init__(self, channel: 'FakeVoiceChannel'):
+        self.channel = channel
+
+
+class StubVoiceClient:
+    """Stands in for discord.VoiceClient.
+
+    play() reads frames from the source on a thread, recording when the
+    first packet came out so playback startup can be measured.
+    """
+
+    def __init__(self, channel: 'FakeVoiceChannel', realtime: bool = False):
+        self.channel = channel
+        self.realtime = realtime
+        self.first_packet_times: list[float] = []
+        self.frames_played = 0
+        self.plays = 0
+        self._connected = True
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._first_packet = threading.Event()
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def is_playing(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self) -> None:
+        # Like discord.py, this doesn't wait for the player thread, which may
+        # be blocked reading from ffmpeg.
+        self._stop.set()
+        self._thread = None
+
+    def _consume(self, source: discord.AudioSource, started: float) -> None:
+        try:
+            first = True
+            while not self._stop.is_set():
+                frame = source.read()
+                if not frame:
+                    break
+                if first:
+                    self.first_packet_times.append(time.perf_counter() -
+                                                   started)
+                    self._first_packet.set()
+                    first = False
+                self.frames_played += 1
+                if self.realtime:
+                    time.sleep(FRAME_SECONDS)
+        finally:
+            source.cleanup()
+
+    def play(self, source: discord.AudioSource, *, after=None) -> None:
+        self.stop()
+        self.plays += 1
+        self._stop = threading.Event()
+        self._first_packet = threading.Event()
+        self._thread = threading.Thread(target=self._consume,
+                                        args=(source, time.perf_counter()),
+                                        daemon=True)
+        self._thread.start()
+
+    async def wait_for_first_packet(self, timeout: float = 10) -> None:
+        first_packet = self._first_packet
+        await asyncio.get_running_loop().run_in_executor(
+            None, first_packet.wait, timeout)
+
+    async def move_to(self, channel: 'FakeVoiceChannel') -> None:
+        self.channel = channel
+
+    async def disconnect(self, *, force: bool = False) -> None:
+        self.stop()
+        self._connected = False
+        self.channel.guild.voice_client = None
+
+
+class FakeVoiceChannel:
+
+    def __init__(self, guild: 'FakeGuild', name: str = 'General'):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.members: list[FakeMember] = []
+
+    def permissions_for(self, member) -> FakePermissions:
+        return FakePermissions()
+
+    async def connect(self, **kwargs) -> StubVoiceClient:
+        voice_client = StubVoiceClient(self, realtime=self.guild.realtime_voice)
+        self.guild.voice_client = voice_client
+        return voice_client
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeMember:
+
+    def __init__(self, guild: 'FakeGuild', name: str, bot: bool = False):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.nick = name
+        self.display_name = name
+        self.bot = bot
+        self.avatar = FakeAsset(f'https://example.invalid/{self.id}.png')
+        self.display_avatar = self.avatar
+        self.voice: FakeVoiceState | None = None
+
+    def join(self, channel: FakeVoiceChannel) -> None:
+        self.voice = FakeVoiceState(channel)
+        channel.members.append(self)
+
+
+class FakeGuild:
+
+    def __init__(self,
+                 n_members: int = 5,
+                 cached_members: bool = True,
+                 realtime_voice: bool = False,
+                 fetch_latency: float = 0.0):
+        self.id = next_id()
+        self.realtime_voice = realtime_voice
+        self.fetch_latency = fetch_latency
+        self.voice_client: StubVoiceClient | None = None
+        self.voice_channels = [FakeVoiceChannel(self)]
+        self.me = FakeMember(self, 'bababooey', bot=True)
+        self.members = [FakeMember(self, f'user{i}') for i in range(n_members)]
+        self._cached = cached_members
+        self.fetch_member_calls = 0
+        for member in self.members:
+            member.join(self.voice_channels[0])
+
+    def get_member(self, user_id: int) -> FakeMember | None:
+        if not self._cached:
+            return None
+        return self._member(user_id)
+
+    def _member(self, user_id: int) -> FakeMember | None:
+        for member in self.members:
+            if member.id == user_id:
+                return member
+        return None
+
+    async def fetch_member(self, user_id: int) -> FakeMember:
+        self.fetch_member_calls += 1
+        await asyncio.sleep(self.fetch_latency)
+        member = self._member(user_id)
+        if member is None:
+            raise discord.NotFound(_FakeResponse(404), 'Unknown Member')
+        return member
+
+
+class _FakeResponse:
+    """The aiohttp response shape discord.HTTPException expects."""
+
+    def __init__(self, status: int):
+        self.status = status
+        self.reason = 'Not Found'
+
+
+class FakeMessage:
+
+    def __init__(self, content: str | None = None, **kwargs):
+        self.id = next_id()
+        self.created_at = _now()
+        self.content = content
+        self.kwargs = kwargs
+        self.deleted = False
+        self.edits = 0
+
+    async def delete(self, *, delay: float | None = None) -> None:
+        if delay is None:
+            self.deleted = True
+        else:
+            asyncio.get_running_loop().call_later(delay, setattr, self,
+                                                  'deleted', True)
+
+    async def edit(self, **kwargs) -> 'FakeMessage':
+        self.edits += 1
+        self.kwargs.update(kwargs)
+        return self
+
+
+class FakeInteractionResponse:
+
+    def __init__(self, interaction: 'FakeInteraction'):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    def _respond(self) -> None:
+        if self._done:
+            raise discord.InteractionResponded(self._interaction)
+        self._done = True
+        self._interaction.responded_at = time.perf_counter()
+
+    async def send_message(self, content: str | None = None, **kwargs) -> None:
+        self._respond()
+        self._interaction.message = FakeMessage(content, **kwargs)
+
+    async def defer(self, **kwargs) -> None:
+        self._respond()
+        self._interaction.message = FakeMessage(None, **kwargs)
+
+    async def edit_message(self, **kwargs) -> None:
+        self._respond()
+
+    async def send_modal(self, modal) -> None:
+        self._respond()
+
+
+class FakeFollowup:
+
+    def __init__(self):
+        self.messages: list[FakeMessage] = []
+
+    async def send(self, content: str | None = None, **kwargs) -> FakeMessage:
+        message = FakeMessage(content, **kwargs)
+        self.messages.append(message)
+        return message
+
+
+class FakeInteraction:
+
+    def __init__(self, user: FakeMember, client: 'FakeBot | None' = None):
+        self.id = next_id()
+        self.client = client
+        self.user = user
+        self.guild = user.guild
+        self.guild_id = user.guild.id
+        self.created_at = _now()
+        self.created = time.perf_counter()
+        self.responded_at: float | None = None
+        self.message: FakeMessage | None = None
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup()
+
+    async def original_response(self) -> FakeMessage:
+        return self.message
+
+    async def edit_original_response(self, **kwargs) -> FakeMessage:
+        if self.message is None:
+            raise discord.NotFound(_FakeResponse(404), 'Unknown interaction')
+        return await self.message.edit(**kwargs)
+
+
+class FakeBot:
+    """The slice of RacketBot the cog uses."""
+
+    def __init__(self):
+        self.user = FakeMember(FakeGuild(n_members=0), 'bababooey', bot=True)
+        self.views: list[discord.ui.View] = []
+        self.dynamic_items: set[type] = set()
+        self.cogs: dict[str, discord.ext.commands.Cog] = {}
+        # No members intent, so members are fetched over REST.
+        self.intents = discord.Intents.default()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return asyncio.get_running_loop()
+
+    def add_view(self, view: discord.ui.View, **kwargs) -> None:
+        self.views.append(view)
+
+    def add_dynamic_items(self, *items: type) -> None:
+        self.dynamic_items.update(items)
+
+    def remove_dynamic_items(self, *items: type) -> None:
+        self.dynamic_items.difference_update(items)
+
+    async def add_cog(self, cog: discord.ext.commands.Cog) -> None:
+        self.cogs[cog.qualified_name] = cog
+        await cog.cog_load()
+
+    async def remove_cog(self, name: str) -> None:
+        await self.cogs.pop(name).cog_unload()
+
+    def get_cog(self, name: str) -> discord.ext.commands.Cog | None:
+        return self.cogs.get(name)
+
+    def get_user(self, user_id: int) -> None:
+        return None
+
+    async def fetch_user(self, user_id: int):
+        raise discord.NotFound(_FakeResponse(404), 'Unknown User')
@@ -0,0 +1,415 @@
+"""Drives the cog with simulated guilds and users, no Discord needed.
+
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --guilds 20 --users 10 --seconds 60
+    python -m benchmarks.load_test --scenarios buttons,guess --out load.json
+
+Every guild gets --users members in one voice channel and a stub voice client
+that consumes frames at real-time pace, like Discord's. The chosen scenarios
+run at the same time for --seconds:
+
+    buttons       everyone presses soundboard buttons, --press-interval
+                  seconds apart on average
+    autocomplete  people type sound names a letter at a time, each keystroke
+                  is an autocomplete request
+    x             everyone uses /x, a fifth as often as they press buttons
+    guess         back to back guess_sound games in every guild, a few people
+                  guessing from the revealed letters
+    add_sound     every --add-sound-interval seconds, --add-sound-burst people
+                  /add_sound a clip from a local media server, then cancel
+
+It reports throughput and p50/p99 latencies per operation, how many
+subprocesses were started and the most running at once, and event loop lag.
+Everything runs in a scratch directory with a synthetic catalog.
+"""
+from collections import Counter, defaultdict
+from collections.abc import Awaitable, Callable
+import argparse
+import asyncio
+import json
+import logging
+import random
+import re
+import shutil
+import sys
+import time
+
+import discord
+
+# First, it points settings at nothing real before the cog is imported.
+from benchmarks.run import scratch_dir
+
+from bababooey.cogs import BababooeyCog
+from bababooey.metrics import metrics
+from bababooey.ui import SoundboardButton
+
+from benchmarks import fakes, media_server, synthetic
+
+_log = logging.getLogger(__name__)
+
+SCENARIOS = ('buttons', 'autocomplete', 'x', 'guess', 'add_sound')
+# How often gauges and loop lag are sampled.
+SAMPLE_SECONDS = 0.01
+PEAK_GAUGES = ('subprocesses_running', 'subprocess_jobs_running',
+               'subprocess_jobs_waiting', 'voice_clients_active',
+               'creation_sessions_active')
+# A stuck /add_sound counts as an error rather than hanging the run.
+ADD_SOUND_TIMEOUT_SECONDS = 60
+# Every kind of subprocess the bot starts, for the report.
+SUBPROCESS_KINDS = ('ffmpeg', 'pcm_decode', 'waveform', 'working_copy',
+                    'ffprobe')
+
+
+def _percentile(samples: list[float], q: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+class Recorder:
+    """Latency samples and errors per operation."""
+
+    def __init__(self):
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        self.errors: Counter[str] = Counter()
+
+    async def time(self, op: str, fn: Callable[[], Awaitable[None]]) -> None:
+        start = time.perf_counter()
+        try:
+            await fn()
+        except Exception as e:
+            key = f'{op}: {type(e).__name__}'
+            if key not in self.errors:
+                _log.exception('First %s', key)
+            self.errors[key] += 1
+            return
+        self.samples[op].append(time.perf_counter() - start)
+
+    def summary(self, seconds: float) -> dict[str, dict]:
+        result = {}
+        for op, samples in sorted(self.samples.items()):
+            samples = sorted(samples)
+            result[op] = {
+                'count': len(samples),
+                'per_second': len(samples) / seconds,
+                'p50_ms': _percentile(samples, 0.5) * 1000,
+                'p99_ms': _percentile(samples, 0.99) * 1000,
+                'max_ms': samples[-1] * 1000,
+            }
+        return result
+
+
+def _latest_view(
+        interaction: fakes.FakeInteraction) -> discord.ui.View | None:
+    """The buttons on the newest message an interaction sent."""
+    messages = [interaction.message] + interaction.followup.messages
+    for message in reversed(messages):
+        if message is not None and message.kwargs.get('view') is not None:
+            return message.kwargs['view']
+    return None
+
+
+class LoadTest:
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.recorder = Recorder()
+        self.peaks: dict[str, float] = {}
+        self.bot = fakes.FakeBot()
+        self.guilds = [
+            fakes.FakeGuild(n_members=args.users, realtime_voice=True)
+            for _ in range(args.guilds)
+        ]
+        self.cog = None
+        self._sampler: asyncio.Task | None = None
+        self.deadline = 0.0
+        # Every nth /add_sound is walked away from, 0 for never.
+        self.abandon_every = 0
+        self.source_url: str | None = None
+
+    def _running(self) -> bool:
+        return time.perf_counter() < self.deadline
+
+    async def _sample(self) -> None:
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(SAMPLE_SECONDS)
+            self.recorder.samples['loop_lag'].append(
+                max(0.0, time.perf_counter() - before - SAMPLE_SECONDS))
+            gauges = metrics.gauge_values()
+            for name in PEAK_GAUGES:
+                self.peaks[name] = max(self.peaks.get(name, 0),
+                                       gauges.get(name, 0))
+
+    async def press(self, member: fakes.FakeMember, num: int,
+                    op: str = 'button') -> None:
+        interaction = fakes.FakeInteraction(member, client=self.bot)
+
+        async def pressed():
+            match = {'guild': str(member.guild.id), 'num': str(num)}
+            button = await SoundboardButton.from_custom_id(
+                interaction, None, match)
+            await button.callback(interaction)
+            self.recorder.samples[f'{op}_ack'].append(
+                interaction.responded_at - interaction.created)
+
+        await self.recorder.time(f'{op}_play', pressed)
+
+    async def _think(self, mean_seconds: float) -> None:
+        await asyncio.sleep(self.rng.expovariate(1 / mean_seconds))
+
+    async def buttons(self, member: fakes.FakeMember) -> None:
+        catalog = self.cog.catalog
+        while self._running():
+            await self._think(self.args.press_interval)
+            await self.press(member, self.rng.choice(catalog.all()).num)
+
+    async def autocomplete(self, member: fakes.FakeMember) -> None:
+        catalog = self.cog.catalog
+        interaction = fakes.FakeInteraction(member, client=self.bot)
+        while self._running():
+            name = self.rng.choice(catalog.all()).name
+            for i in range(1, len(name) + 1):
+                # Discord sends one request per keystroke.
+                await asyncio.sleep(self.rng.uniform(0.05, 0.2))
+                await self.recorder.time(
+                    'autocomplete',
+                    lambda: self.cog._autocomplete_sound_effect_name(
+                        interaction, name[:i]))
+            await self._think(2)
+
+    async def x(self, member: fakes.FakeMember) -> None:
+        catalog = self.cog.catalog
+        while self._running():
+            await self._think(self.args.press_interval * 5)
+            interaction = fakes.FakeInteraction(member, client=self.bot)
+            name = self.rng.choice(catalog.all()).name
+            await self.recorder.time(
+                'x', lambda: self.cog.x.callback(self.cog, interaction, name))
+
+    async def guess(self, guild: fakes.FakeGuild) -> None:
+        while self._running():
+            host = self.rng.choice(guild.members)
+            interaction = fakes.FakeInteraction(host, client=self.bot)
+            game = asyncio.create_task(
+                self.recorder.time(
+                    'guess_game',
+                    lambda: self.cog.guess_sound.callback(
+                        self.cog, interaction)))
+            players = [
+                asyncio.create_task(self._guesser(member, interaction, game))
+                for member in self.rng.sample(guild.members,
+                                              min(3, len(guild.members)))
+            ]
+            # A game can outlast the run, it's cut short rather than waited on.
+            await asyncio.wait([game],
+                               timeout=max(0.0,
+                                           self.deadline - time.perf_counter()))
+            game.cancel()
+            for player in players:
+                player.cancel()
+
+    async def _guesser(self, member: fakes.FakeMember,
+                       interaction: fakes.FakeInteraction,
+                       game: asyncio.Task) -> None:
+        """Reads the revealed letters and plays a sound that fits them."""
+        while not game.done():
+            await self._think(3)
+            embed = interaction.message and interaction.message.kwargs.get(
+                'embed')
+            if embed is None or '?' not in embed.title:
+                continue
+            pattern = re.compile(
+                ''.join('.' if c == '?' else re.escape(c)
+                        for c in embed.title) + '$')
+            candidates = [
+                sfx for sfx in self.cog.catalog.all()
+                if pattern.match(sfx.name)
+            ]
+            if candidates:
+                await self.press(member,
+                                 self.rng.choice(candidates).num,
+                                 op='guess_press')
+
+    async def add_sound(self) -> None:
+        created = 0
+        while self._running():
+            burst = []
+            for _ in range(self.args.add_sound_burst):
+                guild = self.guilds[created % len(self.guilds)]
+                member = guild.members[created // len(self.guilds) %
+                                       len(guild.members)]
+                abandon = (self.abandon_every and
+                           created % self.abandon_every == 0)
+                burst.append(
+                    self._create_and_cancel(member, created, abandon=abandon))
+                created += 1
+            await asyncio.gather(*burst)
+            await asyncio.sleep(self.args.add_sound_interval)
+
+    async def _create_and_cancel(self,
+                                 member: fakes.FakeMember,
+                                 i: int,
+                                 abandon: bool = False) -> None:
+        """Abandoned creations are left to expire instead of cancelled."""
+        interaction = fakes.FakeInteraction(member, client=self.bot)
+        command = asyncio.create_task(
+            self.cog.add_sound.callback(self.cog,
+                                        interaction,
+                                        self.source_url,
+                                        f'load{i}',
+                                        f'load-emoji-{i}',
+                                        start='0:20',
+                                        end='0:23'))
+
+        async def shown():
+            # Until the waveform and buttons are up.
+            while _latest_view(interaction) is None:
+                if command.done():
+                    command.result()
+                    raise RuntimeError('/add_sound gave up')
+                await asyncio.sleep(SAMPLE_SECONDS)
+
+        await self.recorder.time(
+            'add_sound_shown',
+            lambda: asyncio.wait_for(shown(), ADD_SOUND_TIMEOUT_SECONDS))
+        view = _latest_view(interaction)
+        if view is not None and not abandon:
+            cancel = next(item for item in view.children
+                          if getattr(item, 'label', None) == 'Cancel')
+            await cancel.callback(fakes.FakeInteraction(member,
+                                                        client=self.bot))
+        await self.recorder.time(
+            'add_sound_done',
+            lambda: asyncio.wait_for(command, ADD_SOUND_TIMEOUT_SECONDS))
+
+    async def start(self) -> None:
+        """Writes the catalog and loads the cog, in the current directory."""
+        wav = synthetic.write_wav('data/audio/clip.wav', seconds=10)
+        sfx_data = synthetic.make_sfx_data(self.args.sfx,
+                                           wav,
+                                           seed=self.args.seed)
+        for sfx in sfx_data:
+            # Different clips, or one decode would serve every play.
+            sfx.start_millis = sfx.num * 10 % 9000
+            sfx.end_millis = sfx.start_millis + 1000
+        synthetic.write_catalog(sfx_data)
+        self.cog = BababooeyCog(self.bot)
+        await self.bot.add_cog(self.cog)
+        self._sampler = asyncio.create_task(self._sample())
+
+    def workers(self) -> list[Awaitable[None]]:
+        """The traffic of every scenario, it stops at self.deadline."""
+        workers = []
+        scenarios = self.args.scenarios
+        for guild in self.guilds:
+            for member in guild.members:
+                if 'buttons' in scenarios:
+                    workers.append(self.buttons(member))
+                if 'autocomplete' in scenarios:
+                    workers.append(self.autocomplete(member))
+                if 'x' in scenarios:
+                    workers.append(self.x(member))
+            if 'guess' in scenarios:
+                workers.append(self.guess(guild))
+        if 'add_sound' in scenarios:
+            workers.append(self.add_sound())
+        return workers
+
+    async def stop(self) -> None:
+        self._sampler.cancel()
+        await self.bot.remove_cog(self.cog.qualified_name)
+        for guild in self.guilds:
+            if guild.voice_client is not None:
+                await guild.voice_client.disconnect()
+
+    def report(self, seconds: float) -> dict:
+        return {
+            'seconds': seconds,
+            'operations': self.recorder.summary(seconds),
+            'errors': dict(self.recorder.errors),
+            'subprocesses_started': {
+                kind: metrics.counter_value('subprocesses_started_total',
+                                            kind=kind)
+                for kind in SUBPROCESS_KINDS
+            },
+            'peaks': self.peaks,
+        }
+
+    async def run(self) -> dict:
+        await self.start()
+        started = time.perf_counter()
+        self.deadline = started + self.args.seconds
+        try:
+            await asyncio.gather(*self.workers())
+        finally:
+            elapsed = time.perf_counter() - started
+            await self.stop()
+        return self.report(elapsed)
+
+
+def _print_report(report: dict) -> None:
+    print(f'{"operation":<18}{"count":>8}{"per s":>9}{"p50 ms":>10}'
+          f'{"p99 ms":>10}{"max ms":>10}')
+    for op, s in report['operations'].items():
+        print(f'{op:<18}{s["count"]:>8}{s["per_second"]:>9.1f}'
+              f'{s["p50_ms"]:>10.1f}{s["p99_ms"]:>10.1f}{s["max_ms"]:>10.1f}')
+    for error, count in report['errors'].items():
+        print(f'ERROR {error} x{count}')
+    started = ', '.join(f'{kind} {count:g}' for kind, count in
+                        report['subprocesses_started'].items())
+    print(f'subprocesses started: {started or "none"}')
+    print('peaks: ' + ', '.join(f'{name} {value:g}'
+                                for name, value in report['peaks'].items()))
+
+
+def _scenario_list(raw: str) -> list[str]:
+    scenarios = [s for s in raw.split(',') if s]
+    for s in scenarios:
+        if s not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f'Unknown scenario {s}')
+    return scenarios
+
+
+async def _run(args: argparse.Namespace) -> dict:
+    load_test = LoadTest(args)
+    with scratch_dir() as path:
+        if 'add_sound' not in args.scenarios:
+            return await load_test.run()
+        synthetic.write_long_source('source.webm', seconds=60)
+        with media_server.serve_directory(path) as server:
+            load_test.source_url = f'{server.base_url}/source.webm'
+            return await load_test.run()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--guilds', type=int, default=5)
+    parser.add_argument('--users', type=int, default=5,
+                        help='Members in each guild.')
+    parser.add_argument('--sfx', type=int, default=1000,
+                        help='Sound effects in the catalog.')
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--scenarios', type=_scenario_list,
+                        default=','.join(SCENARIOS))
+    parser.add_argument('--press-interval', type=float, default=2.0)
+    parser.add_argument('--add-sound-interval', type=float, default=10.0)
+    parser.add_argument('--add-sound-burst', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='Write the report here as JSON.')
+    args = parser.parse_args()
+
+    if shutil.which('ffmpeg') is None:
+        print('The load test plays and decodes sounds with ffmpeg, '
+              'which was not found.')
+        return 1
+    report = asyncio.run(_run(args))
+    _print_report(report)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""A local stand-in for a video host, serving files over HTTP.
+
+Like a real CDN it answers Range requests, which is what lets ffmpeg (and
+so yt-dlp's download_ranges) seek without fetching what comes before.
+http.server on its own always sends the whole file.
+"""
+from collections.abc import Iterator
+import contextlib
+import functools
+import http.server
+import os
+import re
+import threading
+
+_RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)$')
+_CHUNK_BYTES = 64 * 1024
+
+
+class _RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def send_head(self):
+        match = _RANGE_RE.match(self.headers.get('Range', ''))
+        path = self.translate_path(self.path)
+        if match is None or not os.path.isfile(path):
+            self._range = None
+            return super().send_head()
+        size = os.path.getsize(path)
+        start = int(match[1]) if match[1] else 0
+        end = min(int(match[2]), size - 1) if match[2] else size - 1
+        if start >= size:
+            self.send_error(416)
+            return None
+        f = open(path, 'rb')
+        f.seek(start)
+        self._range = end - start + 1
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(self._range))
+        self.end_headers()
+        return f
+
+    def copyfile(self, source, outputfile) -> None:
+        remaining = self._range
+        try:
+            while remaining is None or remaining > 0:
+                chunk = source.read(_CHUNK_BYTES if remaining is None else
+                                    min(_CHUNK_BYTES, remaining))
+                if not chunk:
+                    return
+                outputfile.write(chunk)
+                if remaining is not None:
+                    remaining -= len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg hangs up once it has read far enough.
+            pass
+
+
+class MediaServer(http.server.ThreadingHTTPServer):
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+@contextlib.contextmanager
+def serve_directory(directory: str) -> Iterator[MediaServer]:
+    """Serves directory on a free localhost port until the block exits."""
+    handler = functools.partial(_RangeRequestHandler, directory=directory)
+    server = MediaServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,361 @@
+"""Benchmarks for the hot paths of the bot, against synthetic data.
+
+    python -m benchmarks.run --out results.json
+    python -m benchmarks.run --baseline results.json --out new.json
+
+Every case runs in a scratch directory with its own generated catalog and
+history, so nothing touches the real data/ folder. With --baseline, any case
+whose median got slower by more than --tolerance is reported and the exit
+status is non-zero.
+"""
+from collections.abc import Awaitable, Callable
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+
+# The cog reads its configuration from settings, point it at nothing real.
+if 'settings' not in sys.modules:
+    sys.modules['settings'] = types.SimpleNamespace(SOUNDBOARD_CHANNELS={})
+
+from bababooey import Catalog, MemberResolver, VoiceClientManager
+from bababooey.downloads import download_source, download_window
+from bababooey.metrics import metrics
+from bababooey.playback_backends import PyAVBackend, StubBackend
+from bababooey.working_copy import DEFAULT_MARGIN_MILLIS
+from bababooey.ui import SoundEffectCreationManager, make_soundboard_views
+from bababooey.cogs import BababooeyCog
+
+from benchmarks import fakes, media_server, synthetic
+
+QUERIES = ['b', 'ba', 'boo', 'vine', 'Bruh', 'zzz']
+
+
+def _summarize(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'median_ms': statistics.median(samples) * 1000,
+        'p95_ms': samples[min(len(samples) - 1, int(len(samples) * 0.95))] *
+                  1000,
+        'min_ms': samples[0] * 1000,
+    }
+
+
+async def measure(fn: Callable[[], Awaitable[None] | None],
+                  repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = fn()
+        if asyncio.iscoroutine(res):
+            await res
+        samples.append(time.perf_counter() - start)
+    return _summarize(samples)
+
+
+@contextlib.contextmanager
+def scratch_dir():
+    previous = os.getcwd()
+    path = tempfile.mkdtemp(prefix='bababooey-bench-')
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class Suite:
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.results: dict[str, dict] = {}
+        self.have_ffmpeg = shutil.which('ffmpeg') is not None
+
+    def record(self, name: str, result: dict) -> None:
+        self.results[name] = result
+        print(f'{name:<45} median {result["median_ms"]:9.3f}ms '
+              f'p95 {result["p95_ms"]:9.3f}ms')
+
+    def _setup_catalog(self, n_sfx: int, guild: fakes.FakeGuild) -> None:
+        wav = synthetic.write_wav('data/audio/clip.wav', seconds=2)
+        synthetic.write_catalog(
+            synthetic.make_sfx_data(n_sfx,
+                                    wav,
+                                    seed=self.args.seed,
+                                    guild_id=guild.id))
+
+    async def catalog_cases(self, n_sfx: int) -> None:
+        repeat = self.args.repeat
+        with scratch_dir():
+            guild = fakes.FakeGuild()
+            self._setup_catalog(n_sfx, guild)
+            synthetic.write_history(1000, n_sfx,
+                                    [m.id for m in guild.members], [guild.id])
+
+            self.record(f'catalog_load[sfx={n_sfx}]', await
+                        measure(lambda: Catalog(VoiceClientManager()),
+                                max(3, repeat // 10)))
+
+            cog = BababooeyCog(fakes.FakeBot())
+            catalog = cog.catalog
+            self.record(
+                f'find_partial_matches[sfx={n_sfx}]', await measure(
+                    lambda: [catalog.find_partial_matches(q) for q in QUERIES],
+                    repeat))
+
+            interaction = fakes.FakeInteraction(guild.members[0])
+
+            async def autocomplete():
+                for q in [''] + QUERIES:
+                    await cog._autocomplete_sound_effect_name(interaction, q)
+
+            self.record(f'autocomplete[sfx={n_sfx}]', await
+                        measure(autocomplete, repeat))
+            self.record(
+                f'make_soundboard_views[sfx={n_sfx}]', await
+                measure(lambda: make_soundboard_views(catalog.all(), guild.id),
+                        max(3, repeat // 10)))
+
+            template = synthetic.make_sfx_data(1, 'data/audio/clip.wav')[0]
+            created = iter(range(10**6))
+
+            def create():
+                i = next(created)
+                template.name = f'new{i}'
+                template.emoji = f'new-emoji-{i}'
+                catalog.create_new_sfx(template)
+
+            self.record(f'create_new_sfx[sfx={n_sfx}]', await
+                        measure(create, max(3, repeat // 10)))
+
+    async def history_cases(self, rows: int) -> None:
+        repeat = max(3, self.args.repeat // 10)
+        with scratch_dir():
+            guild = fakes.FakeGuild(n_members=20)
+            self._setup_catalog(1000, guild)
+            synthetic.write_history(rows, 1000, [m.id for m in guild.members],
+                                    [guild.id])
+            cog = BababooeyCog(fakes.FakeBot())
+            history = cog.catalog._history
+            member = guild.members[0]
+            self.record(f'users_most_recent[rows={rows}]', await
+                        measure(lambda: history.users_most_recent(member, 25),
+                                repeat))
+            self.record(f'fetch_all_history[rows={rows}]', await
+                        measure(history.fetch_all_history, repeat))
+
+            async def history_command():
+                await cog.history.callback(cog,
+                                           fakes.FakeInteraction(member))
+
+            self.record(f'history_command[rows={rows}]', await
+                        measure(history_command, repeat))
+
+            # Nobody in the member cache, every user costs a REST call.
+            guild._cached = False
+            guild.fetch_latency = 0.05
+
+            async def cold_history_command():
+                cog.member_resolver = MemberResolver(cog.bot)
+                await history_command()
+
+            self.record(f'history_command_cold[rows={rows}]', await
+                        measure(cold_history_command, repeat))
+
+    async def ffmpeg_cases(self) -> None:
+        if not self.have_ffmpeg:
+            print('ffmpeg not found, skipping waveform and playback cases')
+            return
+        repeat = max(3, self.args.repeat // 10)
+        with scratch_dir():
+            guild = fakes.FakeGuild()
+            self._setup_catalog(10, guild)
+            wav = synthetic.write_wav('data/audio/long.wav', seconds=30)
+            sfx_data = synthetic.make_sfx_data(1, wav)[0]
+            sfx_data.end_millis = 30_000
+            vcm = VoiceClientManager()
+            manager = SoundEffectCreationManager(
+                partial_sfx_data=sfx_data,
+                original_interaction=fakes.FakeInteraction(guild.members[0]),
+                voice_client_manager=vcm,
+                catalog=Catalog(vcm),
+                working_copy_margin_millis=None)
+            self.record('generate_waveform[30s]', await
+                        measure(manager.generate_waveform, repeat))
+
+            member = guild.members[0]
+
+            async def playback_startup():
+                await vcm.play_file_for(member, wav, 1000, 3000)
+                await guild.voice_client.wait_for_first_packet()
+
+            self.record('play_file_for_first_packet[30s]', await
+                        measure(playback_startup, repeat))
+            guild.voice_client.stop()
+
+    async def creation_cases(self) -> None:
+        """One /add_sound edit, waveform and preview, of a 20 minute source."""
+        if not self.have_ffmpeg:
+            print('ffmpeg not found, skipping the creation cases')
+            return
+        repeat = max(3, self.args.repeat // 10)
+        with scratch_dir():
+            guild = fakes.FakeGuild()
+            member = guild.members[0]
+            self._setup_catalog(10, guild)
+            source = synthetic.write_long_source('data/audio/long.webm',
+                                                 seconds=1200)
+            for name, margin in (('download', None),
+                                 ('working_copy', DEFAULT_MARGIN_MILLIS)):
+                sfx_data = synthetic.make_sfx_data(1, source)[0]
+                sfx_data.start_millis = 600_000
+                sfx_data.end_millis = 603_000
+                vcm = VoiceClientManager()
+                manager = SoundEffectCreationManager(
+                    partial_sfx_data=sfx_data,
+                    original_interaction=fakes.FakeInteraction(member),
+                    voice_client_manager=vcm,
+                    catalog=Catalog(vcm),
+                    working_copy_margin_millis=margin)
+                manager.duration = 1_200_000
+
+                async def edit():
+                    # Nudge the end, like someone tightening a trim.
+                    manager.partial_sfx_data.end_millis += 100
+                    await manager.generate_waveform()
+                    await manager.play_preview(member)
+                    await guild.voice_client.wait_for_first_packet()
+
+                self.record(f'creation_edit[{name},20min]', await
+                            measure(edit, repeat))
+                guild.voice_client.stop()
+
+    async def backend_cases(self) -> None:
+        """First packet latency of the backends that don't need ffmpeg."""
+        repeat = max(3, self.args.repeat // 10)
+        backends = [StubBackend()]
+        try:
+            backends.append(PyAVBackend())
+        except ValueError:
+            print('av not installed, skipping the pyav backend')
+        with scratch_dir():
+            guild = fakes.FakeGuild()
+            member = guild.members[0]
+            wav = synthetic.write_wav('data/audio/long.wav', seconds=30)
+            for backend in backends:
+                vcm = VoiceClientManager(backend)
+
+                async def playback_startup():
+                    await vcm.play_file_for(member, wav, 1000, 3000)
+                    await guild.voice_client.wait_for_first_packet()
+
+                self.record(
+                    f'play_file_for_first_packet[{backend.name},30s]', await
+                    measure(playback_startup, repeat))
+                guild.voice_client.stop()
+
+    async def download_cases(self) -> None:
+        """/add_sound's download of a 3s clip of a 20 minute source."""
+        if not self.have_ffmpeg:
+            print('ffmpeg not found, skipping the download cases')
+            return
+        repeat = max(1, self.args.repeat // 10)
+        with scratch_dir() as path:
+            synthetic.write_long_source('long.webm', seconds=1200)
+            with media_server.serve_directory(path) as server:
+                url = f'{server.base_url}/long.webm'
+                for kind, window in (('window', download_window(
+                        600_000, 603_000)), ('full', None)):
+
+                    async def download():
+                        source = await download_source(url, window)
+                        # Or the next run finds it already downloaded.
+                        os.remove(source.file_path)
+
+                    self.record(f'download_source[{kind},20min]', await
+                                measure(download, repeat))
+                    kept = metrics.counter_value('source_download_bytes_total',
+                                                 kind=kind)
+                    print(f'  kept {kept / repeat / 1024:.0f}KiB per download')
+
+    async def run(self) -> None:
+        for n_sfx in self.args.catalog_sizes:
+            await self.catalog_cases(n_sfx)
+        for rows in self.args.history_rows:
+            await self.history_cases(rows)
+        await self.ffmpeg_cases()
+        await self.creation_cases()
+        await self.backend_cases()
+        await self.download_cases()
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Returns a description of every case that regressed."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['median_ms']
+        after = result['median_ms']
+        if before > 0 and after > before * (1 + tolerance):
+            regressions.append(
+                f'{name}: {before:.3f}ms -> {after:.3f}ms '
+                f'(+{(after / before - 1) * 100:.0f}%)')
+    return regressions
+
+
+def _int_list(raw: str) -> list[int]:
+    return [int(x) for x in raw.split(',') if x]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--catalog-sizes', type=_int_list, default='1000,10000')
+    parser.add_argument('--history-rows', type=_int_list, default='100000')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='Write the results here as JSON.')
+    parser.add_argument('--baseline', help='Results JSON to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed slowdown before failing, 0.2 is 20%%.')
+    args = parser.parse_args()
+
+    suite = Suite(args)
+    asyncio.run(suite.run())
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(
+                {
+                    'python': platform.python_version(),
+                    'machine': platform.machine(),
+                    'results': suite.results,
+                },
+                f,
+                indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(suite.results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            return 1
+        print('No regressions against the baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""Runs the load test for hours of simulated time and checks nothing leaks.
+
+    python -m benchmarks.soak
+    python -m benchmarks.soak --hours 8 --time-scale 120
+    python -m benchmarks.soak --bound tasks=50 --out soak.json
+
+Time is compressed by --time-scale: people press buttons, /x and /add_sound
+that many times faster than they would, and abandoned /add_sound sessions
+expire that much sooner. Every /add_sound in ABANDON_EVERY is walked away from
+rather than cancelled.
+
+A warmup fills the caches, then traffic stops until everything has expired and
+a baseline is taken. After --hours of traffic and the same quiet spell, it is
+compared to the baseline: event loop tasks, open file descriptors, child
+processes, RSS, memory traced by tracemalloc, the cog's per-user and
+per-session state and files left in data/tmp and data/youtubedl. Any that grew
+by more than its bound fails the run. Checkpoints in between print the same
+numbers and the biggest allocation growth since the baseline, to see which
+way things are heading.
+
+Linux only, the process is measured through /proc.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+import tracemalloc
+
+# First, it points settings at nothing real before the cog is imported.
+from benchmarks.run import scratch_dir
+
+from bababooey.creation_sessions import (DEFAULT_IDLE_TTL_SECONDS,
+                                         SWEEP_INTERVAL_SECONDS)
+from bababooey.downloads import DOWNLOAD_DIR
+from bababooey.metrics import metrics
+
+from benchmarks import media_server, synthetic
+from benchmarks.load_test import LoadTest
+
+SCENARIOS = ('buttons', 'autocomplete', 'x', 'guess', 'add_sound')
+ABANDON_EVERY = 3
+TEMP_FILE_PATTERNS = ('data/tmp/*', f'{DOWNLOAD_DIR}/*')
+# How much each measurement may grow from the baseline to the end. After the
+# quiet spell nothing should be in flight, so most of these are a little
+# slack for the event loop's own bookkeeping.
+BOUNDS = {
+    'tasks': 10,
+    'open_fds': 10,
+    'child_processes': 0,
+    'rss_bytes': 64 * 2**20,
+    'traced_bytes': 16 * 2**20,
+    # One per person who ever used /x, so at most everyone.
+    'x_messages': None,
+    'creation_sessions': 0,
+    'playback_subscribers': 0,
+    'temp_files': 0,
+}
+# Allocation sites shown at each checkpoint.
+TOP_ALLOCATIONS = 5
+
+
+def _child_processes() -> int:
+    children = 0
+    for path in glob.glob('/proc/self/task/*/children'):
+        with open(path) as f:
+            children += len(f.read().split())
+    return children
+
+
+def _rss_bytes() -> int:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class Soak:
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.scale = args.time_scale
+        # The load test's knobs are in real seconds.
+        args.seconds = args.hours * 3600 / self.scale
+        args.press_interval = args.press_interval / self.scale
+        args.add_sound_interval = args.add_sound_interval / self.scale
+        args.scenarios = SCENARIOS
+        self.load_test = LoadTest(args)
+        self.load_test.abandon_every = ABANDON_EVERY
+        self.bounds = dict(BOUNDS,
+                           x_messages=args.guilds * args.users)
+        self.bounds.update(args.bound)
+        self.checkpoints: list[dict] = []
+        self._baseline: tracemalloc.Snapshot | None = None
+        self._started = 0.0
+        self._traffic_started: float | None = None
+
+    @property
+    def quiet_seconds(self) -> float:
+        """Long enough for every abandoned session to expire."""
+        return ((DEFAULT_IDLE_TTL_SECONDS + SWEEP_INTERVAL_SECONDS) /
+                self.scale + self.args.settle_seconds)
+
+    async def _sweep(self) -> None:
+        # The cog's own sweeper runs on the uncompressed interval.
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL_SECONDS / self.scale)
+            await self.load_test.cog.creation_sessions.expire_idle()
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ])
+
+    def checkpoint(self, label: str) -> dict:
+        cog = self.load_test.cog
+        now = time.perf_counter()
+        # Simulated time only passes while there's traffic.
+        traffic = 0.0
+        if self._traffic_started is not None:
+            traffic = min(now - self._traffic_started, self.args.seconds)
+        checkpoint = {
+            'label': label,
+            'seconds': now - self._started,
+            'simulated_hours': traffic * self.scale / 3600,
+            'tasks': len(asyncio.all_tasks()),
+            'open_fds': len(os.listdir('/proc/self/fd')),
+            'child_processes': _child_processes(),
+            'rss_bytes': _rss_bytes(),
+            'traced_bytes': tracemalloc.get_traced_memory()[0],
+            'x_messages': len(cog.x_messages),
+            'creation_sessions': len(cog.creation_sessions),
+            'playback_subscribers': metrics.gauge_values().get(
+                'playback_subscribers', 0),
+            'temp_files': sum(
+                len(glob.glob(pattern)) for pattern in TEMP_FILE_PATTERNS),
+        }
+        snapshot = self._snapshot()
+        if self._baseline is None:
+            self._baseline = snapshot
+            checkpoint['top_allocations'] = []
+        else:
+            checkpoint['top_allocations'] = [
+                str(stat) for stat in snapshot.compare_to(
+                    self._baseline, 'lineno')[:TOP_ALLOCATIONS]
+            ]
+        self.checkpoints.append(checkpoint)
+        _print_checkpoint(checkpoint)
+        return checkpoint
+
+    async def _checkpoint_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.args.checkpoint_seconds)
+            self.checkpoint('traffic')
+
+    async def _traffic(self, seconds: float) -> None:
+        self.load_test.deadline = time.perf_counter() + seconds
+        await asyncio.gather(*self.load_test.workers())
+
+    async def run(self) -> dict:
+        tracemalloc.start()
+        self._started = time.perf_counter()
+        await self.load_test.start()
+        cog = self.load_test.cog
+        cog.creation_sessions.idle_ttl = DEFAULT_IDLE_TTL_SECONDS / self.scale
+        sweeper = asyncio.create_task(self._sweep())
+        checkpoints: asyncio.Task | None = None
+        try:
+            await self._traffic(self.args.warmup_seconds)
+            await asyncio.sleep(self.quiet_seconds)
+            baseline = self.checkpoint('baseline')
+            checkpoints = asyncio.create_task(self._checkpoint_forever())
+            self._traffic_started = time.perf_counter()
+            await self._traffic(self.args.seconds)
+            checkpoints.cancel()
+            await asyncio.sleep(self.quiet_seconds)
+            final = self.checkpoint('final')
+        finally:
+            if checkpoints is not None:
+                checkpoints.cancel()
+            sweeper.cancel()
+            await self.load_test.stop()
+            tracemalloc.stop()
+        violations = {}
+        for name, bound in self.bounds.items():
+            growth = final[name] - baseline[name]
+            if growth > bound:
+                violations[name] = {'growth': growth, 'bound': bound}
+        report = self.load_test.report(time.perf_counter() - self._started)
+        report['checkpoints'] = self.checkpoints
+        report['violations'] = violations
+        return report
+
+
+def _print_checkpoint(checkpoint: dict) -> None:
+    print(f'{checkpoint["label"]} at {checkpoint["simulated_hours"]:.2f}h '
+          f'({checkpoint["seconds"]:.0f}s): '
+          f'tasks {checkpoint["tasks"]}, fds {checkpoint["open_fds"]}, '
+          f'children {checkpoint["child_processes"]}, '
+          f'rss {checkpoint["rss_bytes"] / 2**20:.1f}MiB, '
+          f'traced {checkpoint["traced_bytes"] / 2**20:.1f}MiB, '
+          f'x messages {checkpoint["x_messages"]}, '
+          f'sessions {checkpoint["creation_sessions"]}, '
+          f'subscribers {checkpoint["playback_subscribers"]:g}, '
+          f'temp files {checkpoint["temp_files"]}')
+    for stat in checkpoint['top_allocations']:
+        print(f'    {stat}')
+
+
+def _bound(raw: str) -> tuple[str, float]:
+    name, sep, value = raw.partition('=')
+    if not sep or name not in BOUNDS:
+        raise argparse.ArgumentTypeError(
+            f'Expected one of {", ".join(BOUNDS)}=growth, got {raw}')
+    try:
+        return name, float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value} is not a number')
+
+
+async def _run(args: argparse.Namespace) -> dict:
+    soak = Soak(args)
+    with scratch_dir() as path:
+        synthetic.write_long_source('source.webm', seconds=60)
+        with media_server.serve_directory(path) as server:
+            soak.load_test.source_url = f'{server.base_url}/source.webm'
+            return await soak.run()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--guilds', type=int, default=3)
+    parser.add_argument('--users', type=int, default=4,
+                        help='Members in each guild.')
+    parser.add_argument('--sfx', type=int, default=1000,
+                        help='Sound effects in the catalog.')
+    parser.add_argument('--hours', type=float, default=2,
+                        help='Simulated hours of traffic.')
+    parser.add_argument('--time-scale', type=float, default=60,
+                        help='Simulated seconds per real second.')
+    parser.add_argument('--press-interval', type=float, default=60,
+                        help='Simulated seconds between button presses.')
+    parser.add_argument('--add-sound-interval', type=float, default=600,
+                        help='Simulated seconds between /add_sound bursts.')
+    parser.add_argument('--add-sound-burst', type=int, default=3)
+    parser.add_argument('--warmup-seconds', type=float, default=10)
+    parser.add_argument('--settle-seconds', type=float, default=5,
+                        help='Extra quiet time before measuring.')
+    parser.add_argument('--checkpoint-seconds', type=float, default=15)
+    parser.add_argument('--bound',
+                        type=_bound,
+                        action='append',
+                        default=[],
+                        help='Override a bound, like tasks=50.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='Write the report here as JSON.')
+    args = parser.parse_args()
+
+    if shutil.which('ffmpeg') is None:
+        print('The soak test plays and decodes sounds with ffmpeg, '
+              'which was not found.')
+        return 1
+    if not os.path.isdir('/proc/self/fd'):
+        print('The soak test measures the process through /proc.')
+        return 1
+    report = asyncio.run(_run(args))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    for name, violation in report['violations'].items():
+        print(f'LEAK {name} grew by {violation["growth"]:g}, '
+              f'more than {violation["bound"]:g}')
+    return 1 if report['violations'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
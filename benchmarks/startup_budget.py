@@ -0,0 +1,102 @@
+"""Fails when starting the bot gets slower than its budget.
+
+    python -m benchmarks.startup_budget
+    python -m benchmarks.startup_budget --sfx 5000 --budget 0.8
+
+Each measurement runs in a fresh interpreter, since imports are only cold
+once per process. It times importing the cog and loading a synthetic
+catalog, both without and with an up to date snapshot, and checks that
+modules only some commands need weren't imported at startup. The exit
+status is non-zero if anything is over budget.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import textwrap
+
+from benchmarks import synthetic
+from benchmarks.run import scratch_dir
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only imported by the commands that use them.
+LAZY_MODULES = ('yt_dlp', 'IPython', 'numpy', 'av')
+
+_CHILD = textwrap.dedent('''
+    import json, sys, time, types
+    sys.path.insert(0, {root!r})
+    sys.modules['settings'] = types.SimpleNamespace(SOUNDBOARD_CHANNELS={{}})
+    start = time.perf_counter()
+    import bababooey.cogs
+    imported = time.perf_counter()
+    from bababooey import Catalog, VoiceClientManager
+    Catalog(VoiceClientManager())
+    loaded = time.perf_counter()
+    print(json.dumps({{
+        'import': imported - start,
+        'catalog': loaded - imported,
+        'lazy_imported': [m for m in {lazy!r} if m in sys.modules],
+    }}))
+''')
+
+
+def _measure_once() -> dict:
+    child = _CHILD.format(root=REPO_ROOT, lazy=LAZY_MODULES)
+    out = subprocess.run([sys.executable, '-c', child],
+                         check=True,
+                         capture_output=True,
+                         text=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def _measure(repeat: int) -> dict:
+    runs = [_measure_once() for _ in range(repeat)]
+    return {
+        'import': statistics.median(r['import'] for r in runs),
+        'catalog': statistics.median(r['catalog'] for r in runs),
+        'lazy_imported': sorted({m for r in runs for m in r['lazy_imported']}),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--sfx', type=int, default=2000,
+                        help='Size of the synthetic catalog.')
+    parser.add_argument('--budget', type=float, default=0.75,
+                        help='Seconds allowed for import plus catalog load.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    failures = []
+    with scratch_dir():
+        wav = synthetic.write_wav('data/audio/clip.wav', seconds=1)
+        synthetic.write_catalog(synthetic.make_sfx_data(args.sfx, wav))
+        # The first start has no snapshot and writes one.
+        cold = _measure_once()
+        warm = _measure(args.repeat)
+
+    print(f'import bababooey.cogs        {warm["import"] * 1000:9.1f}ms')
+    print(f'catalog load, no snapshot    {cold["catalog"] * 1000:9.1f}ms')
+    print(f'catalog load, snapshot       {warm["catalog"] * 1000:9.1f}ms')
+    total = warm['import'] + warm['catalog']
+    print(f'total                        {total * 1000:9.1f}ms '
+          f'(budget {args.budget * 1000:.0f}ms)')
+
+    if total > args.budget:
+        failures.append(f'startup took {total:.3f}s, over the '
+                        f'{args.budget:.3f}s budget')
+    if warm['catalog'] > cold['catalog']:
+        failures.append('loading from the snapshot was slower than without')
+    for module in warm['lazy_imported']:
+        failures.append(f'{module} was imported at startup')
+    for failure in failures:
+        print(f'FAIL {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
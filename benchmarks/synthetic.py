@@ -0,0 +1,136 @@
+"""Generates reproducible fake catalogs, history tables and audio files."""
+from collections.abc import Iterator
+import datetime
+import itertools
+import math
+import os
+import random
+import shelve
+import sqlite3
+import struct
+import subprocess
+import wave
+
+from bababooey import SoundEffectData
+from bababooey.history import HISTORY_DB_PATH
+
+_SYLLABLES = [
+    'ba', 'boo', 'ey', 'vine', 'bruh', 'oof', 'yeet', 'nope', 'wow', 'huh',
+    'ding', 'dong', 'sad', 'trom', 'bone', 'air', 'horn', 'meme', 'cat', 'dog'
+]
+SAMPLE_RATE = 48000
+
+
+def write_wav(path: str, seconds: float, frequency: float = 440.0) -> str:
+    """Writes a stereo sine wave, enough to exercise ffmpeg."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        frames = bytearray()
+        for i in range(int(seconds * SAMPLE_RATE)):
+            sample = int(8000 * math.sin(2 * math.pi * frequency * i /
+                                         SAMPLE_RATE))
+            frames += struct.pack('<hh', sample, sample)
+        w.writeframes(bytes(frames))
+    return path
+
+
+def write_long_source(path: str, seconds: float) -> str:
+    """Writes a tone as Opus in WebM, like YouTube's bestaudio, with ffmpeg.
+
+    Its cues let ffmpeg seek, like it can in the real thing.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i',
+        f'sine=d={seconds}', '-ac', '2', '-c:a', 'libopus', '-b:a', '128k',
+        path
+    ],
+                   check=True)
+    return path
+
+
+def _unique_names(rng: random.Random, n: int) -> Iterator[str]:
+    seen = set()
+    for i in itertools.count():
+        name = ''.join(rng.choice(_SYLLABLES)
+                       for _ in range(rng.randint(1, 3)))[:9]
+        if name in seen:
+            name = f'{name[:6]}{i}'
+        if name in seen:
+            continue
+        seen.add(name)
+        yield name
+        if len(seen) == n:
+            return
+
+
+def _emoji(i: int) -> str:
+    # Real emoji first, then unique strings once we run out.
+    if i < 0x1F64F - 0x1F300:
+        return chr(0x1F300 + i)
+    return f'{chr(0x1F300 + i % 0x100)}{i}'
+
+
+def make_sfx_data(n: int,
+                  file_path: str,
+                  seed: int = 0,
+                  guild_id: int = 1,
+                  author_id: int = 1) -> list[SoundEffectData]:
+    rng = random.Random(seed)
+    created = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc)
+    return [
+        SoundEffectData(num=num,
+                        name=name,
+                        emoji=_emoji(num),
+                        yt_url=f'https://www.youtube.com/watch?v={num:011d}',
+                        file_path=file_path,
+                        author=author_id,
+                        guild=guild_id,
+                        created_at=created + datetime.timedelta(hours=num),
+                        start_millis=0,
+                        end_millis=1000,
+                        tags=f'{name},')
+        for num, name in enumerate(_unique_names(rng, n))
+    ]
+
+
+def write_catalog(sfx_data: list[SoundEffectData]) -> None:
+    """Writes the catalog where Catalog expects it, relative to the cwd."""
+    os.makedirs('data', exist_ok=True)
+    with shelve.open('data/sfx_data') as s:
+        s['data'] = sfx_data
+
+
+def write_history(rows: int,
+                  n_sfx: int,
+                  user_ids: list[int],
+                  guild_ids: list[int],
+                  seed: int = 0,
+                  chunk_size: int = 100_000) -> None:
+    """Appends rows of plays to the history table, relative to the cwd."""
+    os.makedirs('data', exist_ok=True)
+    rng = random.Random(seed)
+    con = sqlite3.connect(HISTORY_DB_PATH)
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS user_history(datetime, user_id, guild_id, num)'
+    )
+    start = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def generate() -> Iterator[tuple[str, int, int, int]]:
+        for i in range(rows):
+            yield ((start + datetime.timedelta(seconds=i)).isoformat(),
+                   rng.choice(user_ids), rng.choice(guild_ids),
+                   rng.randrange(n_sfx))
+
+    plays = generate()
+    while True:
+        chunk = list(itertools.islice(plays, chunk_size))
+        if not chunk:
+            break
+        with con:
+            con.executemany('INSERT INTO user_history VALUES(?, ?, ?, ?)',
+                            chunk)
+    con.close()
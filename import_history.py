@@ -0,0 +1,48 @@
+"""Import the sound effect history from the old bot's logs.
+
+Safe to run while the bot is up, and safe to interrupt: running it again
+with the same checkpoint picks up where it left off.
+"""
+import argparse
+import logging
+import re
+
+from bababooey import Catalog, VoiceClientManager
+from bababooey.history_import import (DEFAULT_BATCH_SIZE, LEGACY_LINE_RE,
+                                      HistoryImporter)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('logs', nargs='+', help='Legacy log files to import.')
+    parser.add_argument('--checkpoint',
+                        default='data/history_import_checkpoint.json',
+                        help='Where to remember progress between runs.')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument(
+        '--pattern',
+        default=LEGACY_LINE_RE.pattern,
+        help='Regex with datetime, user_id, guild_id and name groups.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    catalog = Catalog(VoiceClientManager())
+
+    def name_to_num(name: str) -> int | None:
+        sfx = catalog.by_name(name)
+        return None if sfx is None else sfx.num
+
+    importer = HistoryImporter(name_to_num,
+                               checkpoint_path=args.checkpoint,
+                               batch_size=args.batch_size,
+                               pattern=re.compile(args.pattern))
+    try:
+        for path in args.logs:
+            importer.import_file(path)
+    finally:
+        importer.close()
+    print(importer.stats.summary())
+
+
+if __name__ == '__main__':
+    main()
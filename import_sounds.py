@@ -0,0 +1,48 @@
+"""Create many sound effects at once from local audio files.
+
+Takes either a directory of files named like "<emoji> <name>.mp3" or a
+CSV/JSON manifest with name, emoji, source, start, end and tags columns.
+
+Run this while the bot is stopped (it writes the catalog directly), or use
+the /import_sounds command instead. Redraw the soundboard afterwards with
+/sync_soundboard.
+"""
+import argparse
+import asyncio
+import logging
+import os
+
+from bababooey import Catalog, VoiceClientManager
+from bababooey.bulk_import import entries_from_directory, read_manifest, run_import
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('source', help='A directory or a .csv/.json manifest.')
+    parser.add_argument('--author', type=int, required=True,
+                        help='User id to credit as the creator.')
+    parser.add_argument('--guild', type=int, required=True)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Clips processed at once, defaults to the '
+                        'non-reserved ffmpeg slots.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if os.path.isdir(args.source):
+        entries = entries_from_directory(args.source)
+    else:
+        entries = read_manifest(args.source)
+
+    catalog = Catalog(VoiceClientManager())
+    report = asyncio.run(
+        run_import(entries,
+                   catalog,
+                   author=args.author,
+                   guild=args.guild,
+                   max_workers=args.workers))
+    print(report.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Runs the test from an empty directory, where data/ is the bot's."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data')
+    return tmp_path / 'data'
@@ -0,0 +1,102 @@
+import datetime
+import shelve
+
+import pytest
+
+from bababooey import Catalog, SoundEffectData, VoiceClientManager
+
+
+def _sfx_data(num: int, name: str, emoji: str) -> SoundEffectData:
+    return SoundEffectData(num=num,
+                           name=name,
+                           emoji=emoji,
+                           yt_url=f'https://www.youtube.com/watch?v={num:011d}',
+                           file_path=f'data/{name}.ogg',
+                           author=1,
+                           guild=1,
+                           created_at=datetime.datetime(
+                               2022, 1, 1, tzinfo=datetime.timezone.utc),
+                           end_millis=1000,
+                           tags=f'{name},')
+
+
+@pytest.fixture
+def catalog(data_dir):
+    with shelve.open('data/sfx_data') as s:
+        s['data'] = [
+            _sfx_data(0, 'bababooey', '🐒'),
+            _sfx_data(1, 'airhorn', '📯'),
+            _sfx_data(2, 'bruh', '😐'),
+        ]
+    return Catalog(VoiceClientManager())
+
+
+def _reload() -> Catalog:
+    return Catalog(VoiceClientManager())
+
+
+def test_update_swaps_the_name_and_emoji_indexes(catalog):
+    sfx = catalog.by_num(1)
+    changes = []
+    catalog.add_change_listener(lambda before, after: changes.append(
+        (before.name, after.name)))
+
+    updated = catalog.update(1, name='horn', emoji='🎺', end_millis=500)
+
+    assert updated is sfx
+    assert sfx.name == 'horn'
+    assert catalog.by_name('airhorn') is None
+    assert catalog.by_name('horn') is sfx
+    assert catalog.by_emoji('📯') is None
+    assert catalog.by_emoji('🎺') is sfx
+    assert changes == [('airhorn', 'horn')]
+    reloaded = _reload().by_num(1)
+    assert (reloaded.name, reloaded.emoji, reloaded.end_millis) == ('horn', '🎺',
+                                                                     500)
+
+
+def test_update_keeping_the_name(catalog):
+    catalog.update(0, name='bababooey', tags='monkey,')
+    assert catalog.by_name('bababooey').tags == 'monkey,'
+
+
+def test_update_to_a_taken_name_changes_nothing(catalog):
+    with pytest.raises(ValueError):
+        catalog.update(1, name='bruh')
+    with pytest.raises(ValueError):
+        catalog.update(1, emoji='🐒')
+    with pytest.raises(ValueError):
+        catalog.update(1, num=5)
+    with pytest.raises(ValueError):
+        catalog.update(9, name='nope')
+    assert catalog.by_name('airhorn').num == 1
+    assert catalog.by_name('bruh').num == 2
+    assert catalog.by_emoji('🐒').num == 0
+    assert _reload().by_name('airhorn').num == 1
+
+
+def test_delete_removes_it_from_every_index(catalog):
+    deleted = []
+    catalog.add_change_listener(lambda before, after: deleted.append(
+        (before.num, after)))
+
+    catalog.delete(1)
+
+    assert catalog.by_num(1) is None
+    assert catalog.by_name('airhorn') is None
+    assert catalog.by_emoji('📯') is None
+    assert [sfx.num for sfx in catalog.all()] == [0, 2]
+    assert deleted == [(1, None)]
+    assert [sfx.num for sfx in _reload().all()] == [0, 2]
+    with pytest.raises(ValueError):
+        catalog.delete(1)
+
+
+def test_deleted_nums_and_names_are_free_again(catalog):
+    catalog.delete(2)
+    created = catalog.create_new_sfx(_sfx_data(-1, 'bruh', '😐'))
+    # The highest num was deleted, it still isn't reused.
+    assert created.num == 3
+    assert catalog.by_name('bruh') is created
+    assert catalog.by_emoji('😐') is created
+    assert [sfx.num for sfx in _reload().all()] == [0, 1, 3]
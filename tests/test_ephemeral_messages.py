@@ -0,0 +1,147 @@
+import asyncio
+import datetime
+
+import discord
+
+from bababooey.ephemeral_messages import EphemeralMessageRegistry
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class FakeMessage:
+
+    def __init__(self, id: int, seconds: float):
+        self.id = id
+        self.created_at = START + datetime.timedelta(seconds=seconds)
+        self.deleted = 0
+
+    async def delete(self):
+        self.deleted += 1
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = START
+
+    def __call__(self) -> datetime.datetime:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += datetime.timedelta(seconds=seconds)
+
+
+def _registry(clock: FakeClock, ttl: float = 60,
+              max_age: float = 15 * 60) -> EphemeralMessageRegistry:
+    return EphemeralMessageRegistry(ttl,
+                                    max_age=max_age,
+                                    batch_seconds=0.01,
+                                    deletes_per_second=1000,
+                                    clock=clock)
+
+
+async def _run_worker(registry: EphemeralMessageRegistry) -> None:
+    registry.start()
+    await asyncio.sleep(0.1)
+    registry.stop()
+
+
+def test_keeps_only_the_latest_per_user_and_guild():
+
+    async def main():
+        clock = FakeClock()
+        registry = _registry(clock)
+        first = FakeMessage(1, 0)
+        second = FakeMessage(2, 1)
+        other_guild = FakeMessage(3, 1)
+        other_user = FakeMessage(4, 1)
+        registry.track(10, 100, first)
+        registry.track(10, 100, second)
+        registry.track(10, 200, other_guild)
+        registry.track(11, 100, other_user)
+        assert len(registry) == 3
+        await _run_worker(registry)
+        return first, second, other_guild, other_user
+
+    first, second, other_guild, other_user = asyncio.run(main())
+    assert first.deleted == 1
+    assert second.deleted == other_guild.deleted == other_user.deleted == 0
+
+
+def test_a_message_tracked_late_is_the_one_deleted():
+
+    async def main():
+        registry = _registry(FakeClock())
+        newer = FakeMessage(2, 5)
+        older = FakeMessage(1, 0)
+        registry.track(10, 100, newer)
+        # Finished sending after the newer one was tracked.
+        registry.track(10, 100, older)
+        await _run_worker(registry)
+        return older, newer
+
+    older, newer = asyncio.run(main())
+    assert older.deleted == 1
+    assert newer.deleted == 0
+
+
+def test_deletes_messages_once_the_ttl_passes():
+
+    async def main():
+        clock = FakeClock()
+        registry = _registry(clock, ttl=60)
+        early = FakeMessage(1, 0)
+        late = FakeMessage(2, 30)
+        registry.track(10, 100, early)
+        registry.track(11, 100, late)
+        clock.advance(61)
+        await _run_worker(registry)
+        assert len(registry) == 1
+        clock.advance(30)
+        await _run_worker(registry)
+        assert len(registry) == 0
+        return early, late
+
+    early, late = asyncio.run(main())
+    assert early.deleted == 1
+    assert late.deleted == 1
+
+
+def test_skips_messages_too_old_to_delete():
+
+    async def main():
+        clock = FakeClock()
+        registry = _registry(clock, ttl=60, max_age=120)
+        message = FakeMessage(1, 0)
+        registry.track(10, 100, message)
+        clock.advance(500)
+        await _run_worker(registry)
+        assert len(registry) == 0
+        return message
+
+    assert asyncio.run(main()).deleted == 0
+
+
+class _NotFoundResponse:
+    status = 404
+    reason = 'Not Found'
+
+
+class GoneMessage(FakeMessage):
+
+    async def delete(self):
+        raise discord.NotFound(_NotFoundResponse(), 'gone')
+
+
+def test_a_failed_delete_does_not_stop_the_worker():
+
+    async def main():
+        registry = _registry(FakeClock())
+        registry.track(10, 100, GoneMessage(1, 0))
+        replaced = FakeMessage(2, 1)
+        registry.track(10, 100, replaced)
+        registry.track(10, 100, FakeMessage(3, 2))
+        await _run_worker(registry)
+        return replaced
+
+    assert asyncio.run(main()).deleted == 1
@@ -0,0 +1,69 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from bababooey.fingerprints import FingerprintIndex, fingerprint_pcm
+from bababooey.pcm import SAMPLE_RATE
+
+
+def _noise(seed: int, seconds: float = 4.0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(0, 6000, int(SAMPLE_RATE * seconds))
+
+
+def _pcm(mono, volume: float = 1.0) -> bytes:
+    samples = np.clip(mono * volume, -32768, 32767).astype('<i2')
+    # The same on both channels.
+    return np.repeat(samples, 2).tobytes()
+
+
+@pytest.fixture
+def clip():
+    return _noise(1)
+
+
+@pytest.fixture
+def index(clip):
+    index = FingerprintIndex()
+    index.add(1, fingerprint_pcm(_pcm(clip)))
+    index.add(2, fingerprint_pcm(_pcm(_noise(2))))
+    return index
+
+
+def test_matches_the_same_clip_quieter(index, clip):
+    assert index.matches(fingerprint_pcm(_pcm(clip, volume=0.5))) == [(1, 0.0)]
+
+
+def test_matches_a_slightly_different_trim(index, clip):
+    # Neither end lines up with a fingerprint frame.
+    matches = index.matches(fingerprint_pcm(_pcm(clip[4801:-4000])))
+    assert [num for num, _ in matches] == [1]
+    assert 0 < matches[0][1] < 0.3
+
+
+def test_does_not_match_different_audio(index):
+    assert index.matches(fingerprint_pcm(_pcm(_noise(3)))) == []
+
+
+def test_does_not_match_a_small_part(index, clip):
+    assert index.matches(fingerprint_pcm(_pcm(clip[:SAMPLE_RATE]))) == []
+
+
+def test_exclude_and_remove(index, clip):
+    fingerprint = fingerprint_pcm(_pcm(clip))
+    assert index.matches(fingerprint, exclude=1) == []
+    index.remove(1)
+    assert 1 not in index
+    assert len(index) == 1
+    assert index.matches(fingerprint) == []
+
+
+def test_too_short_to_fingerprint(index):
+    assert fingerprint_pcm(_pcm(_noise(4, seconds=0.01))) == b''
+    assert index.matches(b'') == []
+
+
+def test_clusters_near_duplicates(index, clip):
+    index.add(3, fingerprint_pcm(_pcm(clip[4801:], volume=0.8)))
+    index.add(4, fingerprint_pcm(_pcm(_noise(4))))
+    assert index.clusters() == [[1, 3]]
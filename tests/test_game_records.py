@@ -0,0 +1,83 @@
+import random
+
+from bababooey.game_records import Board, GameRecords, RunnerUp, _RankedBoard
+
+
+def _expected_order(scores: dict[int, float],
+                    higher_is_better: bool) -> list[int]:
+    return sorted(scores,
+                  key=lambda user_id: (-scores[user_id] if higher_is_better
+                                       else scores[user_id], user_id))
+
+
+def test_ranks_match_sorting():
+    rng = random.Random(0)
+    for higher_is_better in (False, True):
+        board = _RankedBoard(higher_is_better)
+        scores = {}
+        for _ in range(2000):
+            user_id = rng.randrange(300)
+            # Few distinct values, so lots of ties and shared buckets.
+            score = rng.choice([rng.randrange(-5, 5), rng.random() * 10,
+                                round(rng.uniform(-3, 3), 4)])
+            board.set(user_id, score)
+            scores[user_id] = score
+        order = _expected_order(scores, higher_is_better)
+        assert [user_id for user_id, _ in board.top(len(order))] == order
+        for rank, user_id in enumerate(order, start=1):
+            assert board.rank(user_id) == rank
+
+
+def test_top_is_best_first_and_capped():
+    board = _RankedBoard(higher_is_better=False)
+    board.load({1: 3.5, 2: 1.25, 3: 1.25, 4: 9.0})
+    assert board.top(3) == [(2, 1.25), (3, 1.25), (1, 3.5)]
+    assert board.top(10) == [(2, 1.25), (3, 1.25), (1, 3.5), (4, 9.0)]
+    assert board.top(0) == []
+
+
+def test_set_replaces_the_previous_score():
+    board = _RankedBoard(higher_is_better=True)
+    board.load({1: 5, 2: 3})
+    board.set(2, 8)
+    assert board.get(2) == 8
+    assert board.rank(2) == 1
+    assert board.rank(1) == 2
+    assert board.rank(3) is None
+    assert board.top(5) == [(2, 8), (1, 5)]
+
+
+def _record(records: GameRecords, winner_id: int, solve_seconds: float,
+            guild_id: int = 1):
+    return records.record_round(guild_id=guild_id,
+                                num=0,
+                                winner_id=winner_id,
+                                solve_seconds=solve_seconds,
+                                letters_hidden=5,
+                                letters_total=10,
+                                runners_up=[RunnerUp(99, 1.0)])
+
+
+def test_records_rounds_and_reloads_the_boards(tmp_path):
+    db_path = str(tmp_path / 'game_records.db')
+    records = GameRecords(db_path)
+    _record(records, winner_id=1, solve_seconds=4.0)
+    _record(records, winner_id=2, solve_seconds=2.5)
+    result = _record(records, winner_id=1, solve_seconds=3.0)
+    _record(records, winner_id=3, solve_seconds=1.0, guild_id=2)
+    assert result.personal_best
+    assert result.fastest_rank == 2
+    assert result.balance == 2 * result.credits
+
+    boards = {
+        board: records.top(1, board) for board in Board
+    }
+    assert boards[Board.FASTEST] == [(2, 2.5), (1, 3.0)]
+    assert boards[Board.WINS] == [(1, 2), (2, 1)]
+    assert records.top(2, Board.FASTEST) == [(3, 1.0)]
+
+    reloaded = GameRecords(db_path)
+    for board in Board:
+        assert reloaded.top(1, board) == boards[board]
+    assert reloaded.rank(1, Board.WINS, 2) == 2
+    assert reloaded.rank(3, Board.WINS, 2) is None
@@ -0,0 +1,116 @@
+import datetime
+import json
+import sqlite3
+
+import pytest
+
+from bababooey import history_import
+from bababooey.history_import import HistoryImporter, parse_log
+
+NUMS = {'bababooey': 0, 'airhorn': 1}
+
+
+@pytest.fixture(autouse=True)
+def no_pause(monkeypatch):
+    monkeypatch.setattr(history_import, 'BATCH_PAUSE_SECONDS', 0)
+
+
+def _line(second: int, name: str = 'bababooey', user_id: int = 7) -> str:
+    return f'2021-06-02 18:00:{second:02d},402 {user_id} 99 {name}\n'
+
+
+def _rows(db_path) -> list[tuple]:
+    con = sqlite3.connect(db_path)
+    try:
+        return con.execute('SELECT datetime, user_id, guild_id, num FROM '
+                           'user_history ORDER BY datetime').fetchall()
+    finally:
+        con.close()
+
+
+def test_parses_lines_and_counts_the_rest(tmp_path):
+    log = tmp_path / 'bot.log'
+    log.write_text(_line(1) + 'garbage\n' + _line(2, 'airhorn'))
+    stats = history_import.ImportStats()
+    plays = list(parse_log(str(log), stats=stats))
+    assert [play.name for play in plays] == ['bababooey', 'airhorn']
+    assert plays[0].played_at == datetime.datetime(
+        2021, 6, 2, 18, 0, 1, 402000, tzinfo=datetime.timezone.utc)
+    assert plays[-1].end_offset == log.stat().st_size
+    assert (stats.lines, stats.unparsable) == (3, 1)
+
+
+def test_resumes_from_the_checkpoint(tmp_path):
+    log = tmp_path / 'bot.log'
+    # Further apart than the duplicate tolerance.
+    log.write_text(''.join(_line(i * 5) for i in range(10)))
+    db_path = str(tmp_path / 'history.db')
+    checkpoint = str(tmp_path / 'checkpoint.json')
+
+    resolved = []
+
+    def crash_on_sixth(name: str) -> int:
+        if len(resolved) == 5:
+            raise KeyboardInterrupt()
+        resolved.append(name)
+        return NUMS[name]
+
+    importer = HistoryImporter(crash_on_sixth,
+                               db_path=db_path,
+                               checkpoint_path=checkpoint,
+                               batch_size=3)
+    with pytest.raises(KeyboardInterrupt):
+        importer.import_file(str(log))
+    importer.close()
+    # Only whole batches were committed.
+    assert len(_rows(db_path)) == 3
+
+    importer = HistoryImporter(NUMS.get,
+                               db_path=db_path,
+                               checkpoint_path=checkpoint,
+                               batch_size=3)
+    importer.import_file(str(log))
+    importer.close()
+    assert importer.stats.lines == 7
+    assert len(_rows(db_path)) == 10
+    with open(checkpoint) as f:
+        assert list(json.load(f).values()) == [log.stat().st_size]
+
+    # Nothing left to do the next time.
+    importer = HistoryImporter(NUMS.get,
+                               db_path=db_path,
+                               checkpoint_path=checkpoint)
+    importer.import_file(str(log))
+    importer.close()
+    assert importer.stats.lines == 0
+    assert len(_rows(db_path)) == 10
+
+
+def test_skips_plays_already_in_the_history(tmp_path):
+    db_path = str(tmp_path / 'history.db')
+    importer = HistoryImporter(NUMS.get, db_path=db_path)
+    importer.close()
+    con = sqlite3.connect(db_path)
+    with con:
+        # Recorded by the bot a second after the log line's time.
+        con.execute('INSERT INTO user_history VALUES(?, ?, ?, ?)',
+                    ('2021-06-02T18:00:02.000000+00:00', 7, 99, 0))
+    con.close()
+
+    log = tmp_path / 'bot.log'
+    log.write_text(
+        _line(1) +
+        # Someone else, and another sound, at the same time.
+        _line(1, user_id=8) + _line(1, 'airhorn') +
+        # Played twice in a row, both count.
+        _line(30) + _line(30) +
+        # Not a sound effect any more.
+        _line(40, 'deleted'))
+    importer = HistoryImporter(NUMS.get, db_path=db_path)
+    importer.import_file(str(log))
+    importer.close()
+
+    assert importer.stats.duplicates == 1
+    assert importer.stats.unknown_name == 1
+    assert importer.stats.inserted == 4
+    assert len(_rows(db_path)) == 5
@@ -0,0 +1,183 @@
+import asyncio
+import sys
+
+import pytest
+
+from bababooey.subprocess_scheduler import Priority, SubprocessScheduler, SupersededError
+
+
+def _sleep(seconds: float) -> list[str]:
+    return [sys.executable, '-c', f'import time; time.sleep({seconds})']
+
+
+def _echo(text: str) -> list[str]:
+    return [sys.executable, '-c', f'print({text!r})']
+
+
+async def _run_in_order(scheduler: SubprocessScheduler,
+                        jobs: list[tuple[str, Priority]]) -> list[str]:
+    """Queues the jobs behind one that fills the only free slot."""
+    finished = []
+
+    async def run(name: str, priority: Priority) -> None:
+        await scheduler.run(_echo(name), priority=priority, kind='test')
+        finished.append(name)
+
+    blocker = asyncio.create_task(
+        scheduler.run(_sleep(0.2), priority=Priority.BACKGROUND, kind='test'))
+    await asyncio.sleep(0)
+    await asyncio.gather(blocker, *(run(*job) for job in jobs))
+    return finished
+
+
+def test_runs_the_most_important_waiting_job_first():
+    scheduler = SubprocessScheduler(max_concurrent=2, reserved_for_playback=1)
+    finished = asyncio.run(
+        _run_in_order(scheduler, [('background', Priority.BACKGROUND),
+                                  ('preview', Priority.PREVIEW),
+                                  ('background 2', Priority.BACKGROUND)]))
+    assert finished == ['preview', 'background', 'background 2']
+
+
+def test_same_priority_runs_in_submission_order():
+    scheduler = SubprocessScheduler(max_concurrent=2, reserved_for_playback=1)
+    finished = asyncio.run(
+        _run_in_order(scheduler, [(str(i), Priority.PREVIEW) for i in range(4)]))
+    assert finished == ['0', '1', '2', '3']
+
+
+def test_playback_uses_the_reserved_slot():
+
+    async def main():
+        scheduler = SubprocessScheduler(max_concurrent=2,
+                                        reserved_for_playback=1)
+        background = asyncio.create_task(
+            scheduler.run(_sleep(2), priority=Priority.BACKGROUND, kind='test'))
+        await asyncio.sleep(0)
+        result = await asyncio.wait_for(
+            scheduler.run(_echo('played'),
+                          priority=Priority.PLAYBACK,
+                          kind='test'), 1.5)
+        assert not background.done()
+        background.cancel()
+        return result
+
+    assert asyncio.run(main()).stdout.strip() == b'played'
+
+
+def test_returns_output_and_exit_code():
+    scheduler = SubprocessScheduler()
+    result = asyncio.run(
+        scheduler.run(
+            [sys.executable, '-c', 'import sys; sys.stderr.write("e"); sys.exit(3)'],
+            priority=Priority.PREVIEW,
+            kind='test'))
+    assert result.returncode == 3
+    assert result.stderr == b'e'
+
+
+def test_supersedes_a_queued_job():
+
+    async def main():
+        scheduler = SubprocessScheduler(max_concurrent=2,
+                                        reserved_for_playback=1)
+        blocker = asyncio.create_task(
+            scheduler.run(_sleep(0.2), priority=Priority.PREVIEW, kind='test'))
+        await asyncio.sleep(0)
+        older = asyncio.create_task(
+            scheduler.run(_echo('older'),
+                          priority=Priority.PREVIEW,
+                          kind='test',
+                          supersede_key='key'))
+        await asyncio.sleep(0)
+        newer = await scheduler.run(_echo('newer'),
+                                    priority=Priority.PREVIEW,
+                                    kind='test',
+                                    supersede_key='key')
+        await blocker
+        with pytest.raises(SupersededError):
+            await older
+        return newer
+
+    assert asyncio.run(main()).stdout.strip() == b'newer'
+
+
+def test_supersedes_a_running_job():
+
+    async def main():
+        scheduler = SubprocessScheduler(max_concurrent=4)
+        older = asyncio.create_task(
+            scheduler.run(_sleep(10),
+                          priority=Priority.PREVIEW,
+                          kind='test',
+                          supersede_key='key'))
+        # Long enough for the process to start.
+        await asyncio.sleep(0.5)
+        newer = await scheduler.run(_echo('newer'),
+                                    priority=Priority.PREVIEW,
+                                    kind='test',
+                                    supersede_key='key')
+        with pytest.raises(SupersededError):
+            await asyncio.wait_for(older, 5)
+        return newer
+
+    assert asyncio.run(main()).stdout.strip() == b'newer'
+
+
+def test_timeout_kills_the_job_and_frees_its_slot():
+
+    async def main():
+        scheduler = SubprocessScheduler(max_concurrent=2,
+                                        reserved_for_playback=1)
+        with pytest.raises(TimeoutError):
+            await scheduler.run(_sleep(10),
+                                priority=Priority.BACKGROUND,
+                                kind='test',
+                                timeout=0.2)
+        return await asyncio.wait_for(
+            scheduler.run(_echo('next'),
+                          priority=Priority.BACKGROUND,
+                          kind='test'), 5)
+
+    assert asyncio.run(main()).stdout.strip() == b'next'
+
+
+def test_cancelled_while_waiting_gives_up_its_place():
+
+    async def main():
+        scheduler = SubprocessScheduler(max_concurrent=2,
+                                        reserved_for_playback=1)
+        blocker = asyncio.create_task(
+            scheduler.run(_sleep(0.2), priority=Priority.PREVIEW, kind='test'))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(
+            scheduler.run(_echo('cancelled'),
+                          priority=Priority.PREVIEW,
+                          kind='test'))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await blocker
+        return await asyncio.wait_for(
+            scheduler.run(_echo('next'), priority=Priority.PREVIEW,
+                          kind='test'), 5)
+
+    assert asyncio.run(main()).stdout.strip() == b'next'
+
+
+def test_claimed_playback_holds_back_other_jobs():
+
+    async def main():
+        scheduler = SubprocessScheduler(max_concurrent=2,
+                                        reserved_for_playback=1)
+        release = scheduler.claim_playback()
+        queued = asyncio.create_task(
+            scheduler.run(_echo('after'),
+                          priority=Priority.BACKGROUND,
+                          kind='test'))
+        await asyncio.sleep(0.1)
+        assert not queued.done()
+        # discord.py releases it from the player thread.
+        await asyncio.to_thread(release)
+        return await asyncio.wait_for(queued, 5)
+
+    assert asyncio.run(main()).stdout.strip() == b'after'